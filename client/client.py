@@ -1,4 +1,3 @@
-import threading
 from common import *
 from .platform_utils import Platform
 Platform.get_platform().configure_paths()
@@ -11,15 +10,16 @@ import sdl2.ext
 import time
 import uuid as uuid_lib
 import host.host as host
+import host.configuration as host_configuration
+from common.event_queue import EventQueue
 
 
 class Client(object):
     def __init__(self):
         self.logger = logging.getLogger("client")
         self.uuid = "client"
-        self.event_list = []
+        self.event_queue = EventQueue()
         self.event_handlers = {}
-        self.event_list_lock = threading.Lock()
         self.shutting_down = False
         self.message_bus = None
         self.local_message_bus = message_bus.LocalMessageBus(self.uuid)
@@ -28,6 +28,7 @@ class Client(object):
         self.host = None
         self.platform = Platform.get_platform()
         self.configuration = configuration.ClientConfiguration()
+        self.host_configuration = host_configuration.HostConfiguration()
         self.fps_counter = FPSCounter()
 
         self.register_event_handler(events.Quit, self.begin_shut_down)
@@ -44,10 +45,13 @@ class Client(object):
 
     def create_host(self, event):
         host_data = event.host_data
+        tick_rate = self.host_configuration.tick_rate.value()
         if host_data.local:
-            self.host = host.LocalHost(self.local_message_bus)
+            # the host simulates in its own process - the client talks to it over shared memory.
+            self.host = host.SharedMemoryHost(self.uuid, tick_rate=tick_rate)
+            self.local_message_bus = self.host.message_bus
         else:
-            self.host = host.MultiplayerHost(self.uuid, host_data.address[1])
+            self.host = host.MultiplayerHost(self.uuid, host_data.address[1], tick_rate=tick_rate)
 
     def start_message_bus(self, event):
         host_data = event.host_data
@@ -99,17 +103,14 @@ class Client(object):
                     self.event_handlers[key].remove(handler)
 
     def add_event(self, event):
-        with self.event_list_lock:
-            self.event_list.append(event)
+        self.event_queue.put(event)
 
     def get_events(self):
         sdl_events = sdl2.ext.get_events()
         events = []
         for sdl_event in sdl_events:
             events.append(self.convert_sdl2_event(sdl_event))
-        with self.event_list_lock:
-            events.extend(self.event_list)
-            self.event_list = []
+        events.extend(self.event_queue.drain())
         return events
 
     @staticmethod
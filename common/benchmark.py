@@ -0,0 +1,42 @@
+"""
+What every benchmark shares: the --json argument, and printing (and saving) the results.
+"""
+import json
+import platform
+import sys
+
+
+def add_json_argument(parser):
+    parser.add_argument("--json", help="Also write the results (and the environment they were measured in) to this file.")
+
+
+def print_results(results, precision=2):
+    """
+    Prints each result on its own line, as comma separated key=value pairs.
+
+    :param precision: the number of decimal places floats are printed with.
+    """
+    for result in results:
+        print(", ".join("%s=%s" % (key, ("%.*f" % (precision, value)) if isinstance(value, float) else value) for key, value in result.items()))
+
+
+def report(name, args, results, precision=2):
+    """
+    Prints the results, and writes them to the file named by the --json argument, if there is one, along with the
+    arguments and the environment they were measured in.
+
+    :param name: the benchmark's name, as written to the file.
+    :param args: the parsed arguments - functions (e.g. a subcommand's func) and the --json argument itself are
+        left out of the file.
+    :param results: a list of dictionaries.
+    """
+    print_results(results, precision)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({
+                'benchmark': name,
+                'arguments': dict((key, value) for (key, value) in vars(args).items() if key != 'json' and not callable(value)),
+                'python': sys.version,
+                'platform': platform.platform(),
+                'results': results,
+            }, json_file, indent=2)
@@ -22,6 +22,14 @@ class DestructableWall(Entity):
 
 
 class Bomb(Entity):
-    def __init__(self):
+    def __init__(self, position=(0, 0), range=1, detonates_at=0):
+        """
+        :param position: the (column, row) the bomb sits on.
+        :param range: how many cells its flames reach in each direction.
+        :param detonates_at: the tick it goes off on, unless another bomb's flames set it off first.
+        """
         super().__init__()
+        self.position = position
+        self.range = range
+        self.detonates_at = detonates_at
 
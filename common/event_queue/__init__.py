@@ -0,0 +1 @@
+from .event_queue import EventQueue
@@ -0,0 +1,106 @@
+"""
+Benchmarks for the event queue.
+
+Run with:  python -m common.event_queue.benchmark [--json FILE] [options]
+"""
+import argparse
+import threading
+import time
+from .event_queue import EventQueue
+from ..benchmark import add_json_argument, report
+
+
+class LockedEventList(object):
+    """
+    What Client and Host did before EventQueue - a list appended to and swapped out under a lock.  Kept here so the
+    benchmark has a baseline to compare against.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+
+    def put(self, event):
+        with self.lock:
+            self.events.append(event)
+        return True
+
+    def drain(self):
+        with self.lock:
+            to_return = self.events
+            self.events = []
+        return to_return
+
+
+QUEUES = {
+    'locked-list': LockedEventList,
+    'event-queue': EventQueue,
+}
+
+
+def run_queue(queue, producers, events_per_producer):
+    """
+    Starts the producers together, and drains on this thread until every event has come through.
+    """
+    barrier = threading.Barrier(producers + 1)
+    enqueue_times = [0.0] * producers
+
+    def produce(producer):
+        event = object()
+        barrier.wait()
+        start = time.perf_counter()
+        for _ in range(events_per_producer):
+            queue.put(event)
+        enqueue_times[producer] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=produce, args=(producer, )) for producer in range(producers)]
+    for thread in threads:
+        thread.start()
+
+    total = producers * events_per_producer
+    received = 0
+    drains = 0
+    drain_time = 0.0
+    barrier.wait()
+    start = time.perf_counter()
+    while received < total:
+        drain_start = time.perf_counter()
+        received += len(queue.drain())
+        drain_time += time.perf_counter() - drain_start
+        drains += 1
+    elapsed = time.perf_counter() - start
+    for thread in threads:
+        thread.join()
+
+    return {
+        'events_per_second': total / elapsed,
+        'enqueue_ns': sum(enqueue_times) / total * 1e9,
+        'drains': drains,
+        'drain_us': drain_time / drains * 1e6,
+    }
+
+
+def benchmark_event_queue(args):
+    results = []
+    for producers in args.producers:
+        for name in args.queues:
+            result = {'queue': name, 'producers': producers}
+            result.update(run_queue(QUEUES[name](), producers, args.events))
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare enqueue and drain throughput with several producer threads.")
+    add_json_argument(parser)
+    parser.add_argument("--producers", type=lambda value: [int(num) for num in value.split(",")], default=[1, 2, 4, 8],
+                        help="Comma separated producer thread counts.")
+    parser.add_argument("--queues", type=lambda value: value.split(","), default=sorted(QUEUES.keys()),
+                        help="Comma separated queues, out of: %s." % ", ".join(sorted(QUEUES.keys())))
+    parser.add_argument("--events", type=int, default=100000, help="Events per producer.")
+    args = parser.parse_args()
+    results = benchmark_event_queue(args)
+    report('event-queue', args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import collections
+
+
+class EventQueue(object):
+    def __init__(self, capacity=None):
+        """
+        A queue of events from any number of producer threads to a single consumer, which takes everything queued
+        at once.
+
+        Nothing here takes a lock: deque.append and deque.popleft are each atomic, so producers never wait on each
+        other or on the consumer.  Swapping in a fresh buffer would be cheaper still for the consumer, but a producer
+        that looked up the old buffer just before the swap would append to it after it had been handed off - so
+        drain pops what was queued when it was called, leaving anything that arrives meanwhile for the next drain.
+
+        :param capacity: if set, put refuses events once this many are waiting.  Producers racing each other can
+            overshoot it by one each - it's a bound on memory, not an exact limit.
+        """
+        self.capacity = capacity
+        self.events = collections.deque()
+        self.dropped = 0
+
+    def put(self, event):
+        """
+        :return: False if the queue is full, and the event was dropped.
+        """
+        if self.capacity is not None and len(self.events) >= self.capacity:
+            self.dropped += 1
+            return False
+        self.events.append(event)
+        return True
+
+    def drain(self):
+        """
+        Consumer side - only one thread should call this.
+
+        :return: a list of every event queued before the call, oldest first.
+        """
+        events = self.events
+        return [events.popleft() for _ in range(len(events))]
+
+    def __len__(self):
+        return len(self.events)
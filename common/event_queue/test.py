@@ -0,0 +1,46 @@
+import threading
+import unittest
+from . import *
+
+
+class TestEventQueue(unittest.TestCase):
+    def testDrainReturnsEventsInOrder(self):
+        queue = EventQueue()
+        for num in range(5):
+            queue.put(num)
+        self.assertEqual(queue.drain(), [0, 1, 2, 3, 4])
+        self.assertEqual(queue.drain(), [])
+        self.assertEqual(len(queue), 0)
+
+    def testCapacity(self):
+        queue = EventQueue(capacity=2)
+        self.assertTrue(queue.put(0))
+        self.assertTrue(queue.put(1))
+        self.assertFalse(queue.put(2))
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(queue.drain(), [0, 1])
+        self.assertTrue(queue.put(3))
+
+    def testConcurrentProducers(self):
+        queue = EventQueue()
+        producers = 4
+        events_per_producer = 10000
+
+        def produce(producer):
+            for num in range(events_per_producer):
+                queue.put((producer, num))
+
+        threads = [threading.Thread(target=produce, args=(producer, )) for producer in range(producers)]
+        for thread in threads:
+            thread.start()
+        received = []
+        while any(thread.is_alive() for thread in threads):
+            received.extend(queue.drain())
+        for thread in threads:
+            thread.join()
+        received.extend(queue.drain())
+
+        self.assertEqual(len(received), producers * events_per_producer)
+        # nothing lost or duplicated, and each producer's events stay in order.
+        for producer in range(producers):
+            self.assertEqual([num for (source, num) in received if source == producer], list(range(events_per_producer)))
@@ -0,0 +1,139 @@
+"""
+Compares the memory and speed of the byte-per-cell map against the list-of-lists of spawns it replaced.
+
+Run with:  python -m common.maps.benchmark [--json FILE] [options]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from .maps import Map
+from .spawns import *
+from ..benchmark import add_json_argument, report
+
+
+class LegacyMap(object):
+    """
+    What Map did before it stored tile codes - a spawn object per cell, in nested lists, and every query a nested
+    loop.  Kept here so the benchmark has a baseline to compare against.
+    """
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.grid = [[None for _ in range(0, self.dimensions[0])] for _ in range(self.dimensions[1])]
+
+    def add_spawn(self, spawn, pos):
+        self.grid[pos[1]][pos[0]] = spawn
+
+    def count(self, spawn_class):
+        return sum(1 for row in self.grid for space in row if isinstance(space, spawn_class))
+
+    def positions(self, spawn_class):
+        return [(col, row) for (row, spaces) in enumerate(self.grid) for (col, space) in enumerate(spaces) if isinstance(space, spawn_class)]
+
+    def neighbor_mask(self, spawn_class):
+        (width, height) = self.dimensions
+        to_return = bytearray(width * height)
+        for row in range(height):
+            for col in range(width):
+                bits = 0
+                if row > 0 and isinstance(self.grid[row - 1][col], spawn_class):
+                    bits |= Map.NORTH
+                if col < width - 1 and isinstance(self.grid[row][col + 1], spawn_class):
+                    bits |= Map.EAST
+                if row < height - 1 and isinstance(self.grid[row + 1][col], spawn_class):
+                    bits |= Map.SOUTH
+                if col > 0 and isinstance(self.grid[row][col - 1], spawn_class):
+                    bits |= Map.WEST
+                to_return[row * width + col] = bits
+        return to_return
+
+
+def layout(dimensions, seed):
+    """
+    :return: a classic Bomberman layout as (spawn class, position) pairs - indestructable walls on every other
+        cell, destructable walls on most of the rest, and a player in each corner.
+    """
+    generator = random.Random(seed)
+    (width, height) = dimensions
+    to_return = []
+    for row in range(height):
+        for col in range(width):
+            if col % 2 and row % 2:
+                to_return.append((IndestructableWallSpawn, (col, row)))
+            elif generator.random() < 0.6:
+                to_return.append((DestructableWallSpawn, (col, row)))
+    for corner in [(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)]:
+        to_return.append((PlayerSpawn, corner))
+    return to_return
+
+
+def measure(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = func()
+    return (time.perf_counter() - start) / iterations * 1e3, result
+
+
+def build(create, dimensions, spawns):
+    game_map = create(dimensions)
+    for (spawn_class, position) in spawns:
+        game_map.add_spawn(spawn_class(), position)
+    return game_map
+
+
+def run_map(name, create, dimensions, spawns, args):
+    # tracing allocations slows them down - time one build, and measure the memory of another.
+    gc.collect()
+    start = time.perf_counter()
+    game_map = build(create, dimensions, spawns)
+    build_ms = (time.perf_counter() - start) * 1e3
+    del game_map
+    gc.collect()
+    tracemalloc.start()
+    game_map = build(create, dimensions, spawns)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # big maps take the legacy map seconds per query - fewer iterations keep the run short.
+    iterations = max(1, args.iterations * 15 * 13 // (dimensions[0] * dimensions[1]))
+    (count_ms, _) = measure(lambda: game_map.count(DestructableWallSpawn), iterations)
+    (positions_ms, _) = measure(lambda: game_map.positions(PlayerSpawn), iterations)
+    (neighbors_ms, neighbors) = measure(lambda: game_map.neighbor_mask(DestructableWallSpawn), iterations)
+    return {
+        'map': name,
+        'dimensions': "%dx%d" % dimensions,
+        'memory_kb': memory / 1024.0,
+        'build_ms': build_ms,
+        'count_ms': count_ms,
+        'positions_ms': positions_ms,
+        'neighbor_mask_ms': neighbors_ms,
+    }, neighbors
+
+
+def benchmark_maps(args):
+    results = []
+    for dimensions in args.dimensions:
+        spawns = layout(dimensions, args.seed)
+        (legacy, legacy_neighbors) = run_map("legacy", LegacyMap, dimensions, spawns, args)
+        (compact, compact_neighbors) = run_map("compact", lambda dimensions: Map("benchmark", dimensions), dimensions, spawns, args)
+        if legacy_neighbors != compact_neighbors:
+            raise Exception("Neighbor masks differ on a %dx%d map." % dimensions)
+        results.extend([legacy, compact])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare map memory and query speed.")
+    add_json_argument(parser)
+    parser.add_argument("--dimensions", type=lambda value: [tuple(int(num) for num in size.split("x")) for size in value.split(",")],
+                        default=[(15, 13), (64, 64), (256, 256), (1024, 1024)], help="Comma separated map sizes, e.g. 15x13,64x64.")
+    parser.add_argument("--iterations", type=int, default=1000, help="Query iterations on a 15x13 map - scaled down for bigger maps.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = benchmark_maps(args)
+    report('maps', args, results, precision=3)
+
+
+if __name__ == "__main__":
+    main()
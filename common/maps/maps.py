@@ -110,6 +110,22 @@ class JSONMapLoader(MapLoader, TextSpawnConverter):
 
 
 class Map(object):
+    """
+    The grid is stored as one byte per cell - a tile code - rather than as a list of lists of spawn objects.  Each
+    spawn class is represented by a single shared instance, so reading a cell never allocates, and whole-map queries
+    (count, positions, mask, neighbor_mask) run as bytes and integer operations in C rather than as nested loops.
+    """
+    # tile code to spawn class - the code is the index.
+    SPAWN_CLASSES = [None.__class__, PlayerSpawn, IndestructableWallSpawn, DestructableWallSpawn]
+    CODES = dict((spawn_class, code) for (code, spawn_class) in enumerate(SPAWN_CLASSES))
+    SPAWNS = [spawn_class() for spawn_class in SPAWN_CLASSES]
+
+    # bits set in neighbor_mask for each direction.
+    NORTH = 1
+    EAST = 2
+    SOUTH = 4
+    WEST = 8
+
     def __init__(self, name, dimensions):
         name = name.strip()
         if not name:
@@ -118,19 +134,21 @@ class Map(object):
             raise MapLoaderException("Invalid map dimensions: %s - expecting tuple of two positive integers" % str(dimensions))
 
         self.dimensions = dimensions
-        self.grid = [[None for _ in range(0, self.dimensions[0])] for _ in range(self.dimensions[1])]
+        self.tiles = bytearray(self.dimensions[0] * self.dimensions[1])
         self.name = name
 
+    @property
+    def grid(self):
+        """
+        The map as rows of spawns (or None), indexed [row][column].  This is a copy - use add_spawn to change it.
+        """
+        width = self.dimensions[0]
+        spawns = self.SPAWNS
+        return [[spawns[code] for code in self.tiles[offset:offset + width]] for offset in range(0, len(self.tiles), width)]
+
     def validate(self):
-        # count number of player spawns
-        # we need at least two otherwise there won't be a game to be had.
-        player_spawns = 0
-        for row in self.grid:
-            for space in row:
-                if isinstance(space, PlayerSpawn):
-                    player_spawns += 1
-
-        if player_spawns < 2:
+        # we need at least two player spawns otherwise there won't be a game to be had.
+        if self.count(PlayerSpawn) < 2:
             raise MapLoaderException("Map needs at least two player spawns.")
 
     def add_spawn(self, spawn, pos):
@@ -139,7 +157,70 @@ class Map(object):
         if col_index < 0 or col_index >= self.dimensions[0] or row_index < 0 or row_index >= self.dimensions[1]:
             raise MapLoaderException("Spawn location %s must be within (0, 0) and %s." % (str(pos), str(self.dimensions)))
 
-        self.grid[row_index][col_index] = spawn
+        code = self.CODES.get(spawn.__class__)
+        if code is None:
+            raise MapLoaderException("Class %s is unrecognized and cannot be placed on a map." % spawn.__class__)
+        self.tiles[row_index * self.dimensions[0] + col_index] = code
+
+    def get_spawn(self, pos):
+        return self.SPAWNS[self.tiles[pos[1] * self.dimensions[0] + pos[0]]]
+
+    @classmethod
+    def code(cls, spawn_class):
+        """
+        :param spawn_class: a Spawn class, or None for empty cells.
+        """
+        if spawn_class is None:
+            spawn_class = None.__class__
+        if spawn_class not in cls.CODES:
+            raise MapLoaderException("Class %s is unrecognized and cannot be placed on a map." % spawn_class)
+        return cls.CODES[spawn_class]
+
+    def count(self, spawn_class):
+        return self.tiles.count(self.code(spawn_class))
+
+    def positions(self, spawn_class):
+        """
+        :return: the (column, row) of every cell holding spawn_class, in row order.
+        """
+        code = self.code(spawn_class)
+        width = self.dimensions[0]
+        to_return = []
+        index = self.tiles.find(code)
+        while index != -1:
+            to_return.append((index % width, index // width))
+            index = self.tiles.find(code, index + 1)
+        return to_return
+
+    def mask(self, spawn_class):
+        """
+        :return: a bytearray with a byte per cell, in the same order as tiles - 1 where the cell holds spawn_class,
+            0 elsewhere.
+        """
+        table = bytearray(256)
+        table[self.code(spawn_class)] = 1
+        return self.tiles.translate(table)
+
+    def neighbor_mask(self, spawn_class):
+        """
+        :return: a bytearray with a byte per cell, in the same order as tiles, with NORTH/EAST/SOUTH/WEST set for
+            each neighbor that holds spawn_class.  Cells off the edge of the map are never anything.
+        """
+        (width, height) = self.dimensions
+        size = width * height
+        # the whole mask as one integer, a byte per cell - shifting it by a byte moves every cell one column over,
+        # and shifting it by a row's worth of bytes moves every cell one row over.
+        cells = int.from_bytes(self.mask(spawn_class), 'little')
+        everything = (1 << (8 * size)) - 1
+        not_first_column = int.from_bytes((b'\x00' + b'\x01' * (width - 1)) * height, 'little')
+        not_last_column = int.from_bytes((b'\x01' * (width - 1) + b'\x00') * height, 'little')
+
+        north = (cells << (8 * width)) & everything
+        south = cells >> (8 * width)
+        east = (cells >> 8) & not_last_column
+        west = (cells << 8) & not_first_column
+        neighbors = north * self.NORTH | east * self.EAST | south * self.SOUTH | west * self.WEST
+        return bytearray(neighbors.to_bytes(size, 'little'))
 
 
 class MapLoaderException(Exception):
@@ -50,6 +50,25 @@ class TestMap(unittest.TestCase):
         self.assertEquals(map.grid[0][0], player_one)
         self.assertEquals(map.grid[0][1], player_two)
 
+    def testQueries(self):
+        map = Map(name="test", dimensions=(3, 2))
+        map.add_spawn(PlayerSpawn(), (0, 0))
+        map.add_spawn(DestructableWallSpawn(), (1, 0))
+        map.add_spawn(PlayerSpawn(), (2, 1))
+        self.assertEqual(map.count(PlayerSpawn), 2)
+        self.assertEqual(map.count(None), 3)
+        self.assertEqual(map.positions(PlayerSpawn), [(0, 0), (2, 1)])
+        self.assertEqual(map.get_spawn((1, 0)), DestructableWallSpawn())
+        self.assertIsNone(map.get_spawn((1, 1)))
+        self.assertEqual(list(map.mask(PlayerSpawn)), [1, 0, 0, 0, 0, 1])
+        self.assertEqual(list(map.neighbor_mask(PlayerSpawn)), [0, Map.WEST, Map.SOUTH, Map.NORTH, Map.EAST, 0])
+        self.assertEqual(list(map.neighbor_mask(DestructableWallSpawn)), [Map.EAST, 0, Map.WEST, 0, Map.NORTH, 0])
+
+    def testUnknownSpawn(self):
+        map = Map(name="test", dimensions=(1, 1))
+        with self.assertRaises(MapLoaderException):
+            map.add_spawn(object(), (0, 0))
+
 
 class BaseMapLoaderTest(unittest.TestCase):
     def setUp(self):
@@ -1,2 +1,4 @@
 from .message_bus import ClientNetworkedMessageBus, HostNetworkedMessageBus, LocalMessageBus
+from .async_message_bus import AsyncClientNetworkedMessageBus, AsyncHostNetworkedMessageBus
+from .shared_memory import SharedMemoryMessageBus
 from .messages import *
@@ -0,0 +1,363 @@
+import asyncio
+import socket
+import time
+from .messages import *
+from .message_bus import DEFAULT_HANDSHAKE_TIMEOUT, DEFAULT_REQUEST_TIMEOUT, ClientNotFoundException, HandshakeException, MessageBus, Request
+from .codec import CodecException, create_codec
+from .compression import CompressionException
+from .framing import Frame, FrameHeader, FramingException, encode_frame, split_frames
+from ..app_logging import logging
+
+
+class AsyncNetworkedMessageBus(MessageBus):
+    def __init__(self, bus_uuid):
+        """
+        An asyncio counterpart to NetworkedMessageBus.
+
+        Handlers are registered exactly like they are on the threaded buses (register_data_handler/data_handler),
+        and may additionally be coroutine functions, in which case they're awaited.  Everything runs on the event
+        loop that started the bus - there are no threads involved.
+
+        :param bus_uuid: the UUID of the class that spawned this - connections are tagged by UUID.
+        """
+        super().__init__(bus_uuid)
+        self.shutting_down = False
+        self.codec = create_codec()
+        self.connections_by_id = {}
+        self.connections_by_target_address = {}
+        self.pending_requests = {}
+        self.handshake_timeout = DEFAULT_HANDSHAKE_TIMEOUT
+
+        self.register_data_handler(Identify, self.identify)
+        self.register_data_handler(BaseResponse, self.on_response)
+
+    async def start(self, *args):
+        super().start()
+        self.shutting_down = False
+
+    async def send(self, message, target_address=None, blocking=True, timeout=DEFAULT_REQUEST_TIMEOUT):
+        """
+        Sends a message to connected clients (via broadcast).
+
+        :param message: Any message the bus' codec can encode.
+        :param target_address: If we're trying to communicate with a non-identified connection, we can specify a target
+            address instead.
+        :param blocking: If set, waits until every recipient has answered with a RequestSuccess/RequestFail.
+        :param timeout: seconds to wait for responses before the request's pending connections time out.
+        :return: the AsyncRequest tracking the message's responses.
+        """
+        connections = self.get(target_address)
+        if blocking and any(connection.reader_task is asyncio.current_task() for connection in connections):
+            # the responses would be read by the very task we'd be blocking.
+            self.logger.warning("Blocking send of %s from a connection's reader task - sending without blocking." % message.__class__.__name__)
+            blocking = False
+        request = AsyncRequest(message, connections)
+        if message.requires_response and request.connections:
+            if message.uuid in self.pending_requests:
+                raise Exception("Resending a pending request?")
+            self.pending_requests[message.uuid] = request
+            request.expire_after(timeout, lambda: self.pending_requests.pop(message.uuid, None))
+        else:
+            request.complete()
+
+        for connection in connections:
+            connection.send(message)
+        for connection in connections:
+            await connection.drain()
+
+        if blocking:
+            await request
+        return request
+
+    async def stop(self):
+        super().stop()
+        self.shutting_down = True
+        for connection in list(self.connections_by_target_address.values()):
+            await self.close(connection)
+
+    def get(self, target_address=None):
+        if target_address is None:
+            return list(self.connections_by_id.values())
+        if target_address not in self.connections_by_target_address:
+            raise ClientNotFoundException(client_target_address=target_address)
+        return [self.connections_by_target_address[target_address]]
+
+    async def open(self, reader, writer):
+        connection = AsyncConnection(self, reader, writer)
+        self.connections_by_target_address[connection.target_address] = connection
+        self.logger.debug("Accepted connection with %s" % str(connection.target_address))
+        connection.start()
+        await self.send(Identify(self.uuid, connection.source_address), target_address=connection.target_address, blocking=False)
+        return connection
+
+    async def close(self, connection):
+        if self.connections_by_id.get(connection.remote_uuid) is connection:
+            self.connections_by_id.pop(connection.remote_uuid)
+        self.connections_by_target_address.pop(connection.target_address, None)
+        self.notify(connection)
+        await connection.close()
+
+    def notify(self, connection):
+        """
+        Tells every pending request that a connection won't be answering, completing those that have nothing else
+        left to wait on.
+        """
+        for request in list(self.pending_requests.values()):
+            request.notify(connection)
+            if request.done():
+                self.pending_requests.pop(request.message.uuid)
+
+    def identify(self, request, connection):
+        connection.remote_uuid = request.client_id
+        self.connections_by_id[connection.remote_uuid] = connection
+        self.logger.debug("Identified %s:%d as %s" % (connection.target_address[0], connection.target_address[1], connection.remote_uuid))
+
+    def on_response(self, data, connection):
+        if data.request_id in self.pending_requests:
+            request = self.pending_requests[data.request_id]
+            request.notify(connection, data)
+            if request.done():
+                self.pending_requests.pop(data.request_id)
+
+    async def handle_data(self, data, connection):
+        start = time.perf_counter()
+        try:
+            for (handler, wants_connection) in self.dispatch_table.resolve(data.__class__):
+                if wants_connection:
+                    result = handler(data, connection)
+                else:
+                    result = handler(data)
+                if asyncio.iscoroutine(result):
+                    await result
+        finally:
+            self.dispatch_table.record(data.__class__, time.perf_counter() - start)
+        if isinstance(data, Identify):
+            connection.handshake.set()
+
+
+class AsyncClientNetworkedMessageBus(AsyncNetworkedMessageBus):
+    def __init__(self, bus_uuid):
+        """
+        Connects to a host when started, and doesn't return from start until both sides have identified.
+        """
+        super().__init__(bus_uuid)
+        self.host_address = None
+
+    async def start(self, host_address):
+        await super().start()
+        self.host_address = host_address
+        (reader, writer) = await asyncio.open_connection(host_address[0], host_address[1])
+        connection = await self.open(reader, writer)
+        try:
+            await asyncio.wait_for(connection.handshake.wait(), self.handshake_timeout)
+        except asyncio.TimeoutError:
+            await self.close(connection)
+            raise HandshakeException(connection.target_address)
+
+    async def stop(self):
+        await super().stop()
+        self.logger.info("async client networked message bus stopped")
+
+
+class AsyncHostNetworkedMessageBus(AsyncNetworkedMessageBus):
+    def __init__(self, bus_uuid, host_port):
+        """
+        Listens for new connections with an asyncio server - each accepted client is just another task on the
+        event loop, so a single loop can serve many hosts.
+        """
+        super().__init__(bus_uuid)
+        self.listener_address = (socket.gethostname(), host_port)
+        self.server = None
+
+    async def start(self):
+        await super().start()
+        self.server = await asyncio.start_server(self._on_client_connected, port=self.listener_address[1], reuse_address=True)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        await super().stop()
+        self.logger.info("async host networked message bus stopped")
+
+    async def _on_client_connected(self, reader, writer):
+        if self.shutting_down:
+            writer.close()
+            return
+        await self.open(reader, writer)
+
+
+class AsyncConnection(object):
+    def __init__(self, bus, reader, writer, max_frame_size=64 * 1024 * 1024):
+        """
+        Wraps an asyncio stream pair.  Frames are written straight to the stream's transport, and a reader task
+        reads frames off of the stream and hands them to the bus.
+
+        :param max_frame_size: frames announcing a larger size close the connection rather than being read - the
+            same limit as the threaded buses' ReceiveBuffer.
+        """
+        self.logger = logging.getLogger("%s-connection" % bus.uuid)
+        self.bus = bus
+        self.reader = reader
+        self.writer = writer
+        self.max_frame_size = max_frame_size
+        self.remote_uuid = None
+        self.shutting_down = False
+        self.handshake = asyncio.Event()
+        self.reader_task = None
+
+        self.source_address = writer.get_extra_info('sockname')
+        self.target_address = writer.get_extra_info('peername')
+
+    def start(self):
+        self.reader_task = asyncio.ensure_future(self._receive())
+
+    def send(self, message):
+        if self.shutting_down:
+            return
+        (type_id, payload) = self.bus.codec.encode(message)
+        self.writer.writelines(encode_frame(payload, type_id))
+
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def close(self):
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        self.writer.close()
+        if self.reader_task is not None and self.reader_task is not asyncio.current_task():
+            self.reader_task.cancel()
+            try:
+                await self.reader_task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _receive(self):
+        try:
+            while not self.shutting_down:
+                header = await self.reader.readexactly(FrameHeader.SIZE)
+                (length, type_id, flags) = FrameHeader.unpack_from(header)
+                if length > self.max_frame_size:
+                    raise FramingException("Frame of %d bytes exceeds the maximum of %d bytes." % (length, self.max_frame_size))
+                payload = await self.reader.readexactly(length)
+                for data in self._decode_frames([Frame(type_id, flags, payload)]):
+                    await self._process_data(data)
+        except FramingException as e:
+            # there's no way to resynchronize with the stream.
+            self.logger.error(str(e))
+            if not self.shutting_down:
+                await self.bus.close(self)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            if not self.shutting_down:
+                self.logger.info("Socket unexpectedly closed")
+                await self.bus.close(self)
+
+    def _decode_frames(self, frames):
+        """
+        Frames are length-prefixed, so a payload we can't decode doesn't corrupt the rest of the stream - we log
+        and drop it.  Flags we don't know do, though, since we can't tell what the payload holds - those raise a
+        FramingException.
+        """
+        to_return = []
+        for frame in frames:
+            if frame.flags & ~FrameHeader.KNOWN_FLAGS:
+                raise FramingException("Received a frame with unsupported flags 0x%04x." % frame.flags)
+            if frame.flags & FrameHeader.FLAG_BATCH:
+                try:
+                    batch = split_frames(frame.payload)
+                except FramingException as e:
+                    self.logger.error(str(e))
+                    continue
+                to_return.extend(self._decode_frames(batch))
+                continue
+            try:
+                if frame.flags & FrameHeader.FLAG_COMPRESSED:
+                    # compression is never offered in this bus' handshake, so no peer should be sending these.
+                    raise CompressionException("Received a compressed frame, but compression isn't enabled.")
+                to_return.append(self.bus.codec.decode(frame.type_id, frame.payload))
+            except (CodecException, CompressionException) as e:
+                self.logger.error(str(e))
+        return to_return
+
+    async def _process_data(self, data):
+        error = None
+        try:
+            await self.bus.handle_data(data, self)
+        except Exception as e:
+            self.logger.error(str(e))
+            error = str(e)
+        # most traffic isn't answered, so responses are only built when needed.
+        if data.requires_response:
+            self.send(RequestSuccess(data.uuid) if error is None else RequestFail(data.uuid, error))
+
+
+class AsyncRequest(object):
+    """
+    The awaitable counterpart to Request - awaiting it resolves once every connection the message was sent to has
+    answered, gone away, or run out of time.
+
+    Responses are kept per connection, so callers can tell RequestSuccess apart from RequestFail, and each
+    connection ends up with the same status a Request would give it.
+    """
+    def __init__(self, message, connections):
+        self.message = message
+        self.connections = dict((connection, 1) for connection in connections)
+        self.statuses = dict((connection, Request.PENDING) for connection in connections)
+        self.responses = {}
+        self.future = asyncio.get_running_loop().create_future()
+        self.timer = None
+
+    def __await__(self):
+        return self.future.__await__()
+
+    def done(self):
+        return self.future.done()
+
+    def complete(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.future.done():
+            self.future.set_result(self)
+
+    def expire_after(self, timeout, callback):
+        """
+        Times out every connection still pending after timeout seconds, completing the request.
+
+        :param callback: called once the request is done, however it completed.
+        """
+        self.future.add_done_callback(lambda future: callback())
+        if timeout is not None and not self.done():
+            self.timer = asyncio.get_running_loop().call_later(timeout, self.expire)
+
+    def expire(self):
+        self.timer = None
+        for connection in self.connections:
+            self.statuses[connection] = Request.TIMED_OUT
+        self.connections.clear()
+        self.complete()
+
+    def failures(self):
+        return dict((connection, response) for (connection, response) in self.responses.items() if isinstance(response, RequestFail))
+
+    def notify(self, connection, response=None):
+        if connection in self.connections:
+            self.connections.pop(connection)
+            self.responses[connection] = response
+            if response is None:
+                self.statuses[connection] = Request.CLOSED
+            elif isinstance(response, RequestFail):
+                self.statuses[connection] = Request.FAILED
+            else:
+                self.statuses[connection] = Request.SUCCEEDED
+        if len(self.connections) == 0:
+            self.complete()
@@ -0,0 +1,480 @@
+"""
+Benchmarks for the messaging layer.
+
+Run with:  python -m common.messaging.benchmark [--json FILE] <benchmark> [options]
+"""
+import argparse
+import pickle
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+import uuid
+from .messages import *
+from .codec import create_codec
+from .compression import LzmaCompressor, ZlibCompressor, ZlibDictionaryCompressor, train_dictionary
+from .framing import FrameBuffer, ReceiveBuffer, encode_frame, send_buffers
+from .message_bus import ClientNetworkedMessageBus, ConnectionException, HostNetworkedMessageBus, Request
+from ..app_logging import logging
+from ..benchmark import add_json_argument, report
+try:
+    import resource
+except ImportError:
+    # not available on Windows - max_rss_kb isn't reported there.
+    resource = None
+
+
+class LegacyIncomingRequest(object):
+    """
+    Reproduces the header the message bus used before frames were introduced - a whole pickled object whose only
+    job was to carry a 4-byte size.  Kept here so that the framing benchmark has a baseline to compare against.
+    """
+    def __init__(self, size):
+        self.uuid = str(uuid.uuid4())
+        self.requires_response = False
+        self.size = size
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['size'] = struct.pack('!I', self.size)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.size = struct.unpack('!I', self.size)[0]
+
+
+class LegacyTransport(object):
+    name = "legacy"
+
+    def __init__(self):
+        self.header_size = len(pickle.dumps(LegacyIncomingRequest(0)))
+
+    def send(self, sock, message):
+        payload = pickle.dumps(message)
+        header = pickle.dumps(LegacyIncomingRequest(len(payload)))
+        sock.sendall(header)
+        sock.sendall(payload)
+        return len(header) + len(payload)
+
+    def receive(self, sock, count):
+        received = 0
+        while received < count:
+            header = pickle.loads(self._recv_exactly(sock, self.header_size))
+            pickle.loads(self._recv_exactly(sock, header.size))
+            received += 1
+
+    @staticmethod
+    def _recv_exactly(sock, size):
+        # the legacy receiver assumed a single recv returned everything - looping here keeps the benchmark from
+        # crashing on a short read, which only flatters the baseline.
+        chunks = []
+        while size:
+            chunk = sock.recv(size)
+            if not chunk:
+                raise EOFError()
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
+class FramedTransport(object):
+    name = "framed"
+
+    def send(self, sock, message):
+        buffers = encode_frame(pickle.dumps(message), message.type_id)
+        send_buffers(sock, buffers)
+        return sum(len(buffer) for buffer in buffers)
+
+    def receive(self, sock, count):
+        frame_buffer = FrameBuffer()
+        received = 0
+        while received < count:
+            data = sock.recv(65536)
+            if not data:
+                raise EOFError()
+            frame_buffer.feed(data)
+            for frame in frame_buffer.frames():
+                pickle.loads(frame.payload)
+                received += 1
+
+
+def run_transport(transport, messages):
+    sender, receiver = socket.socketpair()
+    receive_thread = threading.Thread(name="benchmark-receiver", target=transport.receive, args=(receiver, len(messages)))
+    try:
+        start = time.perf_counter()
+        receive_thread.start()
+        sent_bytes = 0
+        for message in messages:
+            sent_bytes += transport.send(sender, message)
+        receive_thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        sender.close()
+        receiver.close()
+    return {
+        'transport': transport.name,
+        'messages': len(messages),
+        'messages_per_second': len(messages) / elapsed,
+        'bytes_per_message': sent_bytes / len(messages),
+    }
+
+
+def benchmark_framing(args):
+    messages = [Print("message %d" % num) for num in range(0, args.messages)]
+    return [run_transport(transport, messages) for transport in (LegacyTransport(), FramedTransport())]
+
+
+def sample_messages():
+    from ..configuration import GameConfiguration
+    from ..maps import Map, PlayerSpawn, DestructableWallSpawn, IndestructableWallSpawn
+
+    game_map = Map(name="benchmark", dimensions=(15, 13))
+    for row in range(0, 13):
+        for col in range(0, 15):
+            if row % 2 and col % 2:
+                game_map.add_spawn(IndestructableWallSpawn(), (col, row))
+            elif (row + col) % 3 == 0:
+                game_map.add_spawn(DestructableWallSpawn(), (col, row))
+    game_map.add_spawn(PlayerSpawn(), (0, 0))
+    game_map.add_spawn(PlayerSpawn(), (14, 12))
+
+    request = Print("Host says hi.")
+    return [
+        request,
+        Identify("client-0", ("127.0.0.1", 40000)),
+        RequestSuccess(request.uuid),
+        RequestFail(request.uuid, "Request failed."),
+        CreateGame("client-0", GameConfiguration(game_map, 4, 2)),
+    ]
+
+
+def time_per_call(func, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(0, iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def benchmark_codec(args):
+    codec = create_codec()
+    results = []
+    for message in sample_messages():
+        encoded = codec.encode(message)
+        pickled = pickle.dumps(message)
+        results.append({
+            'message': message.__class__.__name__,
+            'codec_bytes': len(encoded[1]),
+            'pickle_bytes': len(pickled),
+            'codec_encode_us': time_per_call(codec.encode, message, args.iterations),
+            'pickle_encode_us': time_per_call(pickle.dumps, message, args.iterations),
+            'codec_decode_us': time_per_call(lambda payload: codec.decode(encoded[0], payload), encoded[1], args.iterations),
+            'pickle_decode_us': time_per_call(pickle.loads, pickled, args.iterations),
+        })
+    return results
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class BusWorkload(object):
+    """
+    A message mix driven through a host and its clients.  Every message requires a response, so each send's
+    round trip is measured from the send until the request was done.
+    """
+    def __init__(self, name, messages):
+        self.name = name
+        self.messages = messages
+
+    def send(self, host, clients, num):
+        raise NotImplementedError()
+
+    def deliveries(self, clients):
+        """
+        :return: how many messages are delivered per send.
+        """
+        return 1
+
+
+class BroadcastWorkload(BusWorkload):
+    def __init__(self, messages):
+        super().__init__("broadcast", messages)
+
+    def send(self, host, clients, num):
+        return host.send(Print("Host says %d." % num), blocking=False)
+
+    def deliveries(self, clients):
+        return len(clients)
+
+
+class ClientRequestWorkload(BusWorkload):
+    def __init__(self, messages):
+        super().__init__("client-requests", messages)
+
+    def send(self, host, clients, num):
+        return clients[num % len(clients)].send(Print("Client says %d." % num), blocking=False)
+
+
+class CreateGameWorkload(BroadcastWorkload):
+    def __init__(self, messages):
+        super().__init__(messages)
+        self.name = "create-game"
+        self.message = sample_messages()[-1]
+
+    def send(self, host, clients, num):
+        return host.send(CreateGame(self.message.client_id, self.message.configuration), blocking=False)
+
+
+WORKLOADS = {
+    "broadcast": BroadcastWorkload,
+    "client-requests": ClientRequestWorkload,
+    "create-game": CreateGameWorkload,
+}
+
+
+def run_workload(workload, host, clients):
+    requests = []
+    cpu_start = time.process_time()
+    start = time.monotonic()
+    for num in range(0, workload.messages):
+        sent_at = time.monotonic()
+        requests.append((sent_at, workload.send(host, clients, num)))
+    latencies = []
+    delivered = 0
+    for (sent_at, request) in requests:
+        statuses = request.result()
+        latencies.append(request.completed_at - sent_at)
+        delivered += sum(1 for status in statuses.values() if status == Request.SUCCEEDED)
+    elapsed = time.monotonic() - start
+    # every bus lives in this process, so process time covers both ends of each message.
+    messages = workload.messages * workload.deliveries(clients)
+    return {
+        'workload': workload.name,
+        'clients': len(clients),
+        'messages': messages,
+        # only messages acknowledged with a RequestSuccess count as delivered - failed, timed out and closed don't.
+        'failed': messages - delivered,
+        'messages_per_second': delivered / elapsed,
+        'p50_round_trip_ms': percentile(latencies, 0.50) * 1e3,
+        'p99_round_trip_ms': percentile(latencies, 0.99) * 1e3,
+        'cpu_us_per_message': (time.process_time() - cpu_start) / messages * 1e6,
+        'threads': threading.active_count(),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None,
+    }
+
+
+def benchmark_bus(args):
+    results = []
+    for num_clients in args.clients:
+        host = HostNetworkedMessageBus("benchmark-host", args.port)
+        clients = [ClientNetworkedMessageBus("benchmark-client-%d" % num) for num in range(0, num_clients)]
+        try:
+            host.start()
+            start = time.perf_counter()
+            for client in clients:
+                client.start(host.listener_address)
+            connect_seconds = time.perf_counter() - start
+            for name in args.workloads:
+                result = run_workload(WORKLOADS[name](args.messages), host, clients)
+                result['connect_seconds'] = connect_seconds
+                results.append(result)
+        finally:
+            for client in clients:
+                client.stop()
+            host.stop()
+    return results
+
+
+def benchmark_connect_storm(args):
+    """
+    Starts every client at once, and measures how long it takes until the host has identified all of them.
+    """
+    results = []
+    for num_clients in args.clients:
+        host = HostNetworkedMessageBus("benchmark-host", args.port)
+        clients = [ClientNetworkedMessageBus("benchmark-client-%d" % num) for num in range(0, num_clients)]
+        barrier = threading.Barrier(num_clients + 1)
+        connect_times = []
+        failures = []
+
+        def connect(client):
+            barrier.wait()
+            start = time.perf_counter()
+            try:
+                client.start(host.listener_address)
+                connect_times.append(time.perf_counter() - start)
+            except (ConnectionException, OSError):
+                failures.append(client)
+
+        threads = [threading.Thread(name="benchmark-connect-%d" % num, target=connect, args=(client, )) for (num, client) in enumerate(clients)]
+        try:
+            host.start()
+            for thread in threads:
+                thread.start()
+            barrier.wait()
+            start = time.perf_counter()
+            while len(host.connection_manager.get()) < num_clients - len(failures) and time.perf_counter() - start < args.timeout:
+                time.sleep(0.001)
+            elapsed = time.perf_counter() - start
+            for thread in threads:
+                thread.join()
+            results.append({
+                'clients': num_clients,
+                'identified': len(host.connection_manager.get()),
+                'failures': len(failures),
+                'seconds_to_all_identified': elapsed,
+                'p50_connect_ms': percentile(connect_times, 0.50) * 1e3 if connect_times else None,
+                'p99_connect_ms': percentile(connect_times, 0.99) * 1e3 if connect_times else None,
+            })
+        finally:
+            for client in clients:
+                client.stop()
+            host.stop()
+    return results
+
+
+class CopyingReceiver(object):
+    """
+    The receive path connections used before the receive buffer - a fresh bytes object per recv, appended to a
+    bytearray, and another bytes copy per frame.
+    """
+    name = "recv"
+
+    def __init__(self):
+        self.frame_buffer = FrameBuffer()
+
+    def read(self, sock):
+        self.frame_buffer.feed(sock.recv(65536))
+        return self.frame_buffer.frames()
+
+
+class ReceiveBufferReceiver(object):
+    name = "recv_into"
+
+    def __init__(self):
+        self.receive_buffer = ReceiveBuffer()
+
+    def read(self, sock):
+        self.receive_buffer.recv_into(sock)
+        return self.receive_buffer.frames()
+
+
+def run_receiver(receiver, codec, data, count):
+    """
+    Receives and decodes count messages, tracking how much memory each read allocates on top of what's already in
+    use - the peak is reset before every read, so the transient buffers of each read are counted separately.
+    """
+    sender, receiver_socket = socket.socketpair()
+    send_thread = threading.Thread(name="benchmark-sender", target=sender.sendall, args=(data, ))
+    received = 0
+    allocated = 0
+    tracemalloc.start()
+    try:
+        send_thread.start()
+        start = time.perf_counter()
+        while received < count:
+            (current, _) = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            for frame in receiver.read(receiver_socket):
+                codec.decode(frame.type_id, frame.payload)
+                received += 1
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        elapsed = time.perf_counter() - start
+    finally:
+        tracemalloc.stop()
+        send_thread.join()
+        sender.close()
+        receiver_socket.close()
+    return {
+        'receiver': receiver.name,
+        'messages': count,
+        'messages_per_second': count / elapsed,
+        'allocated_bytes_per_message': allocated / count,
+    }
+
+
+def benchmark_receive(args):
+    codec = create_codec()
+    results = []
+    for message in sample_messages():
+        (type_id, payload) = codec.encode(message)
+        data = b''.join(encode_frame(payload, type_id)) * args.messages
+        for receiver in (CopyingReceiver(), ReceiveBufferReceiver()):
+            result = run_receiver(receiver, codec, data, args.messages)
+            result['message'] = message.__class__.__name__
+            result['payload_bytes'] = len(payload)
+            results.append(result)
+    return results
+
+
+def benchmark_compression(args):
+    codec = create_codec()
+    payloads = [(message.__class__.__name__, codec.encode(message)[1]) for message in sample_messages()]
+    compressors = [ZlibCompressor(), ZlibDictionaryCompressor(train_dictionary([payload for (_, payload) in payloads])), LzmaCompressor()]
+    results = []
+    for (name, payload) in payloads:
+        for compressor in compressors:
+            compressed = compressor.compress(payload)
+            results.append({
+                'message': name,
+                'compressor': compressor.__class__.__name__,
+                'raw_bytes': len(payload),
+                'compressed_bytes': len(compressed),
+                'ratio': len(compressed) / len(payload),
+                'compress_us': time_per_call(compressor.compress, payload, args.iterations),
+                'decompress_us': time_per_call(lambda data: compressor.decompress(data, len(payload)), compressed, args.iterations),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message bus benchmarks.")
+    add_json_argument(parser)
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    framing = subparsers.add_parser("framing", help="Compare the legacy pickled headers against binary frames.")
+    framing.add_argument("--messages", type=int, default=50000)
+    framing.set_defaults(func=benchmark_framing)
+
+    codec = subparsers.add_parser("codec", help="Compare the message codec against pickle for each message type.")
+    codec.add_argument("--iterations", type=int, default=20000)
+    codec.set_defaults(func=benchmark_codec)
+
+    compression = subparsers.add_parser("compression", help="Compare compression ratio and cost per message type.")
+    compression.add_argument("--iterations", type=int, default=2000)
+    compression.set_defaults(func=benchmark_compression)
+
+    receive = subparsers.add_parser("receive", help="Compare memory allocated per received message with recv and recv_into.")
+    receive.add_argument("--messages", type=int, default=5000)
+    receive.set_defaults(func=benchmark_receive)
+
+    bus = subparsers.add_parser("bus", help="Drive message mixes through a host and N clients over loopback.")
+    bus.add_argument("--clients", type=lambda value: [int(num) for num in value.split(",")], default=[1, 4, 16, 64],
+                     help="Comma separated client counts, e.g. 1,16,256.")
+    bus.add_argument("--workloads", type=lambda value: value.split(","), default=sorted(WORKLOADS.keys()),
+                     help="Comma separated workloads, out of: %s." % ", ".join(sorted(WORKLOADS.keys())))
+    bus.add_argument("--messages", type=int, default=1000, help="Sends per workload.")
+    bus.add_argument("--port", type=int, default=40100)
+    bus.set_defaults(func=benchmark_bus)
+
+    connect_storm = subparsers.add_parser("connect-storm", help="Connect N clients simultaneously and time how long until all are identified.")
+    connect_storm.add_argument("--clients", type=lambda value: [int(num) for num in value.split(",")], default=[200],
+                               help="Comma separated client counts.")
+    connect_storm.add_argument("--timeout", type=float, default=30.0, help="Give up waiting after this many seconds.")
+    connect_storm.add_argument("--port", type=int, default=40100)
+    connect_storm.set_defaults(func=benchmark_connect_storm)
+
+    args = parser.parse_args()
+    # log output would dominate what we're trying to measure.
+    logging.getLogger().setLevel(logging.WARNING)
+    results = args.func(args)
+    report(args.benchmark, args, results)
+
+
+if __name__ == "__main__":
+    main()
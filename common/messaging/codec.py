@@ -0,0 +1,301 @@
+import io
+import pickle
+import struct
+from .messages import *
+
+
+class Field(object):
+    """
+    Describes how a single message attribute is written to the wire.
+
+    Fixed-size fields only declare a struct format (plus optional conversions to and from the packed value) - the
+    schema merges runs of them into a single struct.Struct.  Variable-size fields override pack/unpack_from.
+    """
+    format = None
+
+    def to_wire(self, value):
+        return value
+
+    def from_wire(self, value):
+        return value
+
+    def pack(self, value, codec):
+        raise CodecException("Field %s has unimplemented method pack." % self.__class__.__name__)
+
+    def unpack_from(self, buffer, offset, codec):
+        raise CodecException("Field %s has unimplemented method unpack_from." % self.__class__.__name__)
+
+
+class BoolField(Field):
+    format = '?'
+
+
+class UShortField(Field):
+    format = 'H'
+
+
+class UIntField(Field):
+    format = 'I'
+
+
+class UUIDField(Field):
+    """
+    Message ids are uuid4 strings in memory - 36 characters that fit in 16 bytes.
+
+    Converting through hex directly is several times faster than constructing a uuid.UUID on both ends.
+    """
+    format = '16s'
+
+    def to_wire(self, value):
+        try:
+            return bytes.fromhex(value.replace('-', ''))
+        except (AttributeError, ValueError):
+            raise ValueError("%s is not a valid UUID" % str(value))
+
+    def from_wire(self, value):
+        value = value.hex()
+        return '%s-%s-%s-%s-%s' % (value[:8], value[8:12], value[12:16], value[16:20], value[20:])
+
+
+class StringField(Field):
+    LENGTH = struct.Struct('!I')
+
+    def pack(self, value, codec):
+        encoded = value.encode('utf-8')
+        return self.LENGTH.pack(len(encoded)) + encoded
+
+    def unpack_from(self, buffer, offset, codec):
+        (length, ) = self.LENGTH.unpack_from(buffer, offset)
+        offset += self.LENGTH.size
+        return str(buffer[offset:offset + length], 'utf-8'), offset + length
+
+
+class AddressField(Field):
+    """
+    A (host, port) socket address.
+    """
+    PORT = struct.Struct('!H')
+
+    def __init__(self):
+        self.host = StringField()
+
+    def pack(self, value, codec):
+        return self.host.pack(value[0], codec) + self.PORT.pack(value[1])
+
+    def unpack_from(self, buffer, offset, codec):
+        (host, offset) = self.host.unpack_from(buffer, offset, codec)
+        (port, ) = self.PORT.unpack_from(buffer, offset)
+        return (host, port), offset + self.PORT.size
+
+
+class ObjectField(Field):
+    """
+    An arbitrary object with no schema of its own - it's handed to the codec's fallback.
+    """
+    LENGTH = struct.Struct('!I')
+
+    def pack(self, value, codec):
+        encoded = codec.fallback.dumps(value)
+        return self.LENGTH.pack(len(encoded)) + encoded
+
+    def unpack_from(self, buffer, offset, codec):
+        (length, ) = self.LENGTH.unpack_from(buffer, offset)
+        offset += self.LENGTH.size
+        return codec.fallback.loads(buffer[offset:offset + length]), offset + length
+
+
+class Schema(object):
+    def __init__(self, cls, fields):
+        """
+        Compiles a list of (attribute, Field) pairs into segments - consecutive fixed-size fields become a single
+        struct, so that e.g. a message's uuid and flags are packed with one call.
+
+        :param cls: the message class described by this schema.
+        :param fields: a list of (attribute name, Field) tuples, in wire order.
+        """
+        self.cls = cls
+        self.segments = []
+
+        fixed = []
+        for (name, field) in fields:
+            if field.format is not None:
+                fixed.append((name, field))
+            else:
+                self._add_fixed(fixed)
+                fixed = []
+                self.segments.append((None, [(name, field)]))
+        self._add_fixed(fixed)
+
+    def _add_fixed(self, fixed):
+        if fixed:
+            fmt = '!' + ''.join(field.format for (_, field) in fixed)
+            self.segments.append((struct.Struct(fmt), fixed))
+
+    def encode(self, message, codec):
+        parts = []
+        for (packer, fields) in self.segments:
+            if packer is not None:
+                parts.append(packer.pack(*[field.to_wire(getattr(message, name)) for (name, field) in fields]))
+            else:
+                (name, field) = fields[0]
+                parts.append(field.pack(getattr(message, name), codec))
+        return b''.join(parts)
+
+    def decode(self, buffer, codec):
+        state = {}
+        offset = 0
+        for (packer, fields) in self.segments:
+            if packer is not None:
+                values = packer.unpack_from(buffer, offset)
+                offset += packer.size
+                for ((name, field), value) in zip(fields, values):
+                    state[name] = field.from_wire(value)
+            else:
+                (name, field) = fields[0]
+                (state[name], offset) = field.unpack_from(buffer, offset, codec)
+        message = self.cls.__new__(self.cls)
+        message.__dict__.update(state)
+        return message
+
+
+class PickleFallback(object):
+    """
+    Pickles anything that doesn't have a schema.
+
+    Unpickling data off of the network can execute arbitrary code, so loads only resolves an explicit set of
+    (module, name) pairs and builtins - anything else raises a CodecException.  Dotted names are always refused,
+    since they'd let a payload reach through an allowed module to whatever it imports.
+    """
+    SAFE_BUILTINS = {'bool', 'bytes', 'complex', 'dict', 'float', 'frozenset', 'int', 'list', 'set', 'str', 'tuple', 'NoneType'}
+    ALLOWED_CLASSES = {
+        ('common.configuration.game_configuration', 'GameConfiguration'),
+        ('common.maps.maps', 'Map'),
+        ('common.maps.spawns.spawns', 'PlayerSpawn'),
+        ('common.maps.spawns.spawns', 'IndestructableWallSpawn'),
+        ('common.maps.spawns.spawns', 'DestructableWallSpawn'),
+        ('common.messaging.messages', 'Print'),
+        ('common.messaging.messages', 'Identify'),
+        ('common.messaging.messages', 'StateUpdate'),
+        ('common.messaging.messages', 'InputMessage'),
+        ('common.messaging.messages', 'StateSnapshot'),
+        ('common.messaging.messages', 'SnapshotAck'),
+        ('common.messaging.messages', 'RequestFail'),
+        ('common.messaging.messages', 'RequestSuccess'),
+        ('common.messaging.messages', 'CreateGame'),
+    }
+
+    def __init__(self, allowed_classes=()):
+        """
+        :param allowed_classes: classes to allow on top of ALLOWED_CLASSES.
+        """
+        self.allowed_classes = set(self.ALLOWED_CLASSES)
+        for cls in allowed_classes:
+            self.allow(cls)
+
+    def allow(self, cls):
+        self.allowed_classes.add((cls.__module__, cls.__qualname__))
+
+    def dumps(self, value):
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        try:
+            return RestrictedUnpickler(io.BytesIO(data), self).load()
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError) as e:
+            raise CodecException("Unable to unpickle payload: %s" % str(e))
+
+    def allows(self, module, name):
+        if '.' in name:
+            return False
+        if module == 'builtins':
+            return name in self.SAFE_BUILTINS
+        return (module, name) in self.allowed_classes
+
+
+class RestrictedUnpickler(pickle.Unpickler):
+    def __init__(self, file, fallback):
+        super().__init__(file)
+        self.fallback = fallback
+
+    def find_class(self, module, name):
+        if not self.fallback.allows(module, name):
+            raise CodecException("Refusing to unpickle %s.%s" % (module, name))
+        return super().find_class(module, name)
+
+
+class MessageCodec(object):
+    # frames carrying a fallback-encoded message (one with no registered schema) use this type id.
+    FALLBACK_TYPE_ID = 0
+
+    def __init__(self, fallback=None):
+        """
+        Encodes registered message classes as their type id plus packed fields, and everything else with the
+        fallback.
+
+        :param fallback: an object with dumps/loads methods - defaults to a restricted PickleFallback.
+        """
+        self.fallback = fallback if fallback is not None else PickleFallback()
+        self.schemas_by_class = {}
+        self.schemas_by_type_id = {}
+
+    def register(self, cls, fields):
+        """
+        :param cls: a message class with a unique, non-zero type_id.
+        :param fields: (attribute, Field) pairs for everything the class defines beyond BaseMessage.
+        """
+        if cls.type_id == self.FALLBACK_TYPE_ID:
+            raise CodecException("Message class %s needs a type id to be registered." % cls.__name__)
+        if cls.type_id in self.schemas_by_type_id and self.schemas_by_type_id[cls.type_id].cls is not cls:
+            raise CodecException("Type id %d is already registered to %s." % (cls.type_id, self.schemas_by_type_id[cls.type_id].cls.__name__))
+        schema = Schema(cls, BASE_FIELDS + list(fields))
+        self.schemas_by_class[cls] = schema
+        self.schemas_by_type_id[cls.type_id] = schema
+
+    def encode(self, message):
+        """
+        :return: a (type id, payload) tuple.
+        """
+        schema = self.schemas_by_class.get(message.__class__)
+        if schema is None:
+            return self.FALLBACK_TYPE_ID, self.fallback.dumps(message)
+        return message.__class__.type_id, schema.encode(message, self)
+
+    def decode(self, type_id, payload):
+        if type_id == self.FALLBACK_TYPE_ID:
+            message = self.fallback.loads(payload)
+            if not isinstance(message, BaseMessage):
+                raise CodecException("Fallback payload decoded to %s, which isn't a message." % message.__class__.__name__)
+            return message
+        if type_id not in self.schemas_by_type_id:
+            raise CodecException("Unknown message type id %d." % type_id)
+        try:
+            return self.schemas_by_type_id[type_id].decode(payload, self)
+        except (struct.error, ValueError) as e:
+            raise CodecException("Malformed payload for message type id %d: %s" % (type_id, str(e)))
+
+
+class CodecException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+BASE_FIELDS = [('uuid', UUIDField()), ('requires_response', BoolField())]
+
+
+def create_codec(fallback=None):
+    """
+    :return: a MessageCodec with every message class in .messages registered.
+    """
+    codec = MessageCodec(fallback)
+    codec.register(Print, [('message', StringField())])
+    codec.register(Identify, [('client_id', StringField()), ('target_address', AddressField()), ('datagram_port', UShortField()),
+                              ('compression', StringField()), ('compression_dictionary', StringField())])
+    codec.register(RequestFail, [('request_id', UUIDField()), ('error', StringField())])
+    codec.register(RequestSuccess, [('request_id', UUIDField())])
+    codec.register(CreateGame, [('client_id', StringField()), ('configuration', ObjectField()), ('session_id', StringField())])
+    codec.register(StateUpdate, [('key', StringField()), ('state', ObjectField())])
+    codec.register(InputMessage, [('client_id', StringField()), ('inputs', ObjectField()), ('session_id', StringField())])
+    codec.register(StateSnapshot, [('session_id', StringField()), ('tick', UIntField()), ('baseline_tick', UIntField()), ('delta', BoolField()),
+                                   ('entities', ObjectField()), ('removed', ObjectField())])
+    codec.register(SnapshotAck, [('session_id', StringField()), ('client_id', StringField()), ('tick', UIntField())])
+    return codec
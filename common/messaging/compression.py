@@ -0,0 +1,229 @@
+import hashlib
+import lzma
+import struct
+import threading
+import time
+import zlib
+
+
+class Compressor(object):
+    """
+    Compresses frame payloads with a single algorithm.
+
+    Every compressed payload starts with the compressor's one byte algorithm id, so the receiving side knows how to
+    decompress it without having to track what was negotiated in each direction.
+    """
+    algorithm_id = None
+    name = None
+
+    def compress(self, data):
+        raise CompressionException("Compressor %s has unimplemented method compress." % self.__class__.__name__)
+
+    def decompress(self, data, max_size):
+        raise CompressionException("Compressor %s has unimplemented method decompress." % self.__class__.__name__)
+
+
+class ZlibCompressor(Compressor):
+    algorithm_id = 1
+    name = "zlib"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, max_size):
+        decompressor = zlib.decompressobj()
+        return self._finish(decompressor, decompressor.decompress(data, max_size))
+
+    @staticmethod
+    def _finish(decompressor, decompressed):
+        if decompressor.unconsumed_tail:
+            raise CompressionException("Decompressed payload exceeds %d bytes." % len(decompressed))
+        if not decompressor.eof:
+            raise CompressionException("Truncated compressed payload.")
+        return decompressed
+
+
+class ZlibDictionaryCompressor(ZlibCompressor):
+    """
+    zlib, primed with a dictionary both sides share - small messages that look like the dictionary compress far
+    better than they would on their own.
+    """
+    algorithm_id = 2
+
+    def __init__(self, dictionary, level=6):
+        super().__init__(level)
+        self.dictionary = dictionary
+
+    def compress(self, data):
+        compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data, max_size):
+        decompressor = zlib.decompressobj(zdict=self.dictionary)
+        return self._finish(decompressor, decompressor.decompress(data, max_size))
+
+
+class LzmaCompressor(Compressor):
+    """
+    Slower than zlib, but usually smaller.  Raw LZMA2 streams skip the xz container's ~60 bytes of headers.
+    """
+    algorithm_id = 3
+    name = "lzma"
+
+    def __init__(self, preset=6):
+        self.filters = [{'id': lzma.FILTER_LZMA2, 'preset': preset}]
+
+    def compress(self, data):
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=self.filters)
+
+    def decompress(self, data, max_size):
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=self.filters)
+        try:
+            decompressed = decompressor.decompress(data, max_size)
+        except lzma.LZMAError as e:
+            raise CompressionException("Unable to decompress payload: %s" % str(e))
+        if not decompressor.eof:
+            raise CompressionException("Compressed payload is truncated or exceeds %d bytes." % max_size)
+        return decompressed
+
+
+def train_dictionary(payloads, size=32768):
+    """
+    Builds a shared dictionary out of typical payloads.
+
+    zlib only looks back 32KB, and finds matches near the end of the dictionary most cheaply - so the dictionary is
+    the tail of the concatenated payloads, with the most representative payloads expected last.
+
+    :param payloads: encoded message payloads, e.g. from MessageCodec.encode.
+    :param size: the dictionary's maximum size.
+    """
+    return b''.join(payloads)[-size:]
+
+
+class CompressionPolicy(object):
+    ALGORITHMS = {
+        ZlibCompressor.name: ZlibCompressor,
+        LzmaCompressor.name: LzmaCompressor,
+    }
+
+    def __init__(self, algorithms=("zlib", ), threshold=256, dictionary=None, max_size=64 * 1024 * 1024):
+        """
+        Describes the compression a bus offers during the handshake.  Each side compresses what it sends with the
+        first of its own algorithms that the other side also offered, and only uses the dictionary if both sides
+        offered the same one.
+
+        :param algorithms: algorithm names, most preferred first - out of zlib and lzma.
+        :param threshold: payloads smaller than this many bytes are sent as they are.
+        :param dictionary: optional bytes to prime zlib with (see train_dictionary) - both sides need the same ones.
+        :param max_size: compressed payloads that would decompress to more than this many bytes are rejected.
+        """
+        for name in algorithms:
+            if name not in self.ALGORITHMS:
+                raise CompressionException("Unknown compression algorithm %s." % name)
+        self.algorithms = list(algorithms)
+        self.threshold = threshold
+        self.dictionary = dictionary
+        self.dictionary_id = hashlib.sha1(dictionary).hexdigest()[:16] if dictionary else ""
+        self.max_size = max_size
+        self.stats = CompressionStats()
+
+        self.decompressors = dict((cls.algorithm_id, cls()) for cls in self.ALGORITHMS.values())
+        if dictionary:
+            self.decompressors[ZlibDictionaryCompressor.algorithm_id] = ZlibDictionaryCompressor(dictionary)
+
+    def offer(self):
+        """
+        :return: what goes in our Identify - the comma separated algorithm names and the dictionary id.
+        """
+        return ",".join(self.algorithms), self.dictionary_id
+
+    def negotiate(self, algorithms, dictionary_id):
+        """
+        :param algorithms: the comma separated algorithm names the other side offered.
+        :param dictionary_id: the id of the dictionary the other side offered.
+        :return: a FrameCompressor for what we send to the other side, or None if we have no algorithm in common.
+        """
+        offered = algorithms.split(",") if algorithms else []
+        for name in self.algorithms:
+            if name in offered:
+                if name == ZlibCompressor.name and self.dictionary and dictionary_id == self.dictionary_id:
+                    return FrameCompressor(self, ZlibDictionaryCompressor(self.dictionary))
+                return FrameCompressor(self, self.ALGORITHMS[name]())
+        return None
+
+    def decompress(self, payload):
+        if not len(payload):
+            raise CompressionException("Empty compressed payload.")
+        decompressor = self.decompressors.get(payload[0])
+        if decompressor is None:
+            raise CompressionException("Unknown compression algorithm id %d." % payload[0])
+        return decompressor.decompress(payload[1:], self.max_size)
+
+
+class FrameCompressor(object):
+    def __init__(self, policy, compressor):
+        self.policy = policy
+        self.compressor = compressor
+        self.prefix = struct.pack('!B', compressor.algorithm_id)
+
+    def compress(self, payload):
+        """
+        :return: the compressed payload (prefixed with its algorithm id), or None if it's below the threshold or
+            didn't get any smaller.
+        """
+        if len(payload) < self.policy.threshold:
+            return None
+        compressed = self.prefix + self.compressor.compress(payload)
+        return compressed if len(compressed) < len(payload) else None
+
+
+class CompressionStats(object):
+    """
+    Per message type: how many frames went through the compressor, how many bytes went in and came out (frames
+    sent raw count the same on both sides), and the time spent compressing and decompressing.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_type = {}
+
+    def record_compress(self, name, raw_bytes, wire_bytes, elapsed):
+        with self.lock:
+            stats = self._get(name)
+            stats['frames'] += 1
+            stats['raw_bytes'] += raw_bytes
+            stats['wire_bytes'] += wire_bytes
+            stats['compress_time'] += elapsed
+
+    def record_decompress(self, name, elapsed):
+        with self.lock:
+            stats = self._get(name)
+            stats['decompressed'] += 1
+            stats['decompress_time'] += elapsed
+
+    def summary(self):
+        """
+        :return: a dictionary of message class name to counters, plus the compression ratio (wire bytes over raw
+            bytes) and the average microseconds spent compressing and decompressing a frame.
+        """
+        with self.lock:
+            to_return = {}
+            for (name, stats) in self.by_type.items():
+                stats = dict(stats)
+                stats['ratio'] = stats['wire_bytes'] / stats['raw_bytes'] if stats['raw_bytes'] else None
+                stats['compress_us'] = stats['compress_time'] / stats['frames'] * 1e6 if stats['frames'] else None
+                stats['decompress_us'] = stats['decompress_time'] / stats['decompressed'] * 1e6 if stats['decompressed'] else None
+                to_return[name] = stats
+            return to_return
+
+    def _get(self, name):
+        if name not in self.by_type:
+            self.by_type[name] = {'frames': 0, 'raw_bytes': 0, 'wire_bytes': 0, 'compress_time': 0.0, 'decompressed': 0, 'decompress_time': 0.0}
+        return self.by_type[name]
+
+
+class CompressionException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
@@ -0,0 +1,260 @@
+import collections
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+from .framing import FrameBuffer, encode_frame
+from ..app_logging import logging
+
+
+def sequence_greater_than(first, second):
+    """
+    Compares two 16-bit sequence numbers, treating the space as circular so that comparisons keep working after
+    the sequence wraps around.
+    """
+    return first != second and ((first - second) & 0xFFFF) < 0x8000
+
+
+def sequence_distance(first, second):
+    return (first - second) & 0xFFFF
+
+
+class DatagramStats(object):
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.acked = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.round_trip_time = None
+
+
+class DatagramChannel(object):
+    """
+    A sequence-numbered, unreliable channel to a single remote address.
+
+    Every packet starts with a header carrying the packet's own sequence number, the most recent sequence number
+    received from the remote side, a bitfield acknowledging the 32 packets before that one, and flags:
+
+        sequence (2 bytes) | ack (2 bytes) | ack bits (4 bytes) | flags (1 byte)
+
+    followed by a single frame.  Acks ride along on whatever traffic flows the other way, so there are no
+    dedicated ack packets and nothing is ever retransmitted - callers can inspect stats to learn what got through.
+    Duplicates and packets older than the ack window are dropped on receipt.
+    """
+    HEADER = struct.Struct('!HHIB')
+    # set once the sender has received anything from us - until then, ack and ack bits are meaningless.
+    FLAG_ACK = 0x01
+    ACK_WINDOW = 32
+    # sent packets still waiting on an ack - anything older than this is counted as lost.
+    MAX_PENDING = 1024
+    # keep datagrams under the usual path MTU so they're never fragmented.
+    MAX_PAYLOAD_SIZE = 1200
+
+    def __init__(self, endpoint, connection, address):
+        self.endpoint = endpoint
+        self.connection = connection
+        self.address = address
+        self.lock = threading.Lock()
+        self.stats = DatagramStats()
+
+        self.local_sequence = 0
+        self.remote_sequence = None
+        self.received_bits = 0
+        self.pending = collections.OrderedDict()
+
+    def send(self, message):
+        """
+        :return: False if the message is too large for a datagram (and should go over the stream instead).
+        """
+        (type_id, payload) = self.endpoint.codec.encode(message)
+        frame = b''.join(encode_frame(payload, type_id))
+        if len(frame) > self.MAX_PAYLOAD_SIZE:
+            return False
+
+        with self.lock:
+            sequence = self.local_sequence
+            self.local_sequence = (sequence + 1) & 0xFFFF
+            if self.remote_sequence is None:
+                header = self.HEADER.pack(sequence, 0, 0, 0)
+            else:
+                header = self.HEADER.pack(sequence, self.remote_sequence, self.received_bits, self.FLAG_ACK)
+            self.pending[sequence] = time.monotonic()
+            while len(self.pending) > self.MAX_PENDING:
+                self.pending.popitem(last=False)
+                self.stats.lost += 1
+            self.stats.sent += 1
+        self.endpoint.sendto(header + frame, self.address)
+        return True
+
+    def receive(self, data):
+        """
+        :param data: a datagram received from this channel's address.
+        :return: the list of messages it carried - empty if it was malformed, a duplicate, or too old.
+        """
+        if len(data) < self.HEADER.size:
+            return []
+        (sequence, ack, ack_bits, flags) = self.HEADER.unpack_from(data)
+        with self.lock:
+            if flags & self.FLAG_ACK:
+                self._process_acks(ack, ack_bits)
+            if not self._track_received(sequence):
+                return []
+            self.stats.received += 1
+
+        frame_buffer = FrameBuffer()
+        frame_buffer.feed(memoryview(data)[self.HEADER.size:])
+        return self.connection._decode_frames(frame_buffer.frames())
+
+    def _track_received(self, sequence):
+        if self.remote_sequence is None:
+            self.remote_sequence = sequence
+            self.received_bits = 0
+            return True
+        if sequence == self.remote_sequence:
+            self.stats.duplicates += 1
+            return False
+        if sequence_greater_than(sequence, self.remote_sequence):
+            shift = sequence_distance(sequence, self.remote_sequence)
+            self.received_bits = ((self.received_bits << shift) | (1 << (shift - 1))) & 0xFFFFFFFF
+            self.remote_sequence = sequence
+            return True
+
+        distance = sequence_distance(self.remote_sequence, sequence)
+        if distance > self.ACK_WINDOW:
+            self.stats.stale += 1
+            return False
+        bit = 1 << (distance - 1)
+        if self.received_bits & bit:
+            self.stats.duplicates += 1
+            return False
+        self.received_bits |= bit
+        return True
+
+    def _process_acks(self, ack, ack_bits):
+        now = time.monotonic()
+        acked = [ack] + [(ack - 1 - num) & 0xFFFF for num in range(0, self.ACK_WINDOW) if ack_bits & (1 << num)]
+        for sequence in acked:
+            sent_at = self.pending.pop(sequence, None)
+            if sent_at is not None:
+                self.stats.acked += 1
+                sample = now - sent_at
+                if self.stats.round_trip_time is None:
+                    self.stats.round_trip_time = sample
+                else:
+                    self.stats.round_trip_time += (sample - self.stats.round_trip_time) * 0.1
+        # anything that fell out of the ack window without being acked never made it.  pending is in send order,
+        # so we can stop at the first packet that's still within the window.
+        while self.pending:
+            sequence = next(iter(self.pending))
+            if not sequence_greater_than(ack, sequence) or sequence_distance(ack, sequence) <= self.ACK_WINDOW:
+                break
+            self.pending.popitem(last=False)
+            self.stats.lost += 1
+
+
+class DatagramEndpoint(object):
+    def __init__(self, bus, simulator=None):
+        """
+        Owns the bus' UDP socket and demultiplexes incoming datagrams to channels by source address.
+
+        :param bus: the NetworkedMessageBus this endpoint belongs to.
+        :param simulator: an optional NetworkSimulator that every outgoing datagram passes through.
+        """
+        self.logger = logging.getLogger("%s-datagram" % bus.uuid)
+        self.reactor = bus.reactor
+        self.codec = bus.codec
+        self.simulator = simulator
+        self.socket = None
+        self.channels_lock = threading.Lock()
+        self.channels = {}
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', 0))
+        self.socket.setblocking(False)
+        self.reactor.call(self.reactor.register, self.socket, selectors.EVENT_READ, self._on_readable)
+
+    def stop(self):
+        if self.socket is not None:
+            self.reactor.call(self._close_socket)
+        with self.channels_lock:
+            self.channels = {}
+
+    def port(self):
+        return self.socket.getsockname()[1] if self.socket is not None else 0
+
+    def open_channel(self, connection, address):
+        channel = DatagramChannel(self, connection, address)
+        with self.channels_lock:
+            self.channels[address] = channel
+        self.logger.debug("Opened datagram channel with %s:%d" % address)
+        return channel
+
+    def close_channel(self, channel):
+        with self.channels_lock:
+            if self.channels.get(channel.address) is channel:
+                self.channels.pop(channel.address)
+
+    def sendto(self, data, address):
+        if self.simulator is not None:
+            self.simulator.sendto(self, data, address)
+        else:
+            self._sendto(data, address)
+
+    def _sendto(self, data, address):
+        try:
+            self.socket.sendto(data, address)
+        except (AttributeError, OSError):
+            # a full socket buffer (or a closed socket) just means the datagram is lost - that's the contract.
+            pass
+
+    def _close_socket(self):
+        self.reactor.unregister(self.socket)
+        self.socket.close()
+        self.socket = None
+
+    def _on_readable(self, mask):
+        while self.socket is not None:
+            try:
+                (data, address) = self.socket.recvfrom(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. an ICMP port unreachable from a peer that went away.
+                continue
+            with self.channels_lock:
+                channel = self.channels.get(address)
+            if channel is None:
+                continue
+            for data in channel.receive(data):
+                if not data.requires_response:
+                    channel.connection._process_data(data)
+
+
+class NetworkSimulator(object):
+    def __init__(self, loss=0.0, latency=0.0, jitter=0.0, seed=None):
+        """
+        Simulates a bad network on outgoing datagrams, so the datagram channel can be tested over loopback.
+
+        :param loss: probability (0-1) that a datagram is dropped.
+        :param latency: seconds every datagram is delayed by.
+        :param jitter: up to this many extra seconds of random delay - enough jitter reorders datagrams.
+        :param seed: seeds the random number generator, for reproducible runs.
+        """
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.dropped = 0
+
+    def sendto(self, endpoint, data, address):
+        if self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay <= 0 or endpoint.reactor.call_later(delay, endpoint._sendto, data, address) is None:
+            endpoint._sendto(data, address)
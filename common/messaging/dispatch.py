@@ -0,0 +1,79 @@
+import itertools
+import threading
+import time
+
+
+class DispatchStats(object):
+    def __init__(self):
+        self.count = 0
+        self.handler_time = 0.0
+
+
+class DispatchTable(object):
+    """
+    Maps message classes to the handlers that should see them.
+
+    Handlers are registered against a class and apply to all of its subclasses - including ones defined after
+    registration.  The handlers for a concrete class are resolved by walking its MRO the first time an instance of
+    it is dispatched, and cached until the next registration.  Whether a handler wants the connection is decided
+    once, when it's registered, so dispatching is a dictionary lookup and a loop over plain calls.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers = {}
+        self.resolved = {}
+        self.stats = {}
+        self.sequence = itertools.count()
+
+    def register(self, cls, func, wants_connection):
+        """
+        :param cls: the message class (or base class) to handle.
+        :param func: the handler.
+        :param wants_connection: if set, the handler is called with (data, connection) rather than (data).
+        """
+        with self.lock:
+            self.handlers.setdefault(cls, []).append((next(self.sequence), func, wants_connection))
+            self.resolved = {}
+
+    def resolve(self, cls):
+        """
+        :return: a list of (handler, wants connection) tuples for instances of cls, in registration order.
+        """
+        handlers = self.resolved.get(cls)
+        if handlers is None:
+            with self.lock:
+                entries = []
+                for base in cls.__mro__:
+                    entries.extend(self.handlers.get(base, []))
+                handlers = [(func, wants_connection) for (_, func, wants_connection) in sorted(entries, key=lambda entry: entry[0])]
+                self.resolved[cls] = handlers
+        return handlers
+
+    def dispatch(self, data, connection=None):
+        """
+        Calls every handler for data's class.  Exceptions propagate to the caller, and stop any remaining handlers.
+        """
+        cls = data.__class__
+        start = time.perf_counter()
+        try:
+            for (handler, wants_connection) in self.resolve(cls):
+                if wants_connection:
+                    handler(data, connection)
+                else:
+                    handler(data)
+        finally:
+            self.record(cls, time.perf_counter() - start)
+
+    def record(self, cls, elapsed):
+        stats = self.stats.get(cls)
+        if stats is None:
+            stats = self.stats.setdefault(cls, DispatchStats())
+        stats.count += 1
+        stats.handler_time += elapsed
+
+    def dispatch_stats(self):
+        """
+        :return: a dictionary of message class name to the number of messages dispatched and the cumulative time
+            (in seconds) spent in their handlers.
+        """
+        return dict((cls.__name__, {'count': stats.count, 'handler_time': stats.handler_time}) for (cls, stats) in list(self.stats.items()))
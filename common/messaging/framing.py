@@ -0,0 +1,331 @@
+import collections
+import itertools
+import struct
+
+
+class FrameHeader(object):
+    """
+    Every message sent over a Connection is prefixed with a fixed-size header:
+
+        length (4 bytes) | message type id (2 bytes) | flags (2 bytes)
+
+    All fields are unsigned and in network byte order.  Because the header has a constant size, the receiving
+    side always knows how many bytes to read before it knows anything about the payload, which removes the need
+    for the old pickled IncomingRequest object (and its ~150 byte overhead).
+    """
+    STRUCT = struct.Struct('!IHH')
+    SIZE = STRUCT.size
+    MAX_PAYLOAD_SIZE = 0xFFFFFFFF
+
+    # the payload is itself a sequence of complete frames, coalesced so they can be written together.
+    FLAG_BATCH = 0x0001
+    # the payload was compressed with the algorithm named by its first byte.
+    FLAG_COMPRESSED = 0x0002
+    # every flag this side understands - a frame with any other set can't be made sense of.
+    KNOWN_FLAGS = FLAG_BATCH | FLAG_COMPRESSED
+
+    @classmethod
+    def pack(cls, length, type_id, flags=0):
+        if length > cls.MAX_PAYLOAD_SIZE:
+            raise FramingException("Payload of %d bytes exceeds the maximum frame size." % length)
+        return cls.STRUCT.pack(length, type_id, flags)
+
+    @classmethod
+    def unpack_from(cls, buffer, offset=0):
+        return cls.STRUCT.unpack_from(buffer, offset)
+
+
+class Frame(object):
+    def __init__(self, type_id, flags, payload):
+        self.type_id = type_id
+        self.flags = flags
+        self.payload = payload
+
+
+def encode_frame(payload, type_id, flags=0):
+    """
+    Builds the buffers making up a single frame.  These are kept separate (rather than concatenated) so that
+    they can be handed to a single vectored send without copying the payload.
+
+    :param payload: bytes-like payload.
+    :param type_id: the message type id of the payload.
+    :param flags: frame flags.
+    :return: a list of buffers - the header followed by the payload.
+    """
+    return [FrameHeader.pack(len(payload), type_id, flags), payload]
+
+
+def encode_batch(frames):
+    """
+    Wraps a list of encoded frames (each a list of buffers, as returned by encode_frame) into a single batch frame.
+    """
+    payload = b''.join(buffer for frame in frames for buffer in frame)
+    return encode_frame(payload, 0, FrameHeader.FLAG_BATCH)
+
+
+def split_frames(payload):
+    """
+    :param payload: a buffer made up of complete frames - e.g. the payload of a batch frame.
+    :return: the list of frames it contains.
+    """
+    to_return = []
+    offset = 0
+    while offset < len(payload):
+        if len(payload) - offset < FrameHeader.SIZE:
+            raise FramingException("Truncated frame header in batch.")
+        (length, type_id, flags) = FrameHeader.unpack_from(payload, offset)
+        offset += FrameHeader.SIZE
+        if offset + length > len(payload):
+            raise FramingException("Truncated frame in batch.")
+        to_return.append(Frame(type_id, flags, payload[offset:offset + length]))
+        offset += length
+    return to_return
+
+
+def send_buffers(sock, buffers):
+    """
+    Sends a list of buffers with as few syscalls as possible.
+
+    Where available, this uses sendmsg (a vectored write) and only loops if the kernel accepted a partial write.
+    Platforms without sendmsg (Windows) fall back to a single sendall of the joined buffers.
+
+    :param sock: a blocking socket.
+    :param buffers: a list of bytes-like objects.
+    """
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+
+    buffers = [memoryview(buffer) for buffer in buffers]
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if buffers and sent:
+            buffers[0] = buffers[0][sent:]
+
+
+class OutboundBuffer(object):
+    """
+    Holds the frames waiting to be written to a non-blocking socket.
+
+    Buffers are queued individually rather than copied into one contiguous bytearray, so that everything pending can be
+    written with a single vectored send when the socket becomes writable.  Buffers are grouped by frame, so that
+    droppable frames that haven't started going out yet can be discarded when the buffer is over its limit.
+    """
+    # most platforms cap the number of buffers accepted by a single sendmsg (IOV_MAX) at 1024.
+    MAX_BUFFERS_PER_SEND = 1024
+
+    def __init__(self):
+        self.frames = collections.deque()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, buffers, droppable=False):
+        """
+        :param buffers: the buffers making up a single frame.
+        :param droppable: if set, drop_oldest may discard the frame until its first byte is written.
+        """
+        frame = OutboundFrame([memoryview(buffer) for buffer in buffers if len(buffer)], droppable)
+        if frame.size:
+            self.frames.append(frame)
+            self.size += frame.size
+
+    def write_to(self, sock):
+        """
+        Writes as much as the socket will accept without blocking.
+
+        :param sock: a non-blocking socket.
+        :return: the number of bytes written.
+        """
+        if not self.frames:
+            return 0
+        buffers = list(itertools.islice(itertools.chain.from_iterable(frame.buffers for frame in self.frames), 0, self.MAX_BUFFERS_PER_SEND))
+        try:
+            if hasattr(sock, 'sendmsg'):
+                sent = sock.sendmsg(buffers)
+            else:
+                sent = sock.send(b''.join(buffers))
+        except (BlockingIOError, InterruptedError):
+            return 0
+        self.consume(sent)
+        return sent
+
+    def consume(self, size):
+        self.size -= size
+        while size:
+            frame = self.frames[0]
+            frame.droppable = False
+            buffer = frame.buffers[0]
+            if size >= len(buffer):
+                size -= len(buffer)
+                frame.size -= len(buffer)
+                frame.buffers.popleft()
+                if not frame.buffers:
+                    self.frames.popleft()
+            else:
+                frame.buffers[0] = buffer[size:]
+                frame.size -= size
+                size = 0
+
+    def drop_oldest(self):
+        """
+        Discards the oldest droppable frame.
+
+        :return: the number of bytes discarded - 0 if there was nothing to drop.
+        """
+        for (index, frame) in enumerate(self.frames):
+            if frame.droppable:
+                del self.frames[index]
+                self.size -= frame.size
+                return frame.size
+        return 0
+
+
+class OutboundFrame(object):
+    def __init__(self, buffers, droppable):
+        self.buffers = collections.deque(buffers)
+        self.size = sum(len(buffer) for buffer in buffers)
+        self.droppable = droppable
+
+
+class FrameBuffer(object):
+    """
+    Accumulates bytes read off of a socket and splits them into frames.
+
+    A single recv might return part of a frame, exactly one frame, or several frames and part of another - this
+    class holds on to any incomplete trailing data until the rest of it arrives.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    def frames(self):
+        """
+        :return: a list of every complete frame currently buffered, in the order they were received.
+        """
+        to_return = []
+        offset = 0
+        buffered = len(self.buffer)
+        while buffered - offset >= FrameHeader.SIZE:
+            (length, type_id, flags) = FrameHeader.unpack_from(self.buffer, offset)
+            end = offset + FrameHeader.SIZE + length
+            if end > buffered:
+                break
+            to_return.append(Frame(type_id, flags, bytes(self.buffer[offset + FrameHeader.SIZE:end])))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return to_return
+
+
+class ReceiveBuffer(object):
+    """
+    A preallocated buffer that a socket reads straight into with recv_into.
+
+    Complete frames are handed out as memoryview slices of the buffer rather than copies, so they're only valid
+    until the next recv_into - decode them before reading again.  Tiny payloads are the exception: a memoryview
+    object is bigger than a copy of a few dozen bytes, so those are copied.  Reads append after whatever is still unread (at
+    most one partial frame), which is moved back to the front of the buffer once there's too little room left at
+    the end - so in the steady state nothing is allocated or copied.  The buffer only grows if a single frame
+    doesn't fit in it.
+    """
+    # don't bother reading into less space than this - move the unread data to the front first.
+    MIN_READ_SIZE = 32768
+    # payloads smaller than this are copied rather than viewed.
+    COPY_THRESHOLD = 256
+
+    def __init__(self, capacity=131072, max_frame_size=64 * 1024 * 1024):
+        """
+        :param capacity: the initial size of the buffer.
+        :param max_frame_size: frames announcing a larger size raise a FramingException rather than growing the
+            buffer to fit them.
+        """
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.max_frame_size = max_frame_size
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def recv_into(self, sock):
+        """
+        :return: the number of bytes received - 0 means the socket was closed.
+        """
+        self._reserve()
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data):
+        """
+        Copies data in, as if it had been received - for buffers that don't come from a socket.
+        """
+        data = memoryview(data)
+        while len(data):
+            self._reserve()
+            size = min(len(data), len(self.buffer) - self.end)
+            self.view[self.end:self.end + size] = data[:size]
+            self.end += size
+            data = data[size:]
+
+    def frames(self):
+        """
+        :return: a list of every complete frame currently buffered, in the order they were received.  Payloads of
+            COPY_THRESHOLD bytes or more are memoryviews into the buffer.
+        """
+        to_return = []
+        offset = self.start
+        while self.end - offset >= FrameHeader.SIZE:
+            (length, type_id, flags) = FrameHeader.unpack_from(self.buffer, offset)
+            end = offset + FrameHeader.SIZE + length
+            if end > self.end:
+                break
+            if length < self.COPY_THRESHOLD:
+                to_return.append(Frame(type_id, flags, bytes(self.buffer[offset + FrameHeader.SIZE:end])))
+            else:
+                to_return.append(Frame(type_id, flags, self.view[offset + FrameHeader.SIZE:end]))
+            offset = end
+        if offset == self.end:
+            self.start = self.end = 0
+        else:
+            self.start = offset
+        return to_return
+
+    def _reserve(self):
+        """
+        Makes room at the end of the buffer for the next read - at least MIN_READ_SIZE bytes, or whatever is left
+        of the partial frame at the front if that's more.
+        """
+        pending = self.end - self.start
+        needed = self.MIN_READ_SIZE
+        if pending >= FrameHeader.SIZE:
+            (length, _, _) = FrameHeader.unpack_from(self.buffer, self.start)
+            if length > self.max_frame_size:
+                raise FramingException("Frame of %d bytes exceeds the maximum of %d bytes." % (length, self.max_frame_size))
+            needed = max(needed, FrameHeader.SIZE + length - pending)
+        if len(self.buffer) - self.end >= needed:
+            return
+
+        if pending + needed > len(self.buffer):
+            # frames handed out earlier may still reference the old buffer, so it can't be resized in place.
+            buffer = bytearray(max(len(self.buffer) * 2, pending + needed))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        elif pending:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+
+class FramingException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
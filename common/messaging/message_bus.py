@@ -1,17 +1,30 @@
+import collections
+import heapq
+import itertools
 import threading
 import socket
-import select
-import pickle
-import queue
+import selectors
+import time
 from .messages import *
+from .codec import CodecException, create_codec
+from .compression import CompressionException, CompressionPolicy
+from .datagram import DatagramEndpoint
+from .dispatch import DispatchTable
+from .framing import FrameHeader, FramingException, OutboundBuffer, ReceiveBuffer, encode_batch, encode_frame, split_frames
+from .reactor import Reactor, WorkerThread
 from ..app_logging import logging
 
+# seconds a request waits for its responses, unless a timeout is passed to send.
+DEFAULT_REQUEST_TIMEOUT = 30.0
+# seconds a new connection has to complete its handshake before it's closed.
+DEFAULT_HANDSHAKE_TIMEOUT = 10.0
+
 
 class MessageBus(object):
     def __init__(self, bus_uuid):
         self.uuid = bus_uuid
         self.logger = logging.getLogger("message-bus")
-        self.data_handlers = {}
+        self.dispatch_table = DispatchTable()
 
     def start(self):
         pass
@@ -22,35 +35,106 @@ class MessageBus(object):
     def stop(self):
         pass
 
+    def flush(self):
+        pass
+
     def data_handler(self, cls):
         def decorated(func):
             self.register_data_handler(cls, func)
         return decorated
 
     def register_data_handler(self, cls, func):
-        to_register = [cls]
-        while to_register:
-            curr_cls = to_register.pop()
-            for subcls in curr_cls.__subclasses__():
-                to_register.append(subcls)
-            if curr_cls not in self.data_handlers:
-                self.data_handlers[curr_cls] = []
-            self.data_handlers[curr_cls].append(func)
+        """
+        Registers func for cls and every subclass of cls, including subclasses defined later on.
+        """
+        self.dispatch_table.register(cls, func, self.wants_connection(func))
+
+    def wants_connection(self, func):
+        """
+        If it's internal, we probably care about the connection - if it's an external data handler, all that
+        matters is the data argument.
+        """
+        return hasattr(func, '__self__') and isinstance(func.__self__, MessageBus)
+
+    def dispatch_stats(self):
+        """
+        :return: per message type, the number of messages handled and the cumulative time spent in handlers.
+        """
+        return self.dispatch_table.dispatch_stats()
 
 
 class LocalMessageBus(MessageBus):
-    def __init__(self, bus_uuid):
+    # handlers run in the sender's thread, before send returns.
+    INLINE = "inline"
+    # send only queues the message - a dispatcher thread drains the queue.
+    DISPATCH_THREAD = "thread"
+
+    def __init__(self, bus_uuid, mode=INLINE):
+        """
+        A message bus between two parts of the same process.
+
+        With a dispatcher thread, messages are handled in the order they were sent - so messages from any one
+        sender are never reordered - and a slow handler never holds up the sender.
+
+        :param bus_uuid: the UUID of the class that spawned this.
+        :param mode: INLINE or DISPATCH_THREAD.
+        """
         super().__init__(bus_uuid)
+        self.mode = mode
+        self.queue_lock = threading.Condition()
+        self.queue = collections.deque()
+        self.shutting_down = False
+        self.thread = None
 
     def start(self, *args):
         super().start()
+        self.shutting_down = False
+        if self.mode == LocalMessageBus.DISPATCH_THREAD:
+            self.thread = WorkerThread(name="%s-dispatcher" % self.uuid, target=self._dispatch_forever)
+            self.thread.start()
 
     def stop(self):
         super().stop()
+        with self.queue_lock:
+            self.shutting_down = True
+            self.queue_lock.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+            self.thread = None
 
     def send(self, data):
-        for handler in self.data_handlers[data.__class__]:
-            handler(data)
+        if self.mode == LocalMessageBus.INLINE:
+            self.dispatch_table.dispatch(data)
+            return
+        with self.queue_lock:
+            was_empty = not self.queue
+            self.queue.append(data)
+            if was_empty:
+                self.queue_lock.notify()
+
+    def _drain(self):
+        """
+        Handles every queued message, in the order they were sent.  Exceptions raised by handlers are logged rather
+        than propagated, since the sender is long gone.
+        """
+        with self.queue_lock:
+            batch = self.queue
+            self.queue = collections.deque()
+        for data in batch:
+            try:
+                self.dispatch_table.dispatch(data)
+            except Exception as e:
+                self.logger.exception("Unhandled exception handling %s: %s" % (data.__class__.__name__, str(e)))
+
+    def _dispatch_forever(self, start_lock):
+        start_lock.set()
+        while True:
+            with self.queue_lock:
+                while not self.queue and not self.shutting_down:
+                    self.queue_lock.wait()
+                if not self.queue:
+                    return
+            self._drain()
 
 
 class NetworkedMessageBus(MessageBus):
@@ -63,8 +147,15 @@ class NetworkedMessageBus(MessageBus):
         """
         super().__init__(bus_uuid)
 
+        self.reactor = Reactor("%s-reactor" % bus_uuid)
+        self.codec = create_codec()
         self.connection_manager = ConnectionManager(self)
         self.request_manager = RequestManager(self)
+        self.batch_policy = None
+        self.outbound_limit = None
+        self.compression = None
+        self.handshake_timeout = DEFAULT_HANDSHAKE_TIMEOUT
+        self.datagram_endpoint = None
         self.shutting_down = False
 
         self.register_data_handler(Identify, self.connection_manager.identify)
@@ -72,41 +163,141 @@ class NetworkedMessageBus(MessageBus):
 
     def start(self, *args):
         super().start()
+        self.shutting_down = False
+        self.reactor.start()
+        if self.datagram_endpoint is not None:
+            self.datagram_endpoint.start()
 
-    def send(self, message, target_address=None, blocking=True):
+    def send(self, message, target_address=None, blocking=True, timeout=DEFAULT_REQUEST_TIMEOUT):
         """
         Sends a message to connected clients (via broadcast).
-        :param message: Any message that is pickleable.
+        :param message: Any message the bus' codec can encode.
         :param target_address: If we're trying to communicate with a non-identified connection, we can specify a target
             address instead.
         :param blocking: Allows the function to block until all responses are received.
-        :return:
+        :param timeout: seconds to wait for responses before the request's pending connections time out.
+        :return: the Request tracking the responses, or None for messages that don't require one.
+        """
+        return self._send(message, self.connection_manager.get(target_address), blocking, timeout)
+
+    def send_to_client(self, message, client_id, blocking=True, timeout=DEFAULT_REQUEST_TIMEOUT):
+        """
+        Sends a message to a single identified connection - e.g. a game's state, to one of its players.
+        :param client_id: the client id the connection identified itself with.
+        """
+        return self._send(message, [self.connection_manager.get_client(client_id)], blocking, timeout)
+
+    def _send(self, message, connections, blocking, timeout):
+        if not message.requires_response:
+            # nothing will answer, so there's nothing to track or wait on.
+            for connection in connections:
+                connection.send(message)
+            return
+        if blocking and self.reactor.in_reactor_thread():
+            # responses are read by the reactor thread - blocking it until they arrive would never return.
+            self.logger.warning("Blocking send of %s from the reactor thread - sending without blocking." % message.__class__.__name__)
+            blocking = False
+        return self.request_manager.send(message, connections, blocking, timeout)
+
+    def enable_batching(self, max_bytes=65536, max_delay=None):
+        """
+        Switches connections opened from now on to batching mode: messages are queued per connection and written
+        as a single frame when flush is called (typically once per host tick), when max_bytes worth of messages
+        are queued, or when the oldest queued message has waited max_delay seconds.
+
+        Batched connections also disable Nagle's algorithm, since we're doing our own coalescing.
+
+        :param max_bytes: flush a connection's batch once it holds this many bytes.
+        :param max_delay: if set, flush a connection's batch this many seconds after its first message is queued.
+        """
+        self.batch_policy = BatchPolicy(max_bytes, max_delay)
+
+    def limit_outbound(self, max_bytes, policy=None):
+        """
+        Bounds how many bytes each connection opened from now on may have waiting to be written - frames in the
+        outbound buffer plus the connection's batch.  What happens when a send would go over the limit depends on
+        the policy:
+
+            OutboundLimit.BLOCK - the sender waits until the socket drains (except on the reactor thread, which
+                can't wait on itself).
+            OutboundLimit.DROP_UNRELIABLE - the oldest unreliable frames that haven't started going out are
+                dropped to make room.  If that isn't enough, an unreliable message is dropped, and a reliable one
+                disconnects the connection.
+            OutboundLimit.DISCONNECT - the connection is closed, as if the remote side had gone away.
+
+        :param max_bytes: the limit, per connection.
+        :param policy: one of the policies above - defaults to DROP_UNRELIABLE.
+        """
+        self.outbound_limit = OutboundLimit(max_bytes, policy if policy is not None else OutboundLimit.DROP_UNRELIABLE)
+
+    def enable_datagrams(self, simulator=None):
+        """
+        Offers a UDP channel alongside each connection.  The channel's port is exchanged in the Identify handshake,
+        and once both sides have offered one, unreliable messages small enough to fit in a datagram are sent over
+        it instead of the stream - everything else (lobby traffic, CreateGame, responses) stays on TCP.
+
+        Must be called before start.
+        :param simulator: an optional NetworkSimulator applied to outgoing datagrams (for testing).
+        """
+        self.datagram_endpoint = DatagramEndpoint(self, simulator)
+
+    def enable_compression(self, algorithms=("zlib", ), threshold=256, dictionary=None):
+        """
+        Offers compression in the Identify handshake.  Once both sides have offered an algorithm in common, frames
+        whose payload is at least threshold bytes are compressed (unless that doesn't make them any smaller).
+
+        Must be called before start.
+        :param algorithms: the algorithms to offer, most preferred first - out of zlib and lzma.
+        :param threshold: payloads smaller than this are sent as they are.
+        :param dictionary: an optional zlib dictionary (see compression.train_dictionary), used when the other side
+            offers the same one.
+        """
+        self.compression = CompressionPolicy(algorithms, threshold, dictionary)
+
+    def compression_stats(self):
+        """
+        :return: per message type, compression ratio and CPU cost - empty if compression isn't enabled.
         """
-        connections = self.connection_manager.get(target_address)
-        self.request_manager.send(message, connections, blocking)
+        return self.compression.stats.summary() if self.compression is not None else {}
+
+    def identify_message(self, connection):
+        datagram_port = self.datagram_endpoint.port() if self.datagram_endpoint is not None else 0
+        (compression, compression_dictionary) = self.compression.offer() if self.compression is not None else ("", "")
+        return Identify(self.uuid, connection.source_address, datagram_port, compression, compression_dictionary)
+
+    def flush(self):
+        """
+        Writes out every connection's pending batch - one frame (and one vectored send) per connection.
+        """
+        for connection in self.connection_manager.get_all():
+            connection.flush()
 
     def stop(self):
         super().stop()
         self.shutting_down = True
-        connections = self.connection_manager.get()
+        connections = self.connection_manager.get_all()
         for connection in connections:
             self.request_manager.notify(connection)
             self.connection_manager.close(connection)
+        # nothing can answer once every connection is closed - don't leave anyone blocked on a request.
+        self.request_manager.notify(None)
+        if self.datagram_endpoint is not None:
+            self.datagram_endpoint.stop()
+        self.reactor.stop()
 
     def handle_closed_remote_socket(self, connection):
         self.request_manager.notify(connection)
         self.connection_manager.close(connection)
 
+    def wants_connection(self, func):
+        return hasattr(func, '__self__') and isinstance(func.__self__, (ConnectionManager, RequestManager, MessageBus))
+
     def handle_data(self, data, connection):
-        if data.__class__ in self.data_handlers:
-            for handler in self.data_handlers[data.__class__]:
-                # if it's internal, we probably care about the connection
-                # if it's an external data handler, all that matters is the data argument
-                # let's enforce this here.
-                if hasattr(handler, '__self__') and isinstance(handler.__self__, (ConnectionManager, RequestManager, MessageBus)):
-                    handler(data, connection)
-                else:
-                    handler(data)
+        self.dispatch_table.dispatch(data, connection)
+        # the handshake only completes once every handler has seen the Identify request - otherwise, whoever is
+        # waiting on the handshake could observe the bus before its own handlers have run.
+        if isinstance(data, Identify):
+            self.connection_manager.complete_handshake(connection)
 
 
 class ClientNetworkedMessageBus(NetworkedMessageBus):
@@ -122,7 +313,7 @@ class ClientNetworkedMessageBus(NetworkedMessageBus):
         super().start()
         self.host_address = host_address
         connection = self.connection_manager.open(target_address=self.host_address)
-        self.request_manager.send(Identify(self.uuid, connection.source_address), connections=[connection])
+        self.request_manager.send(self.identify_message(connection), connections=[connection], timeout=self.handshake_timeout)
         self.connection_manager.wait_until_handshake(connection)
 
     def stop(self):
@@ -134,44 +325,52 @@ class HostNetworkedMessageBus(NetworkedMessageBus):
     def __init__(self, bus_uuid, host_port):
         """
         A Host message bus is a standard message bus with an additional socket used to listen for new connections.
+
+        The listener socket is registered with the bus' reactor, so accepting connections doesn't need a thread.
         """
         super().__init__(bus_uuid)
         self.listener_address = (socket.gethostname(), host_port)
-        self.listener_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.listener_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.listener_thread = WorkerThread(name="host-listener-thread", target=self._listen)
+        self.listener_socket = None
 
     def start(self):
         super().start()
+        self.listener_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.listener_socket.bind(('', self.listener_address[1]))
-        self.listener_socket.listen()
-        self.listener_thread.start()
+        # a whole lobby connecting at once shouldn't overflow the accept queue.
+        self.listener_socket.listen(socket.SOMAXCONN)
+        self.listener_socket.setblocking(False)
+        self.reactor.call(self.reactor.register, self.listener_socket, selectors.EVENT_READ, self._on_listener_readable)
 
     def stop(self):
+        if self.listener_socket is not None:
+            self.reactor.call(self._close_listener_socket)
         super().stop()
-        try:
-            self.listener_socket.shutdown(socket.SHUT_RDWR)
-        except OSError:
-            pass
-        self.listener_socket.close()
-        self.listener_thread.join()
         self.logger.info("host networked message bus stopped")
 
-    def _on_listener_socket_close(self):
-        self.shutting_down = True
-
-    def _listen(self, startup_lock):
-        startup_lock.set()
+    def _close_listener_socket(self):
+        self.reactor.unregister(self.listener_socket)
+        self.listener_socket.close()
+        self.listener_socket = None
 
+    def _on_listener_readable(self, mask):
+        """
+        Accepts every pending connection and starts a handshake with each.  We don't wait for the handshake to
+        finish here - the Identify response is handled by the reactor like any other message, so any number of
+        handshakes can be in flight at once, and a connection that doesn't finish its handshake in time is closed
+        by the connection manager.
+        """
         while not self.shutting_down:
-            if self.listener_socket.can_read(self._on_listener_socket_close):
-                try:
-                    (client_socket, client_address) = self.listener_socket.accept()
-                    connection = self.connection_manager.open(target_socket=client_socket)
-                    self.request_manager.send(Identify(self.uuid, connection.source_address), connections=[connection])
-                    self.connection_manager.wait_until_handshake(connection)
-                except OSError:
-                    self._on_listener_socket_close()
+            try:
+                (client_socket, client_address) = self.listener_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self._close_listener_socket()
+                return
+            connection = self.connection_manager.open(target_socket=client_socket)
+            self.request_manager.send(self.identify_message(connection), connections=[connection], blocking=False)
+            connection.flush()
 
 
 class Connection(object):
@@ -181,8 +380,11 @@ class Connection(object):
 
         Unless a target_socket is provided, it will create a new socket with the passed-in target_address.
 
-        :param request_callback: The callback to pass requests up the chain - usually belongs to the message bus.
-        :param connection_close_callback: The callback to invoke when a socket has been unexpectedly closed - requiring us to notify the bus that this connection has been closd.
+        Once started, the connection's socket is non-blocking and is driven entirely by the bus' reactor - reads
+        happen when the socket is readable, and write interest is only registered while there are frames waiting
+        to be written.
+
+        :param bus: The message bus that owns this connection - supplies the reactor and the data/close callbacks.
         :param target_address: The address to connect a new socket to.
         :param target_socket: The socket to use in lieu of creating a new socket.
         """
@@ -190,12 +392,37 @@ class Connection(object):
         self.local_uuid = bus.uuid
         self.remote_uuid = None
         self.shutting_down = False
+        self.reactor = bus.reactor
+        self.codec = bus.codec
         self.data_process_callback = bus.handle_data
         self.connection_close_callback = bus.handle_closed_remote_socket
 
-        self.send_queue = queue.Queue()
-        self.send_thread = WorkerThread(name="%s-connection_send_thread" % self.local_uuid, target=self._handle_send)
-        self.receive_thread = WorkerThread(name="%s-connection_receive_thread" % self.local_uuid, target=self._handle_receive)
+        self.outbound_lock = threading.Lock()
+        self.outbound_space = threading.Condition(self.outbound_lock)
+        self.outbound = OutboundBuffer()
+        self.outbound_limit = bus.outbound_limit
+        self.high_watermark = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.overflowed = False
+        self.receive_buffer = ReceiveBuffer()
+        self.registered_events = 0
+
+        self.batch_policy = bus.batch_policy
+        self.batch = []
+        self.batch_size = 0
+        self.batch_timer = None
+
+        # unreliable messages waiting to be encoded, by coalesce key.
+        self.latest = collections.OrderedDict()
+        self.superseded = 0
+
+        # set by the connection manager if both sides offered a datagram channel during the handshake.
+        self.datagram = None
+
+        # likewise, set if both sides offered a compression algorithm in common.
+        self.compression = bus.compression
+        self.compressor = None
 
         if target_socket is not None:
             self.socket = target_socket
@@ -207,167 +434,472 @@ class Connection(object):
         self.target_address = self.socket.getpeername()
 
     def start(self):
-        self.send_thread.start()
-        self.receive_thread.start()
+        self.socket.setblocking(False)
+        if self.batch_policy is not None:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reactor.call(self._register)
 
     def send(self, message):
-        self.send_queue.put(message)
+        """
+        Frames a message and queues it to be written.  If the outbound buffer was empty, the reactor is asked to
+        start watching the socket for writability.
+
+        In batching mode, the frame is held in the connection's batch until the batch is flushed.
+
+        Unreliable messages go over the datagram channel when there is one.  Otherwise, those with a coalesce key
+        aren't encoded right away - they're held (latest wins) until the
+        socket is writable, or until the batch is flushed in batching mode.  They may be written out of order with
+        respect to other messages.
+
+        :param message: A message the bus' codec can encode.
+        """
+        if self.shutting_down:
+            return
+        unreliable = isinstance(message, BaseUnreliableMessage)
+        if unreliable and self.datagram is not None and self.datagram.send(message):
+            return
+        key = message.coalesce_key() if unreliable else None
+        if key is not None:
+            self._send_latest(key, message)
+        elif self.batch_policy is None:
+            self._write(self._encode(message), droppable=unreliable)
+        else:
+            self._batch(self._encode(message), droppable=unreliable)
+
+    def outbound_stats(self):
+        """
+        :return: the bytes waiting to be written, the most that have ever been waiting, and how many frames (and
+            bytes) the outbound limit has dropped.
+        """
+        with self.outbound_lock:
+            return {
+                'queued_bytes': self._queued_bytes(),
+                'high_watermark': self.high_watermark,
+                'dropped': self.dropped,
+                'dropped_bytes': self.dropped_bytes,
+                'overflowed': self.overflowed,
+            }
+
+    def flush(self):
+        """
+        Moves everything in the batch into the outbound buffer as a single batch frame.
+        """
+        with self.outbound_lock:
+            if self.batch_timer is not None:
+                self.batch_timer.cancel()
+                self.batch_timer = None
+            latest = list(self.latest.values())
+            self.latest.clear()
+            # coalesced messages aren't encoded until now, so this is when they're counted against the outbound limit.
+            for message in latest:
+                buffers = self._encode(message)
+                size = len(buffers[0]) + len(buffers[1])
+                if self._admit(size, True):
+                    self.batch.append(buffers)
+                    self.batch_size += size
+            self._move_batch()
+            self.high_watermark = max(self.high_watermark, self._queued_bytes())
+
+    def _move_batch(self):
+        """
+        Moves the batch into the outbound buffer, without admitting it again - its bytes were admitted as they were
+        batched.  Must hold the outbound lock.
+        """
+        (batch, self.batch) = (self.batch, [])
+        self.batch_size = 0
+        if not batch:
+            return
+        was_empty = not self.outbound
+        # a batch of one gains nothing from the extra header.
+        self.outbound.append(batch[0] if len(batch) == 1 else encode_batch(batch))
+        if was_empty:
+            self.reactor.call_soon(self._update_interest)
+
+    def _send_latest(self, key, message):
+        with self.outbound_lock:
+            if key in self.latest:
+                self.superseded += 1
+            self.latest[key] = message
+            if self.batch_policy is not None:
+                self._schedule_flush()
+            first = len(self.latest) == 1
+        if first and self.batch_policy is None:
+            self.reactor.call_soon(self._update_interest)
+
+    def _batch(self, buffers, droppable=False):
+        with self.outbound_lock:
+            size = len(buffers[0]) + len(buffers[1])
+            if not self._admit(size, droppable):
+                return
+            self.batch.append(buffers)
+            self.batch_size += size
+            self.high_watermark = max(self.high_watermark, self._queued_bytes())
+            flush = self.batch_size >= self.batch_policy.max_bytes
+            if not flush:
+                self._schedule_flush()
+        if flush:
+            self.flush()
+
+    def _schedule_flush(self):
+        """
+        Starts the batch's latency timer, if there is one and it isn't running yet.  Must hold the outbound lock.
+        """
+        if self.batch_policy.max_delay is not None and self.batch_timer is None:
+            self.batch_timer = self.reactor.call_later(self.batch_policy.max_delay, self.flush)
+
+    def _encode(self, message):
+        (type_id, payload) = self.codec.encode(message)
+        compressor = self.compressor
+        if compressor is None:
+            return encode_frame(payload, type_id)
+        start = time.perf_counter()
+        compressed = compressor.compress(payload)
+        elapsed = time.perf_counter() - start
+        if compressed is None:
+            self.compression.stats.record_compress(message.__class__.__name__, len(payload), len(payload), elapsed)
+            return encode_frame(payload, type_id)
+        self.compression.stats.record_compress(message.__class__.__name__, len(payload), len(compressed), elapsed)
+        return encode_frame(compressed, type_id, FrameHeader.FLAG_COMPRESSED)
+
+    def _write(self, buffers, droppable=False):
+        with self.outbound_lock:
+            if not self._admit(sum(len(buffer) for buffer in buffers), droppable):
+                return
+            was_empty = not self.outbound
+            self.outbound.append(buffers, droppable)
+            self.high_watermark = max(self.high_watermark, self._queued_bytes())
+        if was_empty:
+            self.reactor.call_soon(self._update_interest)
+
+    def _queued_bytes(self):
+        return len(self.outbound) + self.batch_size
+
+    def _admit(self, size, droppable):
+        """
+        Applies the outbound limit to a frame about to be queued.  Must hold the outbound lock.
+
+        :return: True if the frame should be queued.
+        """
+        limit = self.outbound_limit
+        if limit is None:
+            return True
+        while self._queued_bytes() + size > limit.max_bytes:
+            if self.overflowed or self.shutting_down:
+                return False
+            if limit.policy == OutboundLimit.BLOCK:
+                if self.batch:
+                    # only writes make room, and nothing that's still batched gets written - send the batch now,
+                    # rather than waiting on it.
+                    self._move_batch()
+                    continue
+                # a frame bigger than the limit goes out on its own, and the reactor thread can't wait on itself.
+                if not self._queued_bytes() or self.reactor.in_reactor_thread():
+                    return True
+                self.outbound_space.wait()
+                continue
+            if limit.policy == OutboundLimit.DROP_UNRELIABLE:
+                dropped = self.outbound.drop_oldest()
+                if dropped:
+                    self.dropped += 1
+                    self.dropped_bytes += dropped
+                    continue
+                if droppable:
+                    # nothing older to make room with - the newest unreliable message is the one that goes.
+                    self.dropped += 1
+                    self.dropped_bytes += size
+                    return False
+            self.overflowed = True
+            self.reactor.call_soon(self._on_overflow)
+            return False
+        return not self.overflowed
 
     def close(self):
         """
         This method will get called when we want to close a connection in an expected fashion.
-        Generally, since we're expecting this, we can assume that we're not calling this from the receive or send
-        thread.  This is important because otherwise, the join calls could cause a deadlock.
+
+        The socket is unregistered and closed on the reactor thread, so this is safe to call from anywhere.
         :return:
         """
         self.shutting_down = True
+        self.reactor.call(self._close_socket)
+
+    def _register(self):
+        self.registered_events = selectors.EVENT_READ
+        self.reactor.register(self.socket, self.registered_events, self._on_socket_event)
+        self._update_interest()
+
+    def _update_interest(self):
+        if self.shutting_down or not self.registered_events:
+            return
+        events = selectors.EVENT_READ
+        with self.outbound_lock:
+            if self.outbound or (self.latest and self.batch_policy is None):
+                events |= selectors.EVENT_WRITE
+        if events != self.registered_events:
+            self.registered_events = events
+            self.reactor.modify(self.socket, events, self._on_socket_event)
+
+    def _close_socket(self):
+        with self.outbound_lock:
+            # wake up anyone blocked on the outbound limit - they'll see we're shutting down.
+            self.outbound_space.notify_all()
+        if self.registered_events:
+            self.reactor.unregister(self.socket)
+            self.registered_events = 0
         try:
             self.socket.shutdown(socket.SHUT_RDWR)
         except OSError:
             pass
         self.socket.close()
-        self.send_thread.join()
-        self.receive_thread.join()
 
     def _on_socket_close(self):
         """
-        This will get fired when a socket has been closed unexpectedly.
-        Since this can be detected in a variety of different threads, we want to close this connection (which will
-        join the receive and send threads), and notify the bus that this connection is closed from an independent thread.
+        This will get fired (on the reactor thread) when a socket has been closed unexpectedly.
 
-        Since this independent thread calls the close() method (which effectively won't return until this connection's
-        threads aren't running), we can assume that when the connection_close_callback is called, that we've
-        cleaned up as much as we can of this connection from within.
+        We close this connection and then notify the bus, so that when the connection_close_callback is called
+        we've cleaned up as much as we can of this connection from within.
         :return:
         """
+        if self.shutting_down:
+            return
         self.logger.info("Socket unexpectedly closed")
-        def close():
-            self.close()
-            self.connection_close_callback(self)
-        threading.Thread(name="%s-close_connection" % self.local_uuid, target=close).start()
+        self.close()
+        self.connection_close_callback(self)
 
-    def _pop_message(self):
+    def _on_overflow(self):
+        """
+        Disconnects a consumer that couldn't keep up with the outbound limit.  Runs on the reactor thread.
+        """
+        if self.shutting_down:
+            return
+        self.logger.warning("Disconnecting %s:%d - over its outbound limit of %d bytes" % (self.target_address[0], self.target_address[1], self.outbound_limit.max_bytes))
+        self.close()
+        self.connection_close_callback(self)
+
+    def _on_socket_event(self, mask):
+        if mask & selectors.EVENT_READ:
+            self._on_readable()
+        if mask & selectors.EVENT_WRITE and not self.shutting_down:
+            self._on_writable()
+
+    def _on_writable(self):
         try:
-            to_return = self.send_queue.get_nowait()
-            return to_return
-        except queue.Empty:
-            return None
-
-    def _socket_send(self, message):
+            with self.outbound_lock:
+                if self.latest and self.batch_policy is None:
+                    latest = list(self.latest.values())
+                    self.latest.clear()
+                    # coalesced messages aren't encoded until now, so this is when they're counted against the
+                    # outbound limit.
+                    for message in latest:
+                        buffers = self._encode(message)
+                        if self._admit(len(buffers[0]) + len(buffers[1]), True):
+                            self.outbound.append(buffers, droppable=True)
+                    self.high_watermark = max(self.high_watermark, self._queued_bytes())
+                if self.outbound.write_to(self.socket):
+                    self.outbound_space.notify_all()
+        except OSError:
+            # generally, an OSError here will mean that the socket has been closed.
+            self._on_socket_close()
+            return
+        self._update_interest()
+
+    def _on_readable(self):
+        messages = self._socket_receive()
+        if messages is not None:
+            for data in messages:
+                self._process_data(data)
+
+    def _socket_receive(self):
         """
-        Send two messages - one notifying the recipient of the payload, and the other containing the payload.
+        Receives whatever is available on the socket and returns every message that has been fully received.
 
-        :param message: A pickleable message.
+        The socket reads straight into the connection's receive buffer, and frames are decoded from views of it -
+        partial frames are kept there until the remainder arrives.
+        :return: A list of Python objects or None if the connection is presently being shut down.
         """
         if not self.shutting_down:
             try:
-                pickled_message = pickle.dumps(message)
-                incoming_request = pickle.dumps(IncomingRequest(len(pickled_message)))
-                self.socket.sendall(incoming_request)
-                self.socket.sendall(pickled_message)
+                # If nothing was received, this means that the socket was closed
+                if not self.receive_buffer.recv_into(self.socket):
+                    self._on_socket_close()
+                else:
+                    return self._decode_frames(self.receive_buffer.frames())
+            except (BlockingIOError, InterruptedError):
+                pass
+            except FramingException as e:
+                # there's no way to resynchronize with the stream.
+                self.logger.error(str(e))
+                self._on_socket_close()
             except OSError:
                 # generally, an OSError here will mean that the socket has been closed.
                 self._on_socket_close()
+        # shutting down means something else is handling cleanup - nothing to do.
+        return None
 
-    def _socket_receive(self, size=4096):
+    def _decode_frames(self, frames):
         """
-        Receives a request/response sent over a socket.
-        :param size: Number of bytes to read over socket.
-        :return: A Python object or None if the connection is presently being shut down.
+        Frames are length-prefixed, so a payload we can't decode doesn't corrupt the rest of the stream - we log
+        and drop it.  The same goes for frames with flags we don't know, since there's no telling what they hold.
         """
-        if not self.shutting_down:
+        to_return = []
+        for frame in frames:
             try:
-                data = self.socket.recv(size)
-
-                # If data is None, this means that the socket was closed
-                if not data:
-                    self._on_socket_close()
+                if frame.flags & ~FrameHeader.KNOWN_FLAGS:
+                    raise FramingException("Received a frame with unsupported flags 0x%04x." % frame.flags)
+                if frame.flags & FrameHeader.FLAG_BATCH:
+                    to_return.extend(self._decode_frames(split_frames(frame.payload)))
+                elif frame.flags & FrameHeader.FLAG_COMPRESSED:
+                    to_return.append(self._decode_compressed(frame))
                 else:
-                    data = pickle.loads(data)
-                    return data
-            except OSError:
-                # generally, an OSError here will mean that the socket has been closed.
-                self._on_socket_close()
-        # shutting down means something else is handling cleanup - nothing to do.
-        return None
+                    to_return.append(self.codec.decode(frame.type_id, frame.payload))
+            except (CodecException, CompressionException, FramingException) as e:
+                self.logger.error(str(e))
+        return to_return
+
+    def _decode_compressed(self, frame):
+        if self.compression is None:
+            raise CompressionException("Received a compressed frame, but compression isn't enabled.")
+        start = time.perf_counter()
+        payload = self.compression.decompress(frame.payload)
+        elapsed = time.perf_counter() - start
+        data = self.codec.decode(frame.type_id, payload)
+        self.compression.stats.record_decompress(data.__class__.__name__, elapsed)
+        return data
 
     def _process_data(self, data):
-        response = RequestSuccess(data.uuid)
+        error = None
         try:
             self.data_process_callback(data, self)
         except Exception as e:
             self.logger.error(str(e))
-            response = RequestFail(data.uuid, str(e))
-        if data.requires_response:
-            self.send(response)
+            error = str(e)
+        # most traffic (e.g. every tick's StateUpdates) isn't answered, so responses are only built when needed.
+        if data.requires_response and not self.shutting_down:
+            response = RequestSuccess(data.uuid) if error is None else RequestFail(data.uuid, error)
+            # responses skip the batch - they're written straight to the outbound buffer, where every response to
+            # the frames from a single read ends up coalesced into the same vectored send anyway.
+            self._write(self._encode(response))
 
-    def _handle_send(self, start_lock):
-        """
-        This is the target of the send_thread.
-        :param start_lock: An attribute of a WorkerThread, will block the creating thread until this lock is set.
-        :return:
-        """
-        start_lock.set()
-        while not self.shutting_down:
-            if self.socket.can_write(self._on_socket_close):
-                msg = self._pop_message()
-                if msg is not None:
-                    self._socket_send(msg)
 
-    def _handle_receive(self, start_lock):
-        """
-        This is the target of the receive_thread.
-        :param start_lock: An attribute of a WorkerThread, will block the creating thread until this lock is set.
-        :return:
-        """
-        incoming_request_size = len(pickle.dumps(IncomingRequest(0)))
-        recv_size = incoming_request_size
+class BatchPolicy(object):
+    def __init__(self, max_bytes, max_delay):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
 
-        start_lock.set()
-        while not self.shutting_down:
-            if self.socket.can_read(self._on_socket_close):
-                data = self._socket_receive(size=recv_size)
-                if data is not None:
-                    if isinstance(data, IncomingRequest):
-                        recv_size = data.size
-                    else:
-                        self._process_data(data)
-                        recv_size = incoming_request_size
+
+class OutboundLimit(object):
+    BLOCK = "block"
+    DROP_UNRELIABLE = "drop-unreliable"
+    DISCONNECT = "disconnect"
+
+    def __init__(self, max_bytes, policy):
+        self.max_bytes = max_bytes
+        self.policy = policy
 
 
 class Request(object):
     """
-    This object contains a message and all the connections its been sent to.
+    A future-like handle for a message sent to one or more connections that must each acknowledge it.
 
-    It has the ability to block until all recipients acknowledge receipt.
-
-    Upon receipt of a response from these connections OR
-    if the socket used in the connetion is closed, will
-    check upon pending connection responses and unblock as necessary.
+    Every connection starts out PENDING and moves to SUCCEEDED/FAILED when its RequestSuccess/RequestFail arrives,
+    CLOSED if its socket goes away first, or TIMED_OUT if the request's deadline passes.  Once no connection is
+    pending the request is done: result() stops blocking and every done callback is called, on whichever thread
+    completed the request (usually the reactor thread, so callbacks shouldn't block).
     """
-    def __init__(self, message, connections, blocking):
+    PENDING = "pending"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CLOSED = "closed"
+    TIMED_OUT = "timed-out"
+
+    def __init__(self, message, connections, deadline=None):
+        """
+        :param message: the message being sent.
+        :param connections: the connections the message is sent to.
+        :param deadline: a time.monotonic() timestamp after which pending connections time out, or None.
+        """
         self.message = message
-        self.event = None
-        if blocking:
-            self.event = threading.Event()
-        self.connections = dict((connection, 1) for connection in connections)
-
-    def send(self):
-        if len(self.connections) > 0:
-            for connection in self.connections.keys():
-                connection.send(self.message)
-            if self.event:
-                self.event.wait()
-
-    def notify(self, connection):
-        if connection is None:
-            self.connections = {}
-        else:
-            if connection in self.connections:
-                self.connections.pop(connection)
-        if len(self.connections) == 0 and self.event:
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.callbacks = []
+        self.statuses = dict((connection, Request.PENDING) for connection in connections)
+        self.responses = {}
+        self.remaining = len(self.statuses)
+        # the time.monotonic() timestamp the request was done at - set before result() stops blocking.
+        self.completed_at = None
+        if self.remaining == 0:
+            self.completed_at = time.monotonic()
             self.event.set()
 
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for every connection to answer.
+
+        :param timeout: seconds to wait for - None waits until the request is done.
+        :return: a dictionary of connection to status.
+        """
+        if not self.event.wait(timeout):
+            raise RequestTimeoutException(self.message, timeout)
+        return dict(self.statuses)
+
+    def failures(self):
+        """
+        :return: a dictionary of connection to RequestFail, for every connection that answered with one.
+        """
+        with self.lock:
+            return dict((connection, response) for (connection, response) in self.responses.items() if isinstance(response, RequestFail))
+
+    def add_done_callback(self, callback):
+        """
+        :param callback: called with this request once it's done - immediately, if it already is.
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def notify(self, connection, status, response=None):
+        """
+        Records a pending connection's final status.
+
+        :param connection: the connection, or None to resolve every pending connection with status.
+        :param status: the connection's new status.
+        :param response: the RequestSuccess/RequestFail that resolved the connection, if any.
+        :return: True if this completed the request.
+        """
+        with self.lock:
+            if self.event.is_set():
+                return False
+            if connection is None:
+                connections = [connection for (connection, current) in self.statuses.items() if current == Request.PENDING]
+            else:
+                connections = [connection] if self.statuses.get(connection) == Request.PENDING else []
+            for connection in connections:
+                self.statuses[connection] = status
+                if response is not None:
+                    self.responses[connection] = response
+                self.remaining -= 1
+            if self.remaining > 0:
+                return False
+            callbacks = self.callbacks
+            self.callbacks = []
+            self.completed_at = time.monotonic()
+            self.event.set()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logging.getLogger("request").exception("Unhandled exception in request callback: %s" % str(e))
+        return True
+
+    def expire(self):
+        return self.notify(None, Request.TIMED_OUT)
+
 
 class RequestManager(object):
     """
@@ -375,6 +907,12 @@ class RequestManager(object):
     a message bus.  This way, we can keep all the request blocking behavior
     and memoization of pending requests separate from the message bus, which
     kinda cluttered the code.
+
+    Pending requests are indexed by message uuid, and requests with a deadline are also kept in a heap ordered by
+    deadline.  A single reactor timer is armed for the earliest deadline, so expiring a request costs O(log n) no
+    matter how many are pending.  Completed requests are left in the heap and skipped when they surface.
+
+    The lock only ever guards the index and the heap - it's never held while sending or waiting.
     """
     def __init__(self, bus):
         self.logger = logging.getLogger("request-manager")
@@ -382,32 +920,59 @@ class RequestManager(object):
 
         self.pending_requests_lock = threading.Lock()
         self.pending_requests = {}
+        self.deadlines = []
+        self.deadline_sequence = itertools.count()
+        self.expiry_timer = None
 
-    def send(self, message, connections, blocking=True):
-        request = Request(message, connections, blocking)
+    def send(self, message, connections, blocking=True, timeout=DEFAULT_REQUEST_TIMEOUT):
+        """
+        :param message: the message to send.
+        :param connections: the connections to send it to.
+        :param blocking: if set, waits until the request is done before returning.
+        :param timeout: seconds after which unanswered connections are marked as timed out - None never expires.
+        :return: the Request.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        request = Request(message, connections, deadline)
+        if request.done():
+            return request
         with self.pending_requests_lock:
-            if request.message.uuid in self.pending_requests:
+            if message.uuid in self.pending_requests:
                 raise Exception("Resending a pending request?")
-            self.pending_requests[request.message.uuid] = request
-            request.send()
+            self.pending_requests[message.uuid] = request
+            if deadline is not None:
+                heapq.heappush(self.deadlines, (deadline, next(self.deadline_sequence), request))
+                arm = self.expiry_timer is None or deadline < self.expiry_timer.deadline
+            else:
+                arm = False
+        if arm:
+            self.bus.reactor.call_soon(self._arm_expiry_timer)
+        request.add_done_callback(self._forget)
+
+        # responses can start arriving as soon as the first connection is sent to.
+        for connection in request.statuses:
+            connection.send(message)
+        if blocking:
+            # nothing would answer a request still sitting in a batch.
+            for connection in request.statuses:
+                connection.flush()
+            request.result()
+        return request
 
     def notify(self, connection, request=None):
         """
-        Delegates to the request's notify function, but
-        will also clear the pending_requests dictionary
-        if a request has no more pending connection responses.
-        :param connection:
-        :param request:
-        :return:
+        Tells pending requests that a connection is closed and won't be answering.
+
+        :param connection: the closed connection.
+        :param request: the request to notify - every pending request if None.
         """
         if request is None:
-            requests = list(self.pending_requests.values())
+            with self.pending_requests_lock:
+                requests = list(self.pending_requests.values())
         else:
             requests = [request]
         for request in requests:
-            request.notify(connection)
-            if len(request.connections) == 0:
-                self.pending_requests.pop(request.message.uuid)
+            request.notify(connection, Request.CLOSED)
 
     def on_response(self, data, connection):
         """
@@ -417,9 +982,44 @@ class RequestManager(object):
         :param connection:
         :return:
         """
-        if data.request_id in self.pending_requests:
-            request = self.pending_requests[data.request_id]
-            self.notify(connection, request)
+        with self.pending_requests_lock:
+            request = self.pending_requests.get(data.request_id)
+        if request is not None:
+            status = Request.FAILED if isinstance(data, RequestFail) else Request.SUCCEEDED
+            request.notify(connection, status, data)
+
+    def _forget(self, request):
+        with self.pending_requests_lock:
+            if self.pending_requests.get(request.message.uuid) is request:
+                self.pending_requests.pop(request.message.uuid)
+
+    def _arm_expiry_timer(self):
+        """
+        Makes sure a timer is armed for the earliest deadline.  Runs on the reactor thread.
+        """
+        with self.pending_requests_lock:
+            while self.deadlines and self.deadlines[0][2].done():
+                heapq.heappop(self.deadlines)
+            if not self.deadlines:
+                return
+            deadline = self.deadlines[0][0]
+            if self.expiry_timer is not None:
+                if self.expiry_timer.deadline <= deadline:
+                    return
+                self.expiry_timer.cancel()
+            self.expiry_timer = self.bus.reactor.call_later(deadline - time.monotonic(), self._expire)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = []
+        with self.pending_requests_lock:
+            self.expiry_timer = None
+            while self.deadlines and self.deadlines[0][0] <= now:
+                expired.append(heapq.heappop(self.deadlines)[2])
+        for request in expired:
+            if request.expire():
+                self.logger.warning("Request %s (%s) timed out." % (request.message.uuid, request.message.__class__.__name__))
+        self._arm_expiry_timer()
 
 
 class ConnectionManager(object):
@@ -438,6 +1038,7 @@ class ConnectionManager(object):
         self.connections_by_target_address = {}
 
         self.connection_identification_locks = {}
+        self.handshake_timers = {}
         self.blocking_requests_lock = threading.Lock()
         self.blocking_requests = {}
 
@@ -445,7 +1046,8 @@ class ConnectionManager(object):
         """
         Creates a new Connection between this machine and a target machine.
 
-        Connects, sends an identify request, and blocks until both machines handshake.
+        The caller is expected to send an identify request - if the handshake hasn't completed within the bus'
+        handshake timeout, the connection is closed.
 
         :param target_address: specifies a target to connect a new socket to
         :param target_socket: use this pre-existing socket
@@ -459,6 +1061,10 @@ class ConnectionManager(object):
         self.logger.debug("Accepted connection with %s" % str(connection.target_address))
 
         connection.start()
+        timer = self.bus.reactor.call_later(self.bus.handshake_timeout, self._reap, connection)
+        with self.connections_lock:
+            if connection.target_address in self.connection_identification_locks:
+                self.handshake_timers[connection.target_address] = timer
         return connection
 
     def wait_until_handshake(self, connection):
@@ -470,7 +1076,12 @@ class ConnectionManager(object):
         :param connection:
         :return:
         """
-        self.connection_identification_locks[connection.target_address].wait()
+        with self.connections_lock:
+            event = self.connection_identification_locks.get(connection.target_address)
+        if event is not None:
+            event.wait()
+        if connection.shutting_down or connection.remote_uuid is None:
+            raise HandshakeException(connection.target_address)
 
     def get(self, target_address=None):
         with self.connections_lock:
@@ -481,43 +1092,66 @@ class ConnectionManager(object):
                     raise ClientNotFoundException(client_target_address=target_address)
                 return [self.connections_by_target_address[target_address]]
 
+    def get_client(self, client_id):
+        with self.connections_lock:
+            if client_id not in self.connections_by_id:
+                raise ClientNotFoundException(client_id=client_id)
+            return self.connections_by_id[client_id]
+
+    def get_all(self):
+        """
+        :return: every open connection, whether or not it has been identified yet.
+        """
+        with self.connections_lock:
+            return list(self.connections_by_target_address.values())
+
     def close(self, connection):
+        if connection.datagram is not None:
+            connection.datagram.endpoint.close_channel(connection.datagram)
         with self.connections_lock:
-            if connection.remote_uuid in self.connections_by_id:
+            if self.connections_by_id.get(connection.remote_uuid) is connection:
                 self.connections_by_id.pop(connection.remote_uuid)
-            if connection.target_address in self.connections_by_target_address:
+            if self.connections_by_target_address.get(connection.target_address) is connection:
                 self.connections_by_target_address.pop(connection.target_address)
-            if not connection.shutting_down:
-                connection.close()
+                timer = self.handshake_timers.pop(connection.target_address, None)
+                if timer is not None:
+                    timer.cancel()
+                # anyone still waiting on the handshake will find the connection closed.
+                self.connection_identification_locks.pop(connection.target_address).set()
+        # closing waits on the reactor thread, which might itself be waiting on the connections lock.
+        if not connection.shutting_down:
+            connection.close()
 
     def identify(self, request, connection):
         with self.connections_lock:
             connection.remote_uuid = request.client_id
             self.connections_by_id[connection.remote_uuid] = connection
-            self.connection_identification_locks[connection.target_address].set()
+        if request.datagram_port and self.bus.datagram_endpoint is not None:
+            connection.datagram = self.bus.datagram_endpoint.open_channel(connection, (connection.target_address[0], request.datagram_port))
+        if self.bus.compression is not None:
+            connection.compressor = self.bus.compression.negotiate(request.compression, request.compression_dictionary)
         self.logger.debug("Identified %s:%d as %s" % (connection.target_address[0], connection.target_address[1], connection.remote_uuid))
 
+    def complete_handshake(self, connection):
+        with self.connections_lock:
+            timer = self.handshake_timers.pop(connection.target_address, None)
+            if timer is not None:
+                timer.cancel()
+            if connection.target_address in self.connection_identification_locks:
+                self.connection_identification_locks[connection.target_address].set()
 
-class WorkerThread(threading.Thread):
-    """
-    A worker thread is generally a routine that runs on a separate thread whose target function generally
-    just polls within a while loop for events until a certain state causes the loop to exit.
-
-    I've found that generally, however, we want to block until the thread actually starts polling and rather
-    than store locks everywhere, we can just wrap this functionality within a subclass of a Thread, and mandate
-    that all targeted routines of a WorkerThread properly set the threading.Event when it has begun polling.
-    """
-    def __init__(self, *args, **kwargs):
-        self.start_lock = threading.Event()
-        args = ()
-        if "args" in kwargs:
-            args = kwargs["args"]
-        kwargs["args"] = args + (self.start_lock, )
-        super().__init__(*args, **kwargs)
-
-    def start(self):
-        super().start()
-        self.start_lock.wait()
+    def _reap(self, connection):
+        """
+        Closes a connection that didn't complete its handshake in time - e.g. a half-open socket, or a client that
+        connected and never identified.  Runs on the reactor thread.
+        """
+        with self.connections_lock:
+            self.handshake_timers.pop(connection.target_address, None)
+            event = self.connection_identification_locks.get(connection.target_address)
+            if event is None or event.is_set() or self.connections_by_target_address.get(connection.target_address) is not connection:
+                return
+        self.logger.warning("Handshake with %s:%d timed out - closing the connection" % connection.target_address)
+        self.bus.handle_closed_remote_socket(connection)
 
 
 class ConnectionException(Exception):
@@ -534,34 +1168,12 @@ class ClientNotFoundException(ConnectionException):
             message = "Client %s:%d not found." % client_target_address
         super().__init__(message)
 
-# Here, I'm going to monkey patch some 'helpful' methods here onto socket.socket.
-# Basically, when I work with sockets, I use these can_read
-# and can_write helper methods to help determine if it's worthwhile
-# to block on a read/write.  However, since I use sockets in more
-# than one place, it seems 'cleaner' to patch it onto the socket object
-# in lieu of subclassing (which doesn't work with accept) or writing
-# a helper set of static methods that take a socket and a callback
-# as an argument.
-def can_read(self, socket_close_callback):
-    try:
-        inputs, _, closed = select.select([self], [], [self], 0.1)
-    except OSError:
-        inputs = []
-        closed = [self]
-    if len(closed) > 0:
-        socket_close_callback()
-    return len(inputs) > 0 and len(closed) == 0
-
-
-def can_write(self, socket_close_callback):
-    try:
-        _, outputs, closed = select.select([], [self], [self], 0.1)
-    except OSError:
-        outputs = []
-        closed = [self]
-    if len(closed) > 0:
-        socket_close_callback()
-    return len(outputs) > 0 and len(closed) == 0
-
-socket.socket.can_read = can_read
-socket.socket.can_write = can_write
+
+class HandshakeException(ConnectionException):
+    def __init__(self, target_address):
+        super().__init__("Handshake with %s:%d didn't complete." % target_address)
+
+
+class RequestTimeoutException(Exception):
+    def __init__(self, message, timeout):
+        super().__init__("Request %s (%s) didn't complete within %.2f seconds." % (message.uuid, message.__class__.__name__, timeout))
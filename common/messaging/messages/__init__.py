@@ -1,8 +1,10 @@
 import uuid
-import struct
 
 
 class BaseMessage(object):
+    # identifies the message class in a frame header - unique per concrete message class.
+    type_id = 0
+
     def __init__(self):
         self.uuid = str(uuid.uuid4())
         self.requires_response = False
@@ -15,16 +17,102 @@ class BaseRequest(BaseMessage):
 
 
 class Print(BaseRequest):
+    type_id = 1
+
     def __init__(self, message):
         super().__init__()
         self.message = message
 
 
 class Identify(BaseRequest):
-    def __init__(self, client_id, target_address):
+    type_id = 2
+
+    def __init__(self, client_id, target_address, datagram_port=0, compression="", compression_dictionary=""):
         super().__init__()
         self.client_id = client_id
         self.target_address = target_address
+        # the port of the sender's datagram channel, or 0 if it doesn't have one.
+        self.datagram_port = datagram_port
+        # the compression algorithms the sender accepts (comma separated, most preferred first), and the id of the
+        # dictionary it has - both empty if it doesn't compress.
+        self.compression = compression
+        self.compression_dictionary = compression_dictionary
+
+
+class BaseUnreliableMessage(BaseMessage):
+    """
+    Unreliable messages are never acknowledged and never tracked as pending requests.
+
+    If a message with the same coalesce key is queued on a connection before an older one has been written, the
+    older one is dropped - only the latest value is ever sent.
+    """
+    def __init__(self):
+        super().__init__()
+
+    def coalesce_key(self):
+        """
+        :return: a hashable key identifying what this message supersedes, or None if it never supersedes anything.
+        """
+        return None
+
+
+class StateUpdate(BaseUnreliableMessage):
+    type_id = 6
+
+    def __init__(self, key, state):
+        super().__init__()
+        self.key = key
+        self.state = state
+
+    def coalesce_key(self):
+        return (self.__class__, self.key)
+
+
+class InputMessage(BaseUnreliableMessage):
+    type_id = 7
+
+    def __init__(self, client_id, inputs, session_id=""):
+        super().__init__()
+        self.client_id = client_id
+        self.inputs = inputs
+        # the game the inputs are for, on hosts that run more than one.
+        self.session_id = session_id
+
+    def coalesce_key(self):
+        return (self.__class__, self.session_id, self.client_id)
+
+
+class StateSnapshot(BaseUnreliableMessage):
+    type_id = 8
+
+    def __init__(self, session_id, tick, entities, removed=(), baseline_tick=0, delta=False):
+        super().__init__()
+        self.session_id = session_id
+        self.tick = tick
+        # entity id to a dictionary of field to value - every field of every entity in a full snapshot, and only
+        # the entities and fields that changed since the baseline in a delta.
+        self.entities = entities
+        # ids of the entities that existed at the baseline, but don't anymore.
+        self.removed = list(removed)
+        self.baseline_tick = baseline_tick
+        self.delta = delta
+
+    def coalesce_key(self):
+        return (self.__class__, self.session_id)
+
+
+class SnapshotAck(BaseUnreliableMessage):
+    type_id = 9
+
+    def __init__(self, session_id, client_id, tick):
+        super().__init__()
+        self.session_id = session_id
+        self.client_id = client_id
+        # the newest snapshot the client has - the host sends deltas against it from then on.
+        self.tick = tick
+
+    def coalesce_key(self):
+        return (self.__class__, self.session_id, self.client_id)
 
 
 class BaseResponse(BaseMessage):
@@ -34,56 +122,26 @@ class BaseResponse(BaseMessage):
 
 
 class RequestFail(BaseResponse):
+    type_id = 3
+
     def __init__(self, request_id, error):
         super().__init__(request_id)
         self.error = error
 
 
 class RequestSuccess(BaseResponse):
+    type_id = 4
+
     def __init__(self, request_id):
         super().__init__(request_id)
 
 
 class CreateGame(BaseRequest):
-    def __init__(self, client_id, configuration):
+    type_id = 5
+
+    def __init__(self, client_id, configuration, session_id=None):
         super().__init__()
         self.client_id = client_id
         self.configuration = configuration
-
-
-class IncomingRequest(BaseMessage):
-    def __init__(self, size):
-        super().__init__()
-        self.size = size
-
-    def __getstate__(self):
-        """
-        We have a problem - we need this request to be a constant size as its required to
-        fetch subsequent requests off of the size attribute.
-
-        However, when pickling integers (like our size attribute), I've found that they tend
-        to have variable lengths - for example, an IncomingRequest with size attribute 240 might result
-        in a pickled IncomingRequest of 148 bytes.  However, an Incoming request of size attribute sys.maxsize
-        might result in a pickled IncomingRequest of 151 bytes.
-
-        This has a direct effect on how we pass messages - tell a socket to only read 148 bytes when our
-        IncomingRequest is 151 bytes, and the pickler will fail with an EOF error.  Tell a socket to read
-        151 bytes when our IncomingRequest is 148 bytes, and we'll accidentally read 3 bytes of the next
-        message on the socket, causing an error when we attempt to read the next message.
-
-        This means we have to convert the integer into a format that will be of a consistent
-        size.
-        :return:
-        """
-        new_dict = self.__dict__.copy()
-        int_size = self.size
-        del new_dict['size']
-        bytes_size = struct.pack('!I', int_size)
-        new_dict['size'] = bytes_size
-        return new_dict
-
-    def __setstate__(self, state):
-        self.__dict__.update(state)
-        bytes_size = self.size
-        int_size = struct.unpack('!I', bytes_size)[0]
-        self.size = int_size
+        # chosen by the client, so that it can address the game without waiting to be told its id.
+        self.session_id = session_id if session_id is not None else str(uuid.uuid4())
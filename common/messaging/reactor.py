@@ -0,0 +1,223 @@
+import collections
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+from ..app_logging import logging
+
+
+class Reactor(object):
+    """
+    A reactor owns a single selector and a single thread that waits on it.
+
+    Instead of every socket getting its own polling threads, sockets are registered here along with a callback.
+    The reactor thread sleeps inside of select() until one of those sockets is ready, and then invokes the
+    callback with the ready events - so the number of threads stays constant no matter how many connections
+    exist, and an idle reactor uses no CPU at all.
+
+    Selector registrations must only be modified from the reactor thread.  Other threads hand work to the reactor
+    with call_soon (fire and forget), call_later (after a delay) or call (wait for the result), all of which wake
+    the selector up through a socket pair.
+    """
+    def __init__(self, name):
+        self.logger = logging.getLogger("reactor")
+        self.name = name
+        self.selector = None
+        self.thread = None
+        self.running = False
+        self.shutting_down = False
+        self.calls_lock = threading.Lock()
+        self.calls = collections.deque()
+        self.timers = []
+        self.timer_sequence = itertools.count()
+        self.wakeup_receiver = None
+        self.wakeup_sender = None
+
+    def start(self):
+        self.shutting_down = False
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ, self._on_wakeup)
+        with self.calls_lock:
+            self.running = True
+        self.thread = WorkerThread(name=self.name, target=self._run)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.shutting_down = True
+        self._wakeup()
+        if not self.in_reactor_thread():
+            self.thread.join()
+            self.thread = None
+
+    def in_reactor_thread(self):
+        return self.thread is not None and threading.current_thread() is self.thread
+
+    def register(self, sock, events, callback):
+        """
+        :param sock: the socket to watch.
+        :param events: a mask of selectors.EVENT_READ and/or selectors.EVENT_WRITE.
+        :param callback: invoked from the reactor thread with the mask of ready events.
+        """
+        self.selector.register(sock, events, callback)
+
+    def modify(self, sock, events, callback):
+        self.selector.modify(sock, events, callback)
+
+    def unregister(self, sock):
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def call_soon(self, func, *args):
+        """
+        Schedules func to run on the reactor thread.
+
+        :return: False if the reactor isn't running (and func will never be called), True otherwise.
+        """
+        with self.calls_lock:
+            if not self.running:
+                return False
+            self.calls.append((func, args))
+        self._wakeup()
+        return True
+
+    def call_later(self, delay, func, *args):
+        """
+        Schedules func to run on the reactor thread after delay seconds.
+
+        :return: a Timer that can be cancelled, or None if the reactor isn't running.
+        """
+        timer = Timer(time.monotonic() + delay, func, args)
+        with self.calls_lock:
+            if not self.running:
+                return None
+            heapq.heappush(self.timers, (timer.deadline, next(self.timer_sequence), timer))
+        self._wakeup()
+        return timer
+
+    def call(self, func, *args):
+        """
+        Runs func on the reactor thread and waits for it to finish.  If we're already on the reactor thread, or the
+        reactor isn't running, func is simply called directly.
+        """
+        if self.in_reactor_thread():
+            return func(*args)
+
+        done = threading.Event()
+        result = []
+
+        def run():
+            try:
+                result.append(func(*args))
+            finally:
+                done.set()
+
+        if not self.call_soon(run):
+            return func(*args)
+        done.wait()
+        return result[0] if result else None
+
+    def _wakeup(self):
+        try:
+            self.wakeup_sender.send(b'\0')
+        except (AttributeError, OSError):
+            # either the reactor was never started, or a wakeup is already pending in a full socket buffer.
+            pass
+
+    def _on_wakeup(self, mask):
+        try:
+            while self.wakeup_receiver.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _run_calls(self):
+        while True:
+            with self.calls_lock:
+                if not self.calls:
+                    return
+                (func, args) = self.calls.popleft()
+            self._invoke(func, *args)
+
+    def _run_timers(self):
+        """
+        Runs every timer that's due.
+
+        :return: the number of seconds until the next timer is due, or None if there are no timers.
+        """
+        while True:
+            with self.calls_lock:
+                if not self.timers:
+                    return None
+                (deadline, _, timer) = self.timers[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                heapq.heappop(self.timers)
+            if not timer.cancelled:
+                self._invoke(timer.func, *timer.args)
+
+    def _invoke(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            self.logger.exception("Unhandled exception in reactor %s: %s" % (self.name, str(e)))
+
+    def _run(self, start_lock):
+        start_lock.set()
+        timeout = None
+        while not self.shutting_down:
+            for (key, mask) in self.selector.select(timeout):
+                self._invoke(key.data, mask)
+            self._run_calls()
+            timeout = self._run_timers()
+
+        with self.calls_lock:
+            self.running = False
+            self.timers = []
+        self._run_calls()
+
+        self.selector.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+
+class Timer(object):
+    def __init__(self, deadline, func, args):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class WorkerThread(threading.Thread):
+    """
+    A worker thread is generally a routine that runs on a separate thread whose target function generally
+    just polls within a while loop for events until a certain state causes the loop to exit.
+
+    I've found that generally, however, we want to block until the thread actually starts polling and rather
+    than store locks everywhere, we can just wrap this functionality within a subclass of a Thread, and mandate
+    that all targeted routines of a WorkerThread properly set the threading.Event when it has begun polling.
+    """
+    def __init__(self, *args, **kwargs):
+        self.start_lock = threading.Event()
+        args = ()
+        if "args" in kwargs:
+            args = kwargs["args"]
+        kwargs["args"] = args + (self.start_lock, )
+        super().__init__(*args, **kwargs)
+
+    def start(self):
+        super().start()
+        self.start_lock.wait()
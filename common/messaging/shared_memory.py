@@ -0,0 +1,297 @@
+import multiprocessing
+import platform
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from .message_bus import MessageBus
+from .codec import CodecException, create_codec
+from .framing import Frame, FrameHeader, FramingException, encode_frame
+from .reactor import WorkerThread
+from ..app_logging import logging
+
+
+class SharedRing(object):
+    """
+    A single-producer, single-consumer ring buffer of frames in a multiprocessing.shared_memory block.
+
+    The block starts with these fields, on separate cache lines for each side so the two never write to the same
+    one:
+
+        head (8 bytes) - the total number of bytes ever written, only ever written by the producer.
+        tail (8 bytes) - the total number of bytes ever read, only ever written by the consumer.
+        waiting (8 bytes) - set by the consumer while it's blocked in wait, next to tail.
+        closed (1 byte) - set by the producer once it won't write anything else.
+
+    followed by the ring itself.  Frames are written at head (wrapping around the end of the ring) and head is only
+    advanced once the whole frame is in place, so the consumer never sees a partial frame - and since each counter
+    has a single writer, no locks are needed where aligned 8-byte stores are atomic and aren't reordered with the
+    stores before them, as on x86.  Elsewhere (e.g. ARM), the fields are read and written under a lock, whose
+    acquire and release synchronize memory between the two processes.
+
+    A consumer with nothing to read can block on the ring's doorbell, an Event the producer sets after writing -
+    but only while the consumer says it's waiting, so a busy ring costs the producer nothing.
+    """
+    COUNTER = struct.Struct('=Q')
+    HEAD_OFFSET = 0
+    TAIL_OFFSET = 64
+    WAITING_OFFSET = 72
+    CLOSED_OFFSET = 128
+    DATA_OFFSET = 192
+    # whether this machine keeps stores in order, so the fields can be published without a lock.
+    STRONGLY_ORDERED = platform.machine().lower() in ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+
+    def __init__(self, memory, owner, doorbell=None, lock=None):
+        """
+        Use create or attach rather than calling this directly.
+
+        :param memory: the SharedMemory block.
+        :param owner: if set, the block is unlinked when the ring is released.
+        :param doorbell: the Event the producer sets when it writes to a waiting consumer - without one, wait just
+            sleeps.
+        :param lock: the lock the fields are accessed under, on machines that need one.
+        """
+        self.memory = memory
+        self.owner = owner
+        self.doorbell = doorbell
+        self.lock = lock
+        self.capacity = memory.size - self.DATA_OFFSET
+        self.header = memory.buf[:self.DATA_OFFSET]
+        self.data = memory.buf[self.DATA_OFFSET:self.DATA_OFFSET + self.capacity]
+
+    @classmethod
+    def create(cls, capacity=4 * 1024 * 1024, context=None):
+        """
+        :param context: the multiprocessing context the other side's process is started with - spawn by default.
+        """
+        context = context or multiprocessing.get_context("spawn")
+        lock = None if cls.STRONGLY_ORDERED else context.Lock()
+        return cls(shared_memory.SharedMemory(create=True, size=cls.DATA_OFFSET + capacity), True, context.Event(), lock)
+
+    @classmethod
+    def attach(cls, name, doorbell=None, lock=None):
+        """
+        Attaches to a ring another process created - pass it the ring's handle when starting the process, and call
+        this with its contents.
+        """
+        return cls(shared_memory.SharedMemory(name=name), False, doorbell, lock)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def handle(self):
+        """
+        :return: what attach needs, to be handed to a process as it's started.
+        """
+        return (self.name, self.doorbell, self.lock)
+
+    def free_space(self):
+        return self.capacity - (self._get(self.HEAD_OFFSET) - self._get(self.TAIL_OFFSET))
+
+    def try_write(self, buffers):
+        """
+        Producer side.  Writes a frame if there's room for it.
+
+        :param buffers: the buffers making up a single frame.
+        :return: False if the ring is too full right now.
+        """
+        size = sum(len(buffer) for buffer in buffers)
+        if size > self.capacity:
+            raise FramingException("Frame of %d bytes doesn't fit in a ring of %d bytes." % (size, self.capacity))
+        head = self._get(self.HEAD_OFFSET)
+        if self.capacity - (head - self._get(self.TAIL_OFFSET)) < size:
+            return False
+        position = head
+        for buffer in buffers:
+            self._copy_in(position, buffer)
+            position += len(buffer)
+        self._set(self.HEAD_OFFSET, position)
+        if self.doorbell is not None and self._get(self.WAITING_OFFSET):
+            self.doorbell.set()
+        return True
+
+    def read(self):
+        """
+        Consumer side.
+
+        :return: every complete frame in the ring, with its payload copied out.
+        """
+        head = self._get(self.HEAD_OFFSET)
+        tail = self._get(self.TAIL_OFFSET)
+        to_return = []
+        while head - tail >= FrameHeader.SIZE:
+            (length, type_id, flags) = FrameHeader.unpack_from(self._copy_out(tail, FrameHeader.SIZE))
+            to_return.append(Frame(type_id, flags, self._copy_out(tail + FrameHeader.SIZE, length)))
+            tail += FrameHeader.SIZE + length
+        if to_return:
+            self._set(self.TAIL_OFFSET, tail)
+        return to_return
+
+    def wait(self, timeout):
+        """
+        Consumer side.  Blocks until the producer writes to the ring or closes it, or wake is called.  A write that
+        races with the consumer starting to wait on a strongly ordered machine can go unnoticed, so timeout also
+        bounds how late a frame is read.
+
+        :param timeout: the most seconds to wait for.
+        """
+        if self.doorbell is None:
+            time.sleep(timeout)
+            return
+        self._set(self.WAITING_OFFSET, 1)
+        self.doorbell.clear()
+        if self._get(self.HEAD_OFFSET) == self._get(self.TAIL_OFFSET) and not self.closed():
+            self.doorbell.wait(timeout)
+        self._set(self.WAITING_OFFSET, 0)
+
+    def wake(self):
+        """
+        Wakes the consumer up from wait, if it's waiting.
+        """
+        if self.doorbell is not None:
+            self.doorbell.set()
+
+    def close(self):
+        if self.lock is None:
+            self.header[self.CLOSED_OFFSET] = 1
+        else:
+            with self.lock:
+                self.header[self.CLOSED_OFFSET] = 1
+        self.wake()
+
+    def closed(self):
+        if self.lock is None:
+            return self.header[self.CLOSED_OFFSET] == 1
+        with self.lock:
+            return self.header[self.CLOSED_OFFSET] == 1
+
+    def release(self):
+        """
+        Detaches from the shared memory block - and destroys it, if this side created it.
+        """
+        self.header.release()
+        self.data.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def _get(self, offset):
+        if self.lock is None:
+            return self.COUNTER.unpack_from(self.header, offset)[0]
+        with self.lock:
+            return self.COUNTER.unpack_from(self.header, offset)[0]
+
+    def _set(self, offset, value):
+        if self.lock is None:
+            self.COUNTER.pack_into(self.header, offset, value)
+            return
+        with self.lock:
+            self.COUNTER.pack_into(self.header, offset, value)
+
+    def _copy_in(self, position, buffer):
+        offset = position % self.capacity
+        first = min(len(buffer), self.capacity - offset)
+        self.data[offset:offset + first] = buffer[:first]
+        if first < len(buffer):
+            self.data[:len(buffer) - first] = buffer[first:]
+
+    def _copy_out(self, position, size):
+        offset = position % self.capacity
+        first = min(size, self.capacity - offset)
+        if first == size:
+            return bytes(self.data[offset:offset + size])
+        return bytes(self.data[offset:]) + bytes(self.data[:size - first])
+
+
+class SharedMemoryMessageBus(MessageBus):
+    # how long the reader (or a writer waiting on a full ring) sleeps when there's nothing to do - doubling from the
+    # minimum up to the maximum while it stays idle.
+    MIN_IDLE_SLEEP = 0.00005
+    MAX_IDLE_SLEEP = 0.001
+    # once the reader has backed off to the maximum, it blocks on the ring's doorbell instead - for at most this long.
+    IDLE_WAIT = 0.1
+
+    def __init__(self, bus_uuid, outbound, inbound):
+        """
+        A message bus between two processes on the same machine, over a pair of SharedRings - each side writes to
+        one and reads from the other.
+
+        Like LocalMessageBus, messages aren't acknowledged.  Unlike it, handlers run on this bus' reader thread
+        rather than in the sender's thread, so the two sides don't share a core or a GIL.
+
+        :param bus_uuid: the UUID of the class that spawned this.
+        :param outbound: the ring this side writes to.
+        :param inbound: the ring this side reads from.
+        """
+        super().__init__(bus_uuid)
+        self.logger = logging.getLogger("%s-shared-memory" % bus_uuid)
+        self.codec = create_codec()
+        self.outbound = outbound
+        self.inbound = inbound
+        # the ring only supports a single producer, so threads in this process take turns.
+        self.send_lock = threading.Lock()
+        self.shutting_down = False
+        self.thread = None
+
+    def start(self, *args):
+        super().start()
+        self.shutting_down = False
+        self.thread = WorkerThread(name="%s-shared-memory" % self.uuid, target=self._receive)
+        self.thread.start()
+
+    def send(self, message):
+        (type_id, payload) = self.codec.encode(message)
+        buffers = encode_frame(payload, type_id)
+        with self.send_lock:
+            sleep = self.MIN_IDLE_SLEEP
+            while not self.outbound.try_write(buffers):
+                if self.shutting_down:
+                    return
+                time.sleep(sleep)
+                sleep = min(sleep * 2, self.MAX_IDLE_SLEEP)
+
+    def stop(self):
+        """
+        Tells the other side nothing else is coming, and stops reading.
+        """
+        super().stop()
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        self.outbound.close()
+        self.inbound.wake()
+        self.join()
+
+    def join(self):
+        """
+        Waits until the reader thread exits - either because this bus was stopped, or because the other side was.
+        """
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _receive(self, start_lock):
+        start_lock.set()
+        sleep = self.MIN_IDLE_SLEEP
+        while not self.shutting_down:
+            # check before reading, so that nothing written right before the other side closed is missed.
+            closed = self.inbound.closed()
+            frames = self.inbound.read()
+            if not frames:
+                if closed:
+                    break
+                if sleep < self.MAX_IDLE_SLEEP:
+                    time.sleep(sleep)
+                    sleep *= 2
+                else:
+                    self.inbound.wait(self.IDLE_WAIT)
+                continue
+            sleep = self.MIN_IDLE_SLEEP
+            for frame in frames:
+                try:
+                    self.dispatch_table.dispatch(self.codec.decode(frame.type_id, frame.payload))
+                except CodecException as e:
+                    self.logger.error(str(e))
+                except Exception as e:
+                    self.logger.exception("Unhandled exception in data handler: %s" % str(e))
+        self.logger.info("shared memory message bus stopped")
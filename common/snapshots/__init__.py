@@ -0,0 +1 @@
+from .snapshots import Snapshot, SnapshotDecoder, SnapshotEncoder, apply, diff
@@ -0,0 +1,132 @@
+"""
+Compares the bytes per tick of full and delta snapshots.
+
+Run with:  python -m common.snapshots.benchmark [--json FILE] [options]
+"""
+import argparse
+import random
+from ..benchmark import add_json_argument, report
+from ..messaging.codec import create_codec
+from ..messaging.messages import StateSnapshot
+from .snapshots import Snapshot, SnapshotDecoder, SnapshotEncoder
+
+
+class BoardSimulation(object):
+    """
+    A rough stand-in for a game of Bomberman, for generating snapshots - players wander about the board and drop
+    bombs, which go off a few seconds later and take out the destructable walls around them.
+    """
+    BOMB_TICKS = 180
+
+    def __init__(self, players, dimensions=(15, 13), seed=0):
+        self.random = random.Random(seed)
+        self.dimensions = dimensions
+        self.tick = 0
+        self.entities = {}
+        corners = [(0, 0), (dimensions[0] - 1, dimensions[1] - 1), (dimensions[0] - 1, 0), (0, dimensions[1] - 1)]
+        for num in range(players):
+            (col, row) = corners[num % len(corners)] if num < len(corners) else self.free_cell()
+            self.entities["player-%d" % num] = {'position': (col, row), 'alive': True, 'bombs': 1, 'range': 2}
+        for row in range(dimensions[1]):
+            for col in range(dimensions[0]):
+                # indestructable walls sit on every other cell, and never change - they're part of the map.
+                if (col % 2 and row % 2) or self.near_player((col, row)) or self.random.random() < 0.4:
+                    continue
+                self.entities["wall-%d-%d" % (col, row)] = {'position': (col, row)}
+
+    def free_cell(self):
+        while True:
+            cell = (self.random.randrange(self.dimensions[0]), self.random.randrange(self.dimensions[1]))
+            if not (cell[0] % 2 and cell[1] % 2):
+                return cell
+
+    def near_player(self, cell):
+        return any(abs(fields['position'][0] - cell[0]) + abs(fields['position'][1] - cell[1]) <= 1
+                   for (entity_id, fields) in self.entities.items() if entity_id.startswith("player-"))
+
+    def step(self):
+        self.tick += 1
+        for (entity_id, fields) in list(self.entities.items()):
+            if entity_id.startswith("player-") and fields['alive'] and self.random.random() < 0.25:
+                self.move(entity_id, fields)
+            elif entity_id.startswith("bomb-") and fields['detonates_at'] <= self.tick:
+                self.detonate(entity_id, fields)
+        return Snapshot(self.tick, dict(self.entities))
+
+    def move(self, entity_id, fields):
+        (col, row) = fields['position']
+        (d_col, d_row) = self.random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+        target = (col + d_col, row + d_row)
+        if not (0 <= target[0] < self.dimensions[0] and 0 <= target[1] < self.dimensions[1]) or (target[0] % 2 and target[1] % 2):
+            return
+        if "wall-%d-%d" % target in self.entities:
+            return
+        self.entities[entity_id] = dict(fields, position=target)
+        if self.random.random() < 0.05:
+            self.entities["bomb-%d-%s" % (self.tick, entity_id)] = {'position': target, 'range': fields['range'], 'detonates_at': self.tick + self.BOMB_TICKS}
+
+    def detonate(self, entity_id, fields):
+        del self.entities[entity_id]
+        (col, row) = fields['position']
+        for (d_col, d_row) in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            for distance in range(1, fields['range'] + 1):
+                wall_id = "wall-%d-%d" % (col + d_col * distance, row + d_row * distance)
+                if wall_id in self.entities:
+                    del self.entities[wall_id]
+                    break
+
+
+def run_snapshots(players, args):
+    codec = create_codec()
+    simulation = BoardSimulation(players, seed=args.seed)
+    encoder = SnapshotEncoder("benchmark")
+    decoders = dict(("client-%d" % num, SnapshotDecoder("client-%d" % num)) for num in range(players))
+    loss = random.Random(args.seed)
+    full_bytes = 0
+    delta_bytes = 0
+    for _ in range(args.ticks):
+        snapshot = simulation.step()
+        full_bytes += players * len(codec.encode(StateSnapshot("benchmark", snapshot.tick, snapshot.entities))[1])
+        for (client_id, message) in encoder.encode(snapshot, decoders.keys()):
+            delta_bytes += len(codec.encode(message)[1])
+            # lose snapshots and acks alike.
+            if loss.random() < args.loss:
+                continue
+            decoder = decoders[client_id]
+            if decoder.decode(codec.decode(*codec.encode(message))) is None:
+                continue
+            if loss.random() >= args.loss:
+                ack = decoder.acknowledgement("benchmark")
+                encoder.acknowledge(ack.client_id, ack.tick)
+    sent = args.ticks * players
+    return {
+        'players': players,
+        'loss': args.loss,
+        'full_bytes_per_tick': full_bytes / args.ticks,
+        'delta_bytes_per_tick': delta_bytes / args.ticks,
+        'bytes_per_snapshot': delta_bytes / sent,
+        'savings': 1 - delta_bytes / full_bytes,
+        'full_snapshots': encoder.full_snapshots,
+        'delta_snapshots': encoder.delta_snapshots,
+    }
+
+
+def benchmark_snapshots(args):
+    return [run_snapshots(players, args) for players in args.players]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full and delta snapshot bandwidth on a 15x13 board.")
+    add_json_argument(parser)
+    parser.add_argument("--players", type=lambda value: [int(num) for num in value.split(",")], default=[4, 6, 8],
+                        help="Comma separated player counts - each player is also a client.")
+    parser.add_argument("--ticks", type=int, default=1200)
+    parser.add_argument("--loss", type=float, default=0.0, help="The fraction of snapshots and acks lost.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = benchmark_snapshots(args)
+    report('snapshots', args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import collections
+from ..messaging.messages import SnapshotAck, StateSnapshot
+
+
+class Snapshot(object):
+    def __init__(self, tick, entities):
+        """
+        A game's state at the end of a tick.
+
+        :param tick: the tick number.
+        :param entities: a dictionary of entity id to a dictionary of field to value.  An entity always has the same
+            fields - deltas only describe fields that changed, not fields that went away.  Snapshots are never
+            modified once made, so they share unchanged entities' dictionaries with each other.
+        """
+        self.tick = tick
+        self.entities = entities
+
+
+def diff(baseline, current):
+    """
+    :return: a (changed, removed) tuple - the entities and fields in current that differ from baseline, and the ids
+        of the entities in baseline that aren't in current.
+    """
+    changed = {}
+    for (entity_id, fields) in current.entities.items():
+        previous = baseline.entities.get(entity_id)
+        if previous is None:
+            changed[entity_id] = fields
+        elif previous is not fields:
+            delta = dict((key, value) for (key, value) in fields.items() if key not in previous or previous[key] != value)
+            if delta:
+                changed[entity_id] = delta
+    removed = [entity_id for entity_id in baseline.entities if entity_id not in current.entities]
+    return changed, removed
+
+
+def apply(baseline, tick, changed, removed):
+    """
+    The inverse of diff.
+
+    :return: the Snapshot that baseline becomes once changed and removed are applied to it.
+    """
+    entities = dict(baseline.entities)
+    for entity_id in removed:
+        entities.pop(entity_id, None)
+    for (entity_id, fields) in changed.items():
+        if entity_id in entities:
+            merged = dict(entities[entity_id])
+            merged.update(fields)
+            entities[entity_id] = merged
+        else:
+            entities[entity_id] = fields
+    return Snapshot(tick, entities)
+
+
+class SnapshotEncoder(object):
+    def __init__(self, session_id, history=64):
+        """
+        The host's side of a game's snapshots.
+
+        Each client acknowledges the newest snapshot it has, and is sent deltas against that one from then on - so
+        a lost delta costs nothing but a slightly larger one next tick.  Clients that haven't acknowledged anything
+        yet, or whose last acknowledgement is older than the history kept here (e.g. because their acks are being
+        lost), are sent full snapshots until they catch up.
+
+        :param session_id: the game the snapshots describe.
+        :param history: how many of the most recent snapshots are kept to diff against.
+        """
+        self.session_id = session_id
+        self.history = history
+        self.snapshots = {}
+        self.ticks = collections.deque()
+        self.acknowledged = {}
+        self.full_snapshots = 0
+        self.delta_snapshots = 0
+
+    def acknowledge(self, client_id, tick):
+        # acks can arrive out of order - never move a client's baseline backwards.
+        if tick > self.acknowledged.get(client_id, -1):
+            self.acknowledged[client_id] = tick
+
+    def forget(self, client_id):
+        self.acknowledged.pop(client_id, None)
+
+    def encode(self, snapshot, clients):
+        """
+        Records snapshot as the newest one.
+
+        :param clients: the client ids to send it to.
+        :return: a list of (client id, StateSnapshot) tuples, one per client.
+        """
+        self.snapshots[snapshot.tick] = snapshot
+        self.ticks.append(snapshot.tick)
+        while len(self.ticks) > self.history:
+            del self.snapshots[self.ticks.popleft()]
+
+        to_return = []
+        # clients that acknowledged the same snapshot get the same delta.
+        deltas = {}
+        for client_id in clients:
+            baseline = self.snapshots.get(self.acknowledged.get(client_id))
+            if baseline is None or baseline is snapshot:
+                self.full_snapshots += 1
+                to_return.append((client_id, StateSnapshot(self.session_id, snapshot.tick, snapshot.entities)))
+                continue
+            if baseline.tick not in deltas:
+                deltas[baseline.tick] = diff(baseline, snapshot)
+            (changed, removed) = deltas[baseline.tick]
+            self.delta_snapshots += 1
+            to_return.append((client_id, StateSnapshot(self.session_id, snapshot.tick, changed, removed, baseline.tick, True)))
+        return to_return
+
+
+class SnapshotDecoder(object):
+    def __init__(self, client_id, history=64):
+        """
+        A client's side of a game's snapshots - rebuilds full snapshots out of deltas, and acknowledges them.
+
+        :param client_id: the client id acknowledgements are sent as.
+        :param history: how many of the most recent snapshots are kept for deltas to apply to - at least as many
+            as the host keeps.
+        """
+        self.client_id = client_id
+        self.history = history
+        self.snapshots = {}
+        self.ticks = collections.deque()
+        self.latest = None
+
+    def decode(self, message):
+        """
+        :return: the Snapshot message describes, or None if it's older than what we already have, or is a delta
+            against a snapshot we don't have.
+        """
+        if self.latest is not None and message.tick <= self.latest.tick:
+            return None
+        if message.delta:
+            baseline = self.snapshots.get(message.baseline_tick)
+            if baseline is None:
+                return None
+            snapshot = apply(baseline, message.tick, message.entities, message.removed)
+        else:
+            snapshot = Snapshot(message.tick, message.entities)
+
+        self.snapshots[snapshot.tick] = snapshot
+        self.ticks.append(snapshot.tick)
+        while len(self.ticks) > self.history:
+            del self.snapshots[self.ticks.popleft()]
+        self.latest = snapshot
+        return snapshot
+
+    def acknowledgement(self, session_id):
+        """
+        :return: a SnapshotAck for the newest snapshot, or None if there isn't one yet.
+        """
+        if self.latest is None:
+            return None
+        return SnapshotAck(session_id, self.client_id, self.latest.tick)
@@ -0,0 +1,84 @@
+import random
+import unittest
+from . import *
+from .benchmark import BoardSimulation
+from ..messaging.codec import create_codec
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.player = {'position': (0, 0), 'alive': True}
+        self.wall = {'position': (2, 0)}
+        self.baseline = Snapshot(1, {'player-1': self.player, 'wall-2-0': self.wall})
+
+    def testDiff(self):
+        current = Snapshot(2, {'player-1': dict(self.player, position=(1, 0)), 'bomb-1': {'position': (1, 0)}})
+        (changed, removed) = diff(self.baseline, current)
+        self.assertEqual(changed, {'player-1': {'position': (1, 0)}, 'bomb-1': {'position': (1, 0)}})
+        self.assertEqual(removed, ['wall-2-0'])
+        self.assertEqual(apply(self.baseline, 2, changed, removed).entities, current.entities)
+
+    def testUnchangedEntitiesAreSkipped(self):
+        current = Snapshot(2, {'player-1': self.player, 'wall-2-0': dict(self.wall)})
+        self.assertEqual(diff(self.baseline, current), ({}, []))
+
+    def testFullUntilAcknowledged(self):
+        encoder = SnapshotEncoder("game-1")
+        [(_, first)] = encoder.encode(self.baseline, ["client-1"])
+        self.assertFalse(first.delta)
+        [(_, second)] = encoder.encode(Snapshot(2, self.baseline.entities), ["client-1"])
+        self.assertFalse(second.delta)
+
+        encoder.acknowledge("client-1", 2)
+        # a late ack for an older snapshot doesn't move the baseline back.
+        encoder.acknowledge("client-1", 1)
+        [(_, third)] = encoder.encode(Snapshot(3, {'player-1': self.player}), ["client-1"])
+        self.assertTrue(third.delta)
+        self.assertEqual(third.baseline_tick, 2)
+        self.assertEqual(third.entities, {})
+        self.assertEqual(third.removed, ['wall-2-0'])
+
+    def testFullWhenBaselineIsTooOld(self):
+        encoder = SnapshotEncoder("game-1", history=4)
+        encoder.encode(self.baseline, ["client-1"])
+        encoder.acknowledge("client-1", 1)
+        for tick in range(2, 6):
+            [(_, message)] = encoder.encode(Snapshot(tick, self.baseline.entities), ["client-1"])
+        self.assertFalse(message.delta)
+
+    def testDecoder(self):
+        encoder = SnapshotEncoder("game-1")
+        decoder = SnapshotDecoder("client-1")
+        [(_, full)] = encoder.encode(self.baseline, ["client-1"])
+        self.assertIsNone(decoder.acknowledgement("game-1"))
+        self.assertEqual(decoder.decode(full).entities, self.baseline.entities)
+        ack = decoder.acknowledgement("game-1")
+        encoder.acknowledge(ack.client_id, ack.tick)
+
+        current = Snapshot(2, {'player-1': dict(self.player, alive=False)})
+        [(_, delta)] = encoder.encode(current, ["client-1"])
+        self.assertEqual(decoder.decode(delta).entities, current.entities)
+        # stale snapshots, and deltas against snapshots the decoder never had, are ignored.
+        self.assertIsNone(decoder.decode(delta))
+        delta.tick = 3
+        delta.baseline_tick = 0
+        self.assertIsNone(decoder.decode(delta))
+
+    def testLossyGame(self):
+        codec = create_codec()
+        simulation = BoardSimulation(4)
+        encoder = SnapshotEncoder("game-1")
+        decoders = dict(("client-%d" % num, SnapshotDecoder("client-%d" % num)) for num in range(4))
+        loss = random.Random(0)
+        for _ in range(300):
+            snapshot = simulation.step()
+            for (client_id, message) in encoder.encode(snapshot, decoders.keys()):
+                if loss.random() < 0.2:
+                    continue
+                decoded = decoders[client_id].decode(codec.decode(*codec.encode(message)))
+                self.assertIsNotNone(decoded)
+                self.assertEqual(decoded.entities, snapshot.entities)
+                if loss.random() >= 0.2:
+                    ack = decoders[client_id].acknowledgement("game-1")
+                    encoder.acknowledge(ack.client_id, ack.tick)
+        self.assertGreater(encoder.delta_snapshots, encoder.full_snapshots)
@@ -0,0 +1,3 @@
+from .danger import DangerMap
+from .decisions import AIAction, AIBatcher, AIPlayer, Board, decide
+from .pathfinding import FlowField, PathFinder
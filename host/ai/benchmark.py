@@ -0,0 +1,318 @@
+"""
+Times the AI players' view of the board:
+
+  danger - keeping the danger map up to date on a busy board, against working it out from scratch after every
+           change, and the queries the AI players make of it.
+  paths  - the path queries the AI players make every tick, with flow fields shared and cached, and without.
+  decisions - every AI player in every game deciding what to do each tick, in this process, over a pool of workers
+           reading the boards from shared memory, and over a pool sent a pickled board per game.
+
+Run with:  python -m host.ai.benchmark [danger] [paths] [decisions] [--json FILE] [options]
+"""
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import random
+import time
+from common.benchmark import add_json_argument, report
+from common.entities import Bomb
+from host.game import BlastEngine
+from host.game.benchmark import board
+from .danger import DangerMap
+from .decisions import AIAction, AIBatcher, AIPlayer, Board, decide
+from .pathfinding import PathFinder
+
+
+class RebuildingDangerMap(DangerMap):
+    """
+    Works the whole map out again whenever a bomb is placed or goes off - kept here so the benchmark has a
+    baseline to compare against (and to check the incremental map with).
+    """
+    def place(self, bomb):
+        if not self.engine.place(bomb):
+            return False
+        self.rebuild()
+        return True
+
+    def update(self, result):
+        self.rebuild()
+        return result
+
+
+MAPS = {
+    'rebuild': RebuildingDangerMap,
+    'incremental': DangerMap,
+}
+
+
+def run_map(name, dimensions, args):
+    """
+    Every tick, each player may drop a bomb somewhere on the board, due bombs go off, and every AI asks whether the
+    cells around it are safe for the next second.
+    """
+    generator = random.Random(args.seed)
+    (game_map, free) = board(dimensions, args.density, args.seed)
+    danger = MAPS[name](BlastEngine(game_map))
+    ais = [generator.choice(free) for _ in range(args.ais)]
+    neighbourhood = [(d_col, d_row) for d_col in range(-2, 3) for d_row in range(-2, 3) if abs(d_col) + abs(d_row) <= 2]
+    updating = 0.0
+    querying = 0.0
+    queries = 0
+    bombs = 0
+    outcomes = []
+    for tick_number in range(args.ticks):
+        start = time.perf_counter()
+        for _ in range(args.players):
+            if generator.random() < args.bomb_rate:
+                position = generator.choice(free)
+                if not game_map.tiles[position[1] * dimensions[0] + position[0]]:
+                    fuse = generator.randint(args.fuse // 2, args.fuse)
+                    bombs += danger.place(Bomb(position, generator.randint(1, args.range), tick_number + fuse))
+        danger.tick(tick_number)
+        updating += time.perf_counter() - start
+
+        start = time.perf_counter()
+        safe = 0
+        for (col, row) in ais:
+            for (d_col, d_row) in neighbourhood:
+                cell = (col + d_col, row + d_row)
+                if 0 <= cell[0] < dimensions[0] and 0 <= cell[1] < dimensions[1]:
+                    safe += danger.is_safe(cell, tick_number, args.horizon)
+                    queries += 1
+        querying += time.perf_counter() - start
+        outcomes.append((hash(danger.explodes.tobytes()), safe))
+    return {
+        'map': name,
+        'dimensions': "%dx%d" % dimensions,
+        'bombs': bombs,
+        'live_bombs': len(danger.engine.bombs),
+        'update_us_per_tick': updating / args.ticks * 1e6,
+        'query_us_per_tick': querying / args.ticks * 1e6,
+        'queries_per_second': queries / querying if querying else 0.0,
+    }, outcomes
+
+
+def benchmark_danger(args):
+    results = []
+    for dimensions in args.dimensions:
+        (rebuild, expected) = run_map('rebuild', dimensions, args)
+        (incremental, outcomes) = run_map('incremental', dimensions, args)
+        if outcomes != expected:
+            raise Exception("The incremental and rebuilt danger maps disagree on a %dx%d board." % dimensions)
+        results.extend([rebuild, incremental])
+    return results
+
+
+def run_paths(cache_size, dimensions, args):
+    """
+    Every tick, each AI asks the way to safety, to the nearest wall worth bombing and to the next AI along, and
+    steps whichever way it needs to - while the players drop bombs around them.  Every few ticks, one of them plans a
+    route through time to a random cell instead.
+    """
+    generator = random.Random(args.seed)
+    (game_map, free) = board(dimensions, args.density, args.seed)
+    danger = DangerMap(BlastEngine(game_map))
+    paths = PathFinder(danger, cache_size)
+    ais = [generator.choice(free) for _ in range(args.ais)]
+    querying = 0.0
+    queries = 0
+    planning = 0.0
+    plans = 0
+    outcomes = []
+    for tick_number in range(args.ticks):
+        for _ in range(args.players):
+            if generator.random() < args.bomb_rate:
+                position = generator.choice(free)
+                if not game_map.tiles[position[1] * dimensions[0] + position[0]]:
+                    fuse = generator.randint(args.fuse // 2, args.fuse)
+                    danger.place(Bomb(position, generator.randint(1, args.range), tick_number + fuse))
+        danger.tick(tick_number)
+
+        start = time.perf_counter()
+        steps = []
+        for (num, position) in enumerate(ais):
+            safety = paths.to_safety().next_step(position)
+            wall = paths.to_walls().next_step(position)
+            enemy = paths.flow_field([ais[(num + 1) % len(ais)]]).next_step(position)
+            queries += 3
+            steps.append(safety if not danger.is_safe(position, tick_number, args.horizon) else (wall or enemy))
+        querying += time.perf_counter() - start
+
+        plan = None
+        if tick_number % args.plan_every == 0:
+            num = tick_number // args.plan_every % len(ais)
+            goal = generator.choice(free)
+            start = time.perf_counter()
+            plan = paths.find_path(ais[num], goal, tick_number, args.step_ticks)
+            planning += time.perf_counter() - start
+            plans += 1
+        ais = [step or position for (position, step) in zip(ais, steps)]
+        outcomes.append((steps, plan))
+    return {
+        'fields': 'cached' if cache_size else 'uncached',
+        'dimensions': "%dx%d" % dimensions,
+        'ais': args.ais,
+        'field_queries_per_second': queries / querying,
+        'searches': paths.misses,
+        'cache_hits': paths.hits,
+        'astar_ms': planning / plans * 1e3 if plans else 0.0,
+        'astar_per_second': plans / planning if planning else 0.0,
+    }, outcomes
+
+
+def benchmark_paths(args):
+    results = []
+    for dimensions in args.dimensions:
+        (uncached, expected) = run_paths(0, dimensions, args)
+        (cached, outcomes) = run_paths(64, dimensions, args)
+        if outcomes != expected:
+            raise Exception("The cached and uncached path finders disagree on a %dx%d board." % dimensions)
+        results.extend([uncached, cached])
+    return results
+
+
+class PickledBatcher(AIBatcher):
+    """
+    Sends each game's board to the pool pickled, in a task of its own - the straightforward way to farm decisions
+    out, kept here so the benchmark has a baseline to compare against.
+    """
+    def __init__(self, workers, deadline):
+        super().__init__(deadline=deadline)
+        self.workers = workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _evaluate_pooled(self, requests):
+        futures = [(session_id, self.executor.submit(decide_all, board, players)) for (session_id, board, players) in requests]
+        concurrent.futures.wait([future for (_, future) in futures], timeout=self.deadline)
+        to_return = {}
+        for ((session_id, future), (_, _, players)) in zip(futures, requests):
+            if future.done():
+                to_return[session_id] = future.result()
+                self.decisions += len(players)
+            else:
+                future.cancel()
+                to_return[session_id] = dict((player.player_id, AIAction.WAIT) for player in players)
+                self.late += len(players)
+        return to_return
+
+
+def decide_all(board, players):
+    return dict((player.player_id, decide(board, player)) for player in players)
+
+
+BATCHERS = {
+    'in-process': lambda args: AIBatcher(),
+    'shared-memory': lambda args: AIBatcher(args.workers, args.deadline),
+    'pickled': lambda args: PickledBatcher(args.workers, args.deadline),
+}
+
+
+def run_decisions(name, dimensions, args):
+    """
+    Every game has its AI players wander the board and drop bombs as they decide to.  Decisions that miss the
+    deadline leave their players waiting - and the games diverging from the in-process run.
+    """
+    generator = random.Random(args.seed)
+    games = []
+    for num in range(args.sessions):
+        (game_map, free) = board(dimensions, args.density, args.seed + num)
+        players = [AIPlayer("ai-%d" % ai, position, bomb_range=2) for (ai, position) in enumerate(generator.sample(free, args.ais))]
+        games.append(("game-%d" % num, DangerMap(BlastEngine(game_map)), players))
+    batcher = BATCHERS[name](args)
+    # the first batch starts the workers up - don't time that.
+    for (session_id, danger, players) in games:
+        batcher.add(session_id, Board.from_danger(danger, 0), players)
+    batcher.evaluate()
+    (batcher.decisions, batcher.late) = (0, 0)
+
+    elapsed = 0.0
+    slowest = 0.0
+    outcomes = []
+    moves = {AIAction.NORTH: (0, -1), AIAction.EAST: (1, 0), AIAction.SOUTH: (0, 1), AIAction.WEST: (-1, 0)}
+    for tick_number in range(args.decision_ticks):
+        start = time.perf_counter()
+        for (session_id, danger, players) in games:
+            batcher.add(session_id, Board.from_danger(danger, tick_number), players)
+        decisions = batcher.evaluate()
+        duration = time.perf_counter() - start
+        elapsed += duration
+        slowest = max(slowest, duration)
+
+        for (session_id, danger, players) in games:
+            for player in players:
+                action = decisions[session_id][player.player_id]
+                if action == AIAction.BOMB:
+                    danger.place(Bomb(player.position, player.bomb_range, tick_number + args.fuse))
+                elif action in moves:
+                    target = (player.position[0] + moves[action][0], player.position[1] + moves[action][1])
+                    if not danger.engine.walls[target[1] * dimensions[0] + target[0]] and not danger.engine.bomb_mask[target[1] * dimensions[0] + target[0]]:
+                        player.position = target
+            danger.tick(tick_number)
+        outcomes.append(decisions)
+    batcher.stop()
+    return {
+        'batcher': name,
+        'dimensions': "%dx%d" % dimensions,
+        'sessions': args.sessions,
+        'ais': args.ais,
+        'workers': args.workers if name != 'in-process' else 0,
+        'ms_per_tick': elapsed / args.decision_ticks * 1e3,
+        'slowest_tick_ms': slowest * 1e3,
+        'decisions_per_second': batcher.decisions / elapsed,
+        'late': batcher.late,
+    }, outcomes
+
+
+def benchmark_decisions(args):
+    results = []
+    for dimensions in args.dimensions:
+        (in_process, expected) = run_decisions('in-process', dimensions, args)
+        results.append(in_process)
+        for name in ('shared-memory', 'pickled'):
+            (result, outcomes) = run_decisions(name, dimensions, args)
+            result['matches_in_process'] = outcomes == expected
+            results.append(result)
+    return results
+
+
+BENCHMARKS = {
+    'danger': benchmark_danger,
+    'paths': benchmark_paths,
+    'decisions': benchmark_decisions,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the danger map and path finding for AI players.")
+    parser.add_argument("benchmarks", nargs="*", default=sorted(BENCHMARKS), help="Any of: %s." % ", ".join(sorted(BENCHMARKS)))
+    add_json_argument(parser)
+    parser.add_argument("--dimensions", type=lambda value: [tuple(int(num) for num in size.split("x")) for size in value.split(",")],
+                        default=[(15, 13), (64, 64)], help="Comma separated board sizes, e.g. 15x13,64x64.")
+    parser.add_argument("--ticks", type=int, default=1200)
+    parser.add_argument("--players", type=int, default=8, help="Players dropping bombs.")
+    parser.add_argument("--ais", type=int, default=8, help="AI players querying the board every tick.")
+    parser.add_argument("--bomb-rate", type=float, default=0.05, help="The chance each player drops a bomb on a tick.")
+    parser.add_argument("--fuse", type=int, default=180, help="The longest fuse, in ticks.")
+    parser.add_argument("--horizon", type=int, default=60, help="How many ticks ahead the AIs need cells to be safe.")
+    parser.add_argument("--range", type=int, default=4, help="The longest bomb range.")
+    parser.add_argument("--plan-every", type=int, default=4, help="How many ticks apart AIs plan routes through time.")
+    parser.add_argument("--step-ticks", type=int, default=8, help="The ticks it takes a player to move a cell.")
+    parser.add_argument("--density", type=float, default=0.3, help="The fraction of free cells with a destructable wall.")
+    parser.add_argument("--sessions", type=int, default=16, help="Games deciding for their AI players at once.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes deciding for the AI players.")
+    parser.add_argument("--deadline", type=float, default=1 / 120.0, help="How long, in seconds, to wait for the workers.")
+    parser.add_argument("--decision-ticks", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % name)
+    results = []
+    for name in args.benchmarks:
+        results.extend(BENCHMARKS[name](args))
+    report('ai', args, results, precision=3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import array
+
+
+class DangerMap(object):
+    # the tick a cell no bomb can reach explodes on.
+    NEVER = 2 ** 64 - 1
+
+    def __init__(self, engine):
+        """
+        Knows, for every cell, the tick the flames of the bombs placed so far will next reach it - so whether a cell
+        is safe is a single lookup, however many bombs there are and however many players are asking.
+
+        Rather than being worked out from scratch every tick, the map is kept up to date as bombs are placed and go
+        off.  A new bomb only marks the cells its flames cover, and lowers the ticks of the bombs those set off early;
+        a detonation only clears the cells the bombs that went off covered, and redoes the bombs that covered them too.
+        Walls count as they stand now - once bombs destroy them, the bombs behind them are redone as well.
+
+        :param engine: the BlastEngine resolving the game's bombs - place and detonate bombs through the danger map,
+            so it sees them.
+        """
+        self.engine = engine
+        self.width = engine.width
+        self.explodes = array.array('Q', [self.NEVER]) * engine.size
+        # the tick each bomb will go off on, chain reactions included, and the cells it'll cover, keyed by cell index.
+        self.times = {}
+        self.covers = {}
+        self.rebuild()
+
+    def place(self, bomb):
+        """
+        :return: False if there's already a bomb on that cell.
+        """
+        if not self.engine.place(bomb):
+            return False
+        index = self._index(bomb.position)
+        self.covers[index] = self._cover(bomb)
+        # a bomb placed in the path of another's flames goes off with it.
+        self.times[index] = min(bomb.detonates_at, self.explodes[index])
+        self._spread([index])
+        return True
+
+    def tick(self, tick_number):
+        """
+        Detonates every bomb due on this tick.
+        """
+        return self.update(self.engine.tick(tick_number))
+
+    def detonate(self, bombs):
+        return self.update(self.engine.detonate(bombs))
+
+    def update(self, result):
+        """
+        Clears up after the bombs of a BlastResult went off.
+
+        :return: the BlastResult.
+        """
+        cleared = set()
+        for bomb in result.detonated:
+            index = self._index(bomb.position)
+            self.times.pop(index, None)
+            cover = self.covers.pop(index, ())
+            for cell in cover:
+                self.explodes[cell] = self.NEVER
+            cleared.update(cover)
+
+        redo = [index for (index, cover) in self.covers.items() if not cleared.isdisjoint(cover)]
+        for index in redo:
+            self.covers[index] = self._cover(self.engine.bombs[index])
+        self._spread(redo)
+        return result
+
+    def rebuild(self):
+        """
+        Works the map out from scratch, from the bombs the engine holds.
+        """
+        self.explodes[:] = array.array('Q', [self.NEVER]) * self.engine.size
+        self.times = dict((index, bomb.detonates_at) for (index, bomb) in self.engine.bombs.items())
+        self.covers = dict((index, self._cover(bomb)) for (index, bomb) in self.engine.bombs.items())
+        self._spread(list(self.times))
+
+    def explodes_at(self, position):
+        """
+        :return: the tick flames next reach position, or None if no bomb placed so far will reach it.
+        """
+        tick = self.explodes[self._index(position)]
+        return None if tick == self.NEVER else tick
+
+    def time_until(self, position, tick_number):
+        """
+        :return: the number of ticks from tick_number until flames reach position, or None if they never will.
+        """
+        tick = self.explodes[self._index(position)]
+        return None if tick == self.NEVER else max(0, tick - tick_number)
+
+    def is_safe(self, position, tick_number, ticks=0):
+        """
+        :return: True if no flames reach position on any tick from tick_number to tick_number + ticks.
+        """
+        return self.explodes[self._index(position)] > tick_number + ticks
+
+    def _spread(self, worklist):
+        """
+        Marks the cells covered by the bombs at the indexes in worklist with the tick they go off on - and when that
+        sets off another bomb sooner than it would have gone off, does the same for it.
+        """
+        explodes = self.explodes
+        times = self.times
+        while worklist:
+            index = worklist.pop()
+            tick = times[index]
+            for cell in self.covers[index]:
+                if explodes[cell] > tick:
+                    explodes[cell] = tick
+                if times.get(cell, 0) > tick:
+                    times[cell] = tick
+                    worklist.append(cell)
+
+    def _cover(self, bomb):
+        """
+        :return: the indexes of every cell the flames of bomb would reach, were it to go off now.
+        """
+        index = self._index(bomb.position)
+        cells = [index]
+        for (step, length, wall) in self.engine.rays(bomb.position, bomb.range):
+            cells.extend(range(index + step, index + step * (length + 1), step))
+            if wall != -1 and self.engine.map.tiles[wall] == self.engine.destructable:
+                cells.append(wall)
+        return cells
+
+    def _index(self, position):
+        return position[1] * self.width + position[0]
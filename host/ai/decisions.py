@@ -0,0 +1,418 @@
+import array
+import concurrent.futures
+import concurrent.futures.process
+import logging
+import multiprocessing
+import struct
+from multiprocessing import shared_memory
+from common.maps import Map
+from common.maps.spawns import DestructableWallSpawn, IndestructableWallSpawn
+
+
+class AIAction(object):
+    WAIT = "wait"
+    NORTH = "north"
+    EAST = "east"
+    SOUTH = "south"
+    WEST = "west"
+    BOMB = "bomb"
+
+
+class AIPlayer(object):
+    def __init__(self, player_id, position, bomb_range=1, bombs=1):
+        """
+        An AI player, as its decision sees it.
+
+        :param player_id: unique within its game.
+        :param position: the (column, row) it's on.
+        :param bomb_range: the range of the bombs it drops.
+        :param bombs: how many more bombs it can drop right now.
+        """
+        self.player_id = player_id
+        self.position = position
+        self.bomb_range = bomb_range
+        self.bombs = bombs
+
+
+class Board(object):
+    DESTRUCTABLE = Map.code(DestructableWallSpawn)
+    BLOCKING = bytes(1 if code in (Map.code(DestructableWallSpawn), Map.code(IndestructableWallSpawn)) else 0 for code in range(256))
+    # how far ahead a cell has to be clear of flames for a player to count as safe on it.
+    SAFE_TICKS = 60
+
+    def __init__(self, width, height, tick_number, tiles, bombs, explodes):
+        """
+        A game's board as its AI players see it on a tick - everything a decision needs, and nothing it can't be
+        shipped to another process with.
+
+        :param tiles: the Map's tiles.
+        :param bombs: a byte per cell, 1 where there's a bomb.
+        :param explodes: the tick per cell that flames next reach it, as a DangerMap keeps them.
+        """
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.tick_number = tick_number
+        self.tiles = tiles
+        self.bombs = bombs
+        self.explodes = explodes
+        blocked = int.from_bytes(bytes(tiles).translate(self.BLOCKING), 'little') | int.from_bytes(bombs, 'little')
+        self.blocked = blocked.to_bytes(self.size, 'little')
+
+    @classmethod
+    def from_danger(cls, danger, tick_number):
+        engine = danger.engine
+        return cls(engine.width, engine.height, tick_number, engine.map.tiles, engine.bomb_mask, danger.explodes)
+
+    def index(self, position):
+        return position[1] * self.width + position[0]
+
+    def is_safe(self, index, ticks=SAFE_TICKS):
+        return self.explodes[index] > self.tick_number + ticks
+
+    def neighbours(self, index):
+        """
+        :return: (action, index) for each cell next to index that's on the board.
+        """
+        to_return = []
+        col = index % self.width
+        if index >= self.width:
+            to_return.append((AIAction.NORTH, index - self.width))
+        if col < self.width - 1:
+            to_return.append((AIAction.EAST, index + 1))
+        if index + self.width < self.size:
+            to_return.append((AIAction.SOUTH, index + self.width))
+        if col > 0:
+            to_return.append((AIAction.WEST, index - 1))
+        return to_return
+
+    def first_step(self, start, goal):
+        """
+        A breadth first search out from start, through cells nothing blocks.
+
+        :param goal: called with a cell's index, True if it'll do.
+        :return: the action that takes a player at start a step towards the nearest cell goal accepts, WAIT if start
+            is one, or None if none can be reached.
+        """
+        if goal(start):
+            return AIAction.WAIT
+        blocked = self.blocked
+        seen = {start: None}
+        frontier = []
+        for (action, neighbour) in self.neighbours(start):
+            if not blocked[neighbour]:
+                seen[neighbour] = action
+                frontier.append(neighbour)
+        while frontier:
+            following = []
+            for index in frontier:
+                if goal(index):
+                    return seen[index]
+                for (_, neighbour) in self.neighbours(index):
+                    if neighbour not in seen and not blocked[neighbour]:
+                        # every cell remembers which way the search left start to get to it.
+                        seen[neighbour] = seen[index]
+                        following.append(neighbour)
+            frontier = following
+        return None
+
+    def blast(self, index, bomb_range):
+        """
+        :return: the indexes of the cells a bomb at index would set alight.
+        """
+        cells = {index}
+        for (step, limit) in [(-self.width, index // self.width), (1, self.width - 1 - index % self.width),
+                              (self.width, self.height - 1 - index // self.width), (-1, index % self.width)]:
+            for distance in range(1, min(bomb_range, limit) + 1):
+                cell = index + step * distance
+                if self.blocked[cell]:
+                    break
+                cells.add(cell)
+        return cells
+
+
+def decide(board, player):
+    """
+    The default AI - gets out of the way of flames, bombs the walls next to it when it has somewhere to hide, and
+    otherwise heads for the nearest wall to bomb.
+
+    :return: an AIAction.
+    """
+    index = board.index(player.position)
+    if not board.is_safe(index):
+        return board.first_step(index, board.is_safe) or AIAction.WAIT
+
+    next_to_wall = any(board.tiles[neighbour] == board.DESTRUCTABLE for (_, neighbour) in board.neighbours(index))
+    if next_to_wall and player.bombs:
+        blast = board.blast(index, player.bomb_range)
+        if board.first_step(index, lambda cell: cell not in blast and board.is_safe(cell)) is not None:
+            return AIAction.BOMB
+
+    def beside_wall(cell):
+        return board.is_safe(cell) and any(board.tiles[neighbour] == board.DESTRUCTABLE for (_, neighbour) in board.neighbours(cell))
+    return board.first_step(index, beside_wall) or AIAction.WAIT
+
+
+class SharedBoards(object):
+    """
+    A tick's worth of boards in a multiprocessing.shared_memory block, for worker processes to read rather than be
+    sent a pickled copy each.
+
+    The block starts with a generation counter (8 bytes), bumped before the block is written to, followed by one
+    record per board:
+
+        width (4 bytes), height (4 bytes), tick number (8 bytes)
+        tiles (a byte per cell)
+        bombs (a byte per cell)
+        explodes (8 bytes per cell, at an 8 byte aligned offset)
+
+    A reader checks the generation both before and after copying a board out - if it changed, the board was being
+    overwritten for a later tick while it was being read.
+    """
+    COUNTER = struct.Struct('=Q')
+    HEADER = struct.Struct('=IIQ')
+    DATA_OFFSET = 8
+
+    def __init__(self, memory, owner):
+        """
+        Use create or attach rather than calling this directly.
+        """
+        self.memory = memory
+        self.owner = owner
+
+    @classmethod
+    def create(cls, capacity=1024 * 1024):
+        return cls(shared_memory.SharedMemory(create=True, size=cls.DATA_OFFSET + capacity), True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name), False)
+
+    @classmethod
+    def record_size(cls, board):
+        return cls._explodes_offset(board.size) + 8 * board.size
+
+    @classmethod
+    def _explodes_offset(cls, size):
+        return (cls.HEADER.size + 2 * size + 7) // 8 * 8
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def generation(self):
+        return self.COUNTER.unpack_from(self.memory.buf, 0)[0]
+
+    def fits(self, boards):
+        return self.DATA_OFFSET + sum(self.record_size(board) for board in boards) <= self.memory.size
+
+    def write(self, boards):
+        """
+        :return: the offset of each board's record.
+        """
+        buf = self.memory.buf
+        self.COUNTER.pack_into(buf, 0, self.generation + 1)
+        offsets = []
+        offset = self.DATA_OFFSET
+        for board in boards:
+            offsets.append(offset)
+            size = board.size
+            self.HEADER.pack_into(buf, offset, board.width, board.height, board.tick_number)
+            tiles = offset + self.HEADER.size
+            buf[tiles:tiles + size] = board.tiles
+            buf[tiles + size:tiles + 2 * size] = board.bombs
+            explodes = offset + self._explodes_offset(size)
+            buf[explodes:explodes + 8 * size] = memoryview(board.explodes).cast('B')
+            offset += self.record_size(board)
+        return offsets
+
+    def read(self, offset):
+        buf = self.memory.buf
+        (width, height, tick_number) = self.HEADER.unpack_from(buf, offset)
+        size = width * height
+        tiles = offset + self.HEADER.size
+        explodes = array.array('Q')
+        start = offset + self._explodes_offset(size)
+        explodes.frombytes(buf[start:start + 8 * size])
+        return Board(width, height, tick_number, bytes(buf[tiles:tiles + size]), bytes(buf[tiles + size:tiles + 2 * size]), explodes)
+
+    def release(self):
+        """
+        Detaches from the shared memory block - and destroys it, if this side created it.
+        """
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class AIBatcher(object):
+    def __init__(self, workers=0, deadline=0.008, policy=decide):
+        """
+        Collects the decisions every AI player on the host needs on a tick, across every game, and makes them all at
+        once - over a pool of worker processes if there are any, so the AIs don't hold up the host's own process.
+
+        The boards are written to a single shared memory block per tick, and each worker is sent a batch of the
+        games to decide on, rather than a pickled board per game.  Any batch not back within the deadline is
+        given up on, and its players wait for the tick - a slow AI never holds up the game.  Without workers, or
+        once the pool is broken, decisions are made in this process instead, in the order they were added, with no
+        deadline - the same inputs always make the same decisions.  A game whose policy raises has its players wait for
+        the tick, rather than taking the host down with it.
+
+        :param workers: the number of worker processes - 0 decides in this process.
+        :param deadline: how long, in seconds, evaluate waits for the workers.
+        :param policy: called with a Board and an AIPlayer for an AIAction - it has to be importable, since
+            workers are spawned rather than forked.
+        """
+        self.logger = logging.getLogger("ai-batcher")
+        self.workers = workers
+        self.deadline = deadline
+        self.policy = policy
+        self.requests = []
+        self.executor = None
+        self.boards = None
+        # decisions made, the ones given up on for missing the deadline or for the policy failing, and batches
+        # decided in this process.
+        self.decisions = 0
+        self.late = 0
+        self.failed = 0
+        self.in_process = 0
+        if workers:
+            # the workers start from scratch, rather than forking a process that's running threads.
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            self.boards = SharedBoards.create()
+
+    def add(self, session_id, board, players):
+        """
+        :param session_id: the game the players are in.
+        :param board: the game's Board.
+        :param players: its AIPlayers.
+        """
+        self.requests.append((session_id, board, players))
+
+    def evaluate(self):
+        """
+        Makes every decision added since the last call.
+
+        :return: a dictionary of session id to a dictionary of player id to AIAction.
+        """
+        (requests, self.requests) = (self.requests, [])
+        if not requests:
+            return {}
+        if self.executor is None:
+            return self._evaluate_here(requests)
+        return self._evaluate_pooled(requests)
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        if self.boards is not None:
+            self.boards.release()
+            self.boards = None
+
+    def _evaluate_here(self, requests):
+        self.in_process += 1
+        to_return = {}
+        for (session_id, board, players) in requests:
+            try:
+                to_return[session_id] = dict((player.player_id, self.policy(board, player)) for player in players)
+                self.decisions += len(players)
+            except Exception as e:
+                self.logger.exception("AI policy failed for session %s: %s" % (session_id, str(e)))
+                to_return[session_id] = self._wait(players)
+                self.failed += len(players)
+        return to_return
+
+    def _evaluate_pooled(self, requests):
+        boards = [board for (_, board, _) in requests]
+        if not self.boards.fits(boards):
+            needed = sum(SharedBoards.record_size(board) for board in boards)
+            self.boards.release()
+            self.boards = SharedBoards.create(2 * needed)
+        offsets = self.boards.write(boards)
+        generation = self.boards.generation
+
+        # contiguous batches, one per worker, so each worker is sent a single task per tick.
+        batch_size = -(-len(requests) // self.workers)
+        batches = []
+        for start in range(0, len(requests), batch_size):
+            batch = [(session_id, offset, players) for ((session_id, _, players), offset) in zip(requests[start:start + batch_size], offsets[start:start + batch_size])]
+            future = self.executor.submit(evaluate_shared, self.boards.name, generation, batch, self.policy)
+            batches.append((future, batch))
+        concurrent.futures.wait([future for (future, _) in batches], timeout=self.deadline)
+
+        to_return = {}
+        broken = False
+        for (future, batch) in batches:
+            decisions = None
+            if future.done() and not future.cancelled():
+                error = future.exception()
+                if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+                    broken = True
+                elif error is not None:
+                    self.logger.error("AI batch failed: %s" % str(error))
+                else:
+                    decisions = future.result()
+            else:
+                future.cancel()
+            if decisions is None:
+                for (session_id, _, players) in batch:
+                    to_return[session_id] = self._wait(players)
+                    self.late += len(players)
+                continue
+            for ((session_id, players, error), (_, _, ai_players)) in zip(decisions, batch):
+                if error is not None:
+                    self.logger.error("AI policy failed for session %s: %s" % (session_id, error))
+                    to_return[session_id] = self._wait(ai_players)
+                    self.failed += len(ai_players)
+                else:
+                    to_return[session_id] = players
+                    self.decisions += len(players)
+        if broken:
+            self.logger.error("AI worker pool is broken - deciding in process from now on")
+            self.stop()
+            return self._evaluate_here(requests)
+        return to_return
+
+    @staticmethod
+    def _wait(players):
+        return dict((player.player_id, AIAction.WAIT) for player in players)
+
+
+# the block a worker process last attached to - it only changes when the block has to grow.
+_attached = {}
+
+
+def evaluate_shared(name, generation, batch, policy):
+    """
+    A worker process' task - decides for a batch of games whose boards are in a SharedBoards block.
+
+    :return: a list of (session id, dictionary of player id to AIAction, error), in the order of batch - error is
+        the policy's exception as a string if it raised, and the decisions None.  None instead if the boards were
+        overwritten before they could be read - the batcher has given up on them by then.
+    """
+    boards = _attached.get(name)
+    if boards is None:
+        for stale in _attached.values():
+            stale.release()
+        _attached.clear()
+        boards = _attached[name] = SharedBoards.attach(name)
+    to_return = []
+    for (session_id, offset, players) in batch:
+        if boards.generation != generation:
+            return None
+        try:
+            board = boards.read(offset)
+        except Exception:
+            # a torn read - whatever was half written can't be trusted.
+            if boards.generation != generation:
+                return None
+            raise
+        if boards.generation != generation:
+            return None
+        try:
+            to_return.append((session_id, dict((player.player_id, policy(board, player)) for player in players), None))
+        except Exception as e:
+            to_return.append((session_id, None, "%s: %s" % (e.__class__.__name__, str(e))))
+    return to_return
@@ -0,0 +1,238 @@
+import array
+import collections
+import heapq
+
+
+class FlowField(object):
+    # the distance of a cell no goal can be reached from.
+    UNREACHABLE = 2 ** 32 - 1
+
+    def __init__(self, width, distances):
+        """
+        The number of steps from every cell on the board to the nearest of a set of goals - any number of players
+        heading for the same goals can share one, each just following it downhill from wherever they are.
+
+        :param width: the width of the board.
+        :param distances: an array with an entry per cell, in the same order as the map's tiles.
+        """
+        self.width = width
+        self.distances = distances
+
+    def distance(self, position):
+        """
+        :return: the number of steps from position to the nearest goal, or None if there's no way there.
+        """
+        distance = self.distances[position[1] * self.width + position[0]]
+        return None if distance == self.UNREACHABLE else distance
+
+    def next_step(self, position):
+        """
+        :return: the neighbouring cell one step closer to the nearest goal, or None if position is a goal or no
+            goal can be reached from it.
+        """
+        index = position[1] * self.width + position[0]
+        distance = self.distances[index]
+        if distance == 0 or distance == self.UNREACHABLE:
+            return None
+        for neighbour in _neighbours(index, self.width, len(self.distances)):
+            if self.distances[neighbour] == distance - 1:
+                return (neighbour % self.width, neighbour // self.width)
+
+    def path(self, position):
+        """
+        :return: the cells from position to the nearest goal, both included, or None if no goal can be reached.
+        """
+        if self.distance(position) is None:
+            return None
+        to_return = [position]
+        while True:
+            position = self.next_step(position)
+            if position is None:
+                return to_return
+            to_return.append(position)
+
+
+class PathFinder(object):
+    def __init__(self, danger, cache_size=64):
+        """
+        Finds paths around the board for AI players - to safety, to the walls worth bombing, and to one another.
+
+        Flow fields are cached by their goals, so every player after the same goals shares one.  The cache only
+        lasts as long as the board does - placing a bomb, or one going off, bumps the blast engine's version and
+        empties it.
+
+        :param danger: the game's DangerMap.
+        :param cache_size: the most flow fields kept at once - the least recently used go first.  0 disables caching.
+        """
+        self.danger = danger
+        self.engine = danger.engine
+        self.width = self.engine.width
+        self.size = self.engine.size
+        self.cache_size = cache_size
+        self.fields = collections.OrderedDict()
+        self.version = None
+        self.blocked = None
+        self.neighbours = [_neighbours(index, self.width, self.size) for index in range(self.size)]
+        # how many flow fields were served from the cache, and how many had to be searched for.
+        self.hits = 0
+        self.misses = 0
+
+    def flow_field(self, goals):
+        """
+        :param goals: an iterable of (column, row) cells.
+        :return: a FlowField towards the nearest of goals.
+        """
+        key = tuple(sorted(set(position[1] * self.width + position[0] for position in goals)))
+        return self._flow_field(key, lambda: key)
+
+    def to_safety(self):
+        """
+        :return: a FlowField towards the nearest cell no bomb on the board will reach.
+        """
+        def goals():
+            never = self.danger.NEVER
+            explodes = self.danger.explodes
+            return [index for index in range(self.size) if explodes[index] == never and not self.blocked[index]]
+        return self._flow_field('safety', goals)
+
+    def to_walls(self):
+        """
+        :return: a FlowField towards the nearest cell next to a destructable wall - where a bomb would take one out.
+        """
+        def goals():
+            tiles = self.engine.map.tiles
+            destructable = self.engine.destructable
+            to_return = set()
+            for wall in range(self.size):
+                if tiles[wall] == destructable:
+                    to_return.update(neighbour for neighbour in self.neighbours[wall] if not self.blocked[neighbour])
+            return to_return
+        return self._flow_field('walls', goals)
+
+    def find_path(self, start, goal, tick_number, step_ticks=1, max_steps=None):
+        """
+        A* through space and time - a player can wait in place for flames to pass, and never stands on a cell on a
+        tick flames reach it.
+
+        :param start: the (column, row) the player is on.
+        :param goal: the (column, row) it's heading for.
+        :param tick_number: the tick the player sets off on.
+        :param step_ticks: the ticks it takes the player to move a cell.
+        :param max_steps: the longest path to look for, waits included - defaults to twice the board's perimeter.
+        :return: the cell the player is on at the end of each step, start included, or None if there's no safe
+            path.
+        """
+        self._refresh()
+        width = self.width
+        blocked = self.blocked
+        explodes = self.danger.explodes
+        if max_steps is None:
+            max_steps = 4 * (width + self.engine.height)
+        start_index = start[1] * width + start[0]
+        goal_index = goal[1] * width + goal[0]
+        # once the last bomb on the board has gone off, time stops mattering - states past it are folded together.
+        last = max(self.danger.times.values()) if self.danger.times else tick_number
+        settled = max(0, (last - tick_number) // step_ticks + 1)
+
+        parents = {(start_index, 0): None}
+        steps = {(start_index, 0): 0}
+        heap = [(_distance(start_index, goal_index, width), 0, start_index)]
+        while heap:
+            (_, step, index) = heapq.heappop(heap)
+            state = (index, min(step, settled))
+            if steps[state] < step:
+                continue
+            if index == goal_index:
+                path = []
+                while state is not None:
+                    path.append((state[0] % width, state[0] // width))
+                    state = parents[state]
+                return path[::-1]
+            if step >= max_steps:
+                continue
+            following = step + 1
+            window = tick_number + following * step_ticks
+            for neighbour in self.neighbours[index] + [index]:
+                if blocked[neighbour] and neighbour != index:
+                    continue
+                if window <= explodes[neighbour] < window + step_ticks:
+                    continue
+                key = (neighbour, min(following, settled))
+                if steps.get(key, following + 1) <= following:
+                    continue
+                parents[key] = state
+                steps[key] = following
+                heapq.heappush(heap, (following + _distance(neighbour, goal_index, width), following, neighbour))
+        return None
+
+    def _flow_field(self, key, goals):
+        """
+        :param key: what the flow field is cached by.
+        :param goals: called for the indexes of the goal cells, if the flow field isn't cached.
+        """
+        self._refresh()
+        field = self.fields.get(key)
+        if field is not None:
+            self.hits += 1
+            self.fields.move_to_end(key)
+            return field
+        self.misses += 1
+        field = FlowField(self.width, self._search(goals()))
+        if self.cache_size:
+            self.fields[key] = field
+            if len(self.fields) > self.cache_size:
+                self.fields.popitem(last=False)
+        return field
+
+    def _refresh(self):
+        if self.version == self.engine.version:
+            return
+        self.version = self.engine.version
+        self.fields.clear()
+        # walls and bombs both stand in the way - or'd together a whole board at a time.
+        blocked = int.from_bytes(self.engine.walls, 'little') | int.from_bytes(self.engine.bomb_mask, 'little')
+        self.blocked = blocked.to_bytes(self.size, 'little')
+
+    def _search(self, goals):
+        """
+        A breadth first search out from every goal at once.
+        """
+        blocked = self.blocked
+        unreachable = FlowField.UNREACHABLE
+        distances = array.array('I', [unreachable]) * self.size
+        neighbours = self.neighbours
+        for index in goals:
+            distances[index] = 0
+        frontier = list(goals)
+        distance = 0
+        while frontier:
+            distance += 1
+            following = []
+            for index in frontier:
+                for neighbour in neighbours[index]:
+                    if distances[neighbour] == unreachable and not blocked[neighbour]:
+                        distances[neighbour] = distance
+                        following.append(neighbour)
+            frontier = following
+        return distances
+
+
+def _neighbours(index, width, size):
+    """
+    :return: the indexes of the cells north, east, south and west of index that are on the board.
+    """
+    to_return = []
+    col = index % width
+    if index >= width:
+        to_return.append(index - width)
+    if col < width - 1:
+        to_return.append(index + 1)
+    if index + width < size:
+        to_return.append(index + width)
+    if col > 0:
+        to_return.append(index - 1)
+    return to_return
+
+
+def _distance(index, other, width):
+    return abs(index % width - other % width) + abs(index // width - other // width)
@@ -0,0 +1,241 @@
+import random
+import time
+import unittest
+from common.entities import Bomb
+from common.maps import Map
+from common.maps.spawns import DestructableWallSpawn, IndestructableWallSpawn
+from host.game import BlastEngine
+from host.game.benchmark import board
+from . import *
+from .decisions import SharedBoards
+
+
+class TestDangerMap(unittest.TestCase):
+    def setUp(self):
+        # 0 1 2 3 4
+        # _ _ d _ _   row 0
+        # _ i _ i _   row 1
+        # _ _ _ _ d   row 2
+        self.map = Map(name="test", dimensions=(5, 3))
+        self.map.add_spawn(DestructableWallSpawn(), (2, 0))
+        self.map.add_spawn(IndestructableWallSpawn(), (1, 1))
+        self.map.add_spawn(IndestructableWallSpawn(), (3, 1))
+        self.map.add_spawn(DestructableWallSpawn(), (4, 2))
+        self.danger = DangerMap(BlastEngine(self.map))
+
+    def grid(self):
+        return [[self.danger.explodes_at((col, row)) for col in range(5)] for row in range(3)]
+
+    def testPlace(self):
+        self.assertTrue(self.danger.place(Bomb((0, 0), range=3, detonates_at=10)))
+        self.assertFalse(self.danger.place(Bomb((0, 0))))
+        self.assertEqual(self.grid(), [[10, 10, 10, None, None],
+                                       [10, None, None, None, None],
+                                       [10, None, None, None, None]])
+        self.assertEqual(self.danger.time_until((0, 2), 4), 6)
+        self.assertIsNone(self.danger.time_until((4, 0), 4))
+        self.assertTrue(self.danger.is_safe((0, 2), 4, 5))
+        self.assertFalse(self.danger.is_safe((0, 2), 4, 6))
+
+    def testChainReaction(self):
+        self.danger.place(Bomb((2, 2), range=2, detonates_at=100))
+        self.danger.place(Bomb((0, 2), range=2, detonates_at=10))
+        # set off by the first bomb, so it goes off on the same tick.
+        self.danger.place(Bomb((2, 1), range=1, detonates_at=200))
+        self.assertEqual(self.grid(), [[10, None, 10, None, None],
+                                       [10, None, 10, None, None],
+                                       [10, 10, 10, 10, 10]])
+
+    def testDetonation(self):
+        self.danger.place(Bomb((0, 0), range=4, detonates_at=10))
+        self.danger.place(Bomb((4, 0), range=1, detonates_at=20))
+        # the destructable wall shields the second bomb from the first, until the first goes off.
+        self.assertEqual(self.danger.explodes_at((3, 0)), 20)
+        self.assertEqual(self.danger.explodes_at((2, 0)), 10)
+
+        self.danger.tick(10)
+        self.assertEqual(self.grid(), [[None, None, None, 20, 20],
+                                       [None, None, None, None, 20],
+                                       [None, None, None, None, None]])
+        second = Bomb((0, 0), range=4, detonates_at=30)
+        self.danger.place(second)
+        # the second bomb's flames reach the first, but it goes off sooner by itself.
+        self.assertEqual(self.grid(), [[30, 30, 30, 20, 20],
+                                       [30, None, None, None, 20],
+                                       [30, None, None, None, None]])
+
+    def testMatchesRebuild(self):
+        generator = random.Random(0)
+        for tick_number in range(200):
+            position = (generator.randrange(5), generator.randrange(3))
+            if generator.random() < 0.3 and not self.map.get_spawn(position):
+                self.danger.place(Bomb(position, generator.randint(1, 3), tick_number + generator.randint(1, 20)))
+            self.danger.tick(tick_number)
+            incremental = self.grid()
+            self.danger.rebuild()
+            self.assertEqual(self.grid(), incremental)
+
+
+class TestPathFinder(unittest.TestCase):
+    def setUp(self):
+        # 0 1 2 3 4
+        # _ _ d _ _   row 0
+        # _ i _ i _   row 1
+        # _ _ _ _ d   row 2
+        self.map = Map(name="test", dimensions=(5, 3))
+        self.map.add_spawn(DestructableWallSpawn(), (2, 0))
+        self.map.add_spawn(IndestructableWallSpawn(), (1, 1))
+        self.map.add_spawn(IndestructableWallSpawn(), (3, 1))
+        self.map.add_spawn(DestructableWallSpawn(), (4, 2))
+        self.danger = DangerMap(BlastEngine(self.map))
+        self.paths = PathFinder(self.danger)
+
+    def testFlowField(self):
+        field = self.paths.flow_field([(2, 1)])
+        self.assertEqual(field.distance((0, 0)), 5)
+        # walled in, or on a wall.
+        self.assertIsNone(field.distance((4, 0)))
+        self.assertIsNone(field.distance((1, 1)))
+        self.assertEqual(field.path((0, 2)), [(0, 2), (1, 2), (2, 2), (2, 1)])
+        self.assertEqual(field.next_step((2, 2)), (2, 1))
+        self.assertIsNone(field.next_step((2, 1)))
+
+    def testCachedUntilTheBoardChanges(self):
+        field = self.paths.flow_field([(2, 1)])
+        self.assertIs(self.paths.flow_field([(2, 1)]), field)
+        self.assertEqual((self.paths.hits, self.paths.misses), (1, 1))
+
+        self.danger.place(Bomb((1, 2), range=1, detonates_at=5))
+        changed = self.paths.flow_field([(2, 1)])
+        self.assertIsNot(changed, field)
+        # the bomb cuts the board in two.
+        self.assertIsNone(changed.distance((0, 0)))
+        self.danger.tick(5)
+        self.assertEqual(self.paths.flow_field([(2, 1)]).distance((0, 0)), 5)
+
+    def testToSafetyAndWalls(self):
+        self.danger.place(Bomb((0, 2), range=2, detonates_at=5))
+        safety = self.paths.to_safety()
+        self.assertEqual(safety.path((0, 0)), [(0, 0), (1, 0)])
+        self.assertEqual(safety.distance((1, 2)), 2)
+        walls = self.paths.to_walls()
+        self.assertEqual(walls.distance((1, 0)), 0)
+        self.assertEqual(walls.distance((0, 0)), 1)
+
+    def testFindPathWaitsForFlames(self):
+        game_map = Map(name="test", dimensions=(5, 3))
+        game_map.add_spawn(IndestructableWallSpawn(), (1, 1))
+        game_map.add_spawn(IndestructableWallSpawn(), (3, 1))
+        danger = DangerMap(BlastEngine(game_map))
+        paths = PathFinder(danger)
+        self.assertEqual(len(paths.find_path((0, 0), (4, 0), 0)), 5)
+
+        # the flames reach (4, 0) just as the player would, so it has to hang back a step.
+        danger.place(Bomb((4, 2), range=2, detonates_at=4))
+        path = paths.find_path((0, 0), (4, 0), 0)
+        self.assertEqual(len(path), 6)
+        self.assertEqual((path[0], path[4], path[5]), ((0, 0), (3, 0), (4, 0)))
+        self.assertIsNone(paths.find_path((0, 0), (1, 1), 0))
+
+
+def slow_decide(board, player):
+    time.sleep(1.0)
+    return decide(board, player)
+
+
+def failing_decide(board, player):
+    # only the first game's policy fails.
+    if board.tick_number == 0:
+        raise ValueError("policy failed")
+    return decide(board, player)
+
+
+class TestDecisions(unittest.TestCase):
+    def setUp(self):
+        # 0 1 2 3 4
+        # _ _ d _ _   row 0
+        # _ i _ i _   row 1
+        # _ _ _ _ d   row 2
+        self.map = Map(name="test", dimensions=(5, 3))
+        self.map.add_spawn(DestructableWallSpawn(), (2, 0))
+        self.map.add_spawn(IndestructableWallSpawn(), (1, 1))
+        self.map.add_spawn(IndestructableWallSpawn(), (3, 1))
+        self.map.add_spawn(DestructableWallSpawn(), (4, 2))
+        self.danger = DangerMap(BlastEngine(self.map))
+
+    def board(self, tick_number=0):
+        return Board.from_danger(self.danger, tick_number)
+
+    def testFleesFlames(self):
+        self.danger.place(Bomb((0, 2), range=2, detonates_at=30))
+        self.assertEqual(decide(self.board(), AIPlayer("ai-1", (0, 1))), AIAction.NORTH)
+        self.assertEqual(decide(self.board(), AIPlayer("ai-1", (1, 2))), AIAction.EAST)
+
+    def testBombsWallsWhenItCanHide(self):
+        self.assertEqual(decide(self.board(), AIPlayer("ai-1", (1, 0))), AIAction.BOMB)
+        self.assertEqual(decide(self.board(), AIPlayer("ai-1", (1, 0), bombs=0)), AIAction.WAIT)
+        # somewhere to hide from its own flames, but not from the bomb already there.
+        self.danger.place(Bomb((0, 2), range=2, detonates_at=30))
+        self.assertEqual(decide(self.board(), AIPlayer("ai-1", (1, 0), bomb_range=3)), AIAction.WAIT)
+
+    def testHeadsForWalls(self):
+        self.assertEqual(decide(self.board(), AIPlayer("ai-1", (0, 2))), AIAction.NORTH)
+        self.assertEqual(decide(self.board(), AIPlayer("ai-1", (1, 2))), AIAction.EAST)
+
+    def testSharedBoards(self):
+        self.danger.place(Bomb((0, 2), range=2, detonates_at=30))
+        boards = SharedBoards.create(capacity=1024)
+        try:
+            offsets = boards.write([self.board(7), self.board(8)])
+            self.assertEqual(boards.generation, 1)
+            copy = boards.read(offsets[1])
+            self.assertEqual((copy.width, copy.height, copy.tick_number), (5, 3, 8))
+            self.assertEqual(copy.tiles, bytes(self.map.tiles))
+            self.assertEqual(copy.blocked, self.board().blocked)
+            self.assertEqual(copy.explodes, self.danger.explodes)
+        finally:
+            boards.release()
+
+
+class TestAIBatcher(unittest.TestCase):
+    def requests(self):
+        generator = random.Random(0)
+        to_return = []
+        for num in range(4):
+            (game_map, free) = board((15, 13), 0.4, num)
+            danger = DangerMap(BlastEngine(game_map))
+            for position in generator.sample(free, 3):
+                danger.place(Bomb(position, 2, 50))
+            players = [AIPlayer("ai-%d" % ai, position) for (ai, position) in enumerate(generator.sample(free, 4))]
+            to_return.append(("game-%d" % num, Board.from_danger(danger, num), players))
+        return to_return
+
+    def evaluate(self, batcher):
+        try:
+            for request in self.requests():
+                batcher.add(*request)
+            return batcher.evaluate()
+        finally:
+            batcher.stop()
+
+    def testPooledDecisionsMatchInProcess(self):
+        expected = self.evaluate(AIBatcher())
+        self.assertEqual(len(expected), 4)
+        pooled = AIBatcher(workers=2, deadline=30.0)
+        self.assertEqual(self.evaluate(pooled), expected)
+        self.assertEqual((pooled.decisions, pooled.late, pooled.in_process), (16, 0, 0))
+
+    def testFailingPolicyWaits(self):
+        for batcher in (AIBatcher(policy=failing_decide), AIBatcher(workers=1, deadline=30.0, policy=failing_decide)):
+            expected = self.evaluate(AIBatcher())
+            decisions = self.evaluate(batcher)
+            self.assertEqual(decisions["game-0"], dict((player_id, AIAction.WAIT) for player_id in expected["game-0"]))
+            for num in range(1, 4):
+                self.assertEqual(decisions["game-%d" % num], expected["game-%d" % num])
+            self.assertEqual((batcher.decisions, batcher.failed), (12, 4))
+
+    def testLateDecisionsWait(self):
+        batcher = AIBatcher(workers=1, deadline=0.1, policy=slow_decide)
+        decisions = self.evaluate(batcher)
+        self.assertEqual(batcher.late, 16)
+        self.assertEqual(set(action for players in decisions.values() for action in players.values()), {AIAction.WAIT})
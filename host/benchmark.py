@@ -0,0 +1,132 @@
+"""
+Load test for running many game sessions on one host.
+
+Run with:  python -m host.benchmark [--json FILE] [options]
+"""
+import argparse
+import os
+import threading
+import time
+from common.app_logging import logging
+from common.benchmark import add_json_argument, report
+from common.messaging.messages import InputMessage
+from .scheduler import TickScheduler
+from .session import GameSession, SessionManager
+from .sharding import ShardedSessionManager
+
+
+class LoadSession(GameSession):
+    """
+    Stands in for a game's rules until there are some - each tick spins for as many seconds as its configuration
+    says.
+    """
+    def simulate(self, timestep):
+        end = time.perf_counter() + self.configuration
+        while time.perf_counter() < end:
+            pass
+
+
+class InputFeeder(object):
+    def __init__(self, sessions, session_ids, tick_rate):
+        """
+        Sends an input to every session once per tick from its own thread, the way the message bus' reactor would.
+        """
+        self.sessions = sessions
+        self.session_ids = session_ids
+        self.scheduler = TickScheduler(tick_rate)
+        self.stopping = False
+        self.thread = threading.Thread(name="input-feeder", target=self.scheduler.run, args=(self.tick, lambda: self.stopping))
+
+    def tick(self, tick_number, timestep):
+        for session_id in self.session_ids:
+            self.sessions.add_input(session_id, InputMessage("client-%s" % session_id, tick_number, session_id))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+        self.thread.join()
+
+
+def sustained(stats, tick_rate, duration):
+    """
+    Whether a scheduler kept up: it ran (nearly) every tick it should have, none were skipped, and hardly any ran
+    late.
+    """
+    return stats['ticks'] >= 0.95 * tick_rate * duration and stats['skipped_ticks'] == 0 and stats['late_ticks'] <= 0.01 * stats['ticks']
+
+
+def run_sessions(sessions, num_sessions, args):
+    """
+    Ticks the sessions the way a MultiGameHost would - on a TickScheduler on this thread, with inputs arriving from
+    another.
+
+    :return: the host scheduler's metrics, followed by each worker's if the sessions are sharded.
+    """
+    session_ids = ["session-%d" % num for num in range(num_sessions)]
+    for session_id in session_ids:
+        sessions.create(session_id, "client-%s" % session_id, args.work_us / 1e6)
+    scheduler = TickScheduler(args.tick_rate)
+    # the first tick sends sharded sessions to their workers - which spawn a fresh interpreter each, so give them a
+    # moment before the clock starts.
+    sessions.tick(0, scheduler.timestep)
+    if isinstance(sessions, ShardedSessionManager):
+        time.sleep(1.0)
+    feeder = InputFeeder(sessions, session_ids, args.tick_rate)
+    feeder.start()
+    end = time.perf_counter() + args.duration
+    scheduler.run(sessions.tick, lambda: time.perf_counter() >= end)
+    feeder.stop()
+    sessions.stop()
+    return [scheduler.metrics.summary()] + list(getattr(sessions, 'shard_stats', {}).values())
+
+
+MODES = {
+    'in-process': lambda num_sessions, args: SessionManager(num_sessions, LoadSession),
+    'sharded': lambda num_sessions, args: ShardedSessionManager(args.shards, args.tick_rate, num_sessions, LoadSession),
+}
+
+
+
+def benchmark_sessions(args):
+    results = []
+    for mode in args.modes:
+        for num_sessions in args.sessions:
+            all_stats = run_sessions(MODES[mode](num_sessions, args), num_sessions, args)
+            results.append({
+                'mode': mode,
+                'sessions': num_sessions,
+                'tick_rate': args.tick_rate,
+                'average_tick_ms': max(stats['average_tick_duration'] for stats in all_stats) * 1e3,
+                'max_tick_ms': max(stats['max_tick_duration'] for stats in all_stats) * 1e3,
+                'late_ticks': sum(stats['late_ticks'] for stats in all_stats),
+                'skipped_ticks': sum(stats['skipped_ticks'] for stats in all_stats),
+                'sustained': all(sustained(stats, args.tick_rate, args.duration) for stats in all_stats),
+            })
+    for mode in args.modes:
+        held = [result['sessions'] for result in results if result['mode'] == mode and result['sustained']]
+        results.append({'mode': mode, 'max_sustained_sessions': max(held) if held else 0})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find how many game sessions a host sustains at its tick rate.")
+    add_json_argument(parser)
+    parser.add_argument("--sessions", type=lambda value: [int(num) for num in value.split(",")], default=[50, 100, 200, 400, 800],
+                        help="Comma separated session counts.")
+    parser.add_argument("--modes", type=lambda value: value.split(","), default=sorted(MODES.keys()),
+                        help="Comma separated modes, out of: %s." % ", ".join(sorted(MODES.keys())))
+    parser.add_argument("--tick-rate", type=int, default=60)
+    parser.add_argument("--work-us", type=float, default=20.0, help="Simulated work per session per tick, in microseconds.")
+    parser.add_argument("--shards", type=int, default=os.cpu_count(), help="Worker processes in sharded mode.")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds to run each session count for.")
+    args = parser.parse_args()
+    # log output would dominate what we're trying to measure.
+    logging.getLogger().setLevel(logging.WARNING)
+    results = benchmark_sessions(args)
+    report('sessions', args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ class HostConfiguration(configuration.Configuration):
     def __init__(self, filename="host_config.ini"):
         self.address = None
         self.port = None
+        self.tick_rate = None
         super().__init__(filename)
 
     @classmethod
@@ -17,6 +18,7 @@ class DefaultHostConfiguration(configuration.BaseConfiguration):
         super().__init__()
         self.address = HostAddressOption("127.0.0.1")
         self.port = HostPortOption(40000)
+        self.tick_rate = HostTickRateOption(60)
 
 
 class HostAddressOption(configuration.InputConfigurationOption):
@@ -31,3 +33,11 @@ class HostPortOption(configuration.InputConfigurationOption):
 
     def __init__(self, value):
         super().__init__(int(value))
+
+
+class HostTickRateOption(configuration.PredefinedConfigurationOption):
+    _key = "tick_rate"
+    _options = [30, 60, 120]
+
+    def __init__(self, value):
+        super().__init__(int(value))
@@ -0,0 +1 @@
+from .blast import BlastEngine, BlastResult
@@ -0,0 +1,149 @@
+"""
+Times resolving many simultaneous bombs with the blast engine, against walking the flames cell by cell.
+
+Run with:  python -m host.game.benchmark [--json FILE] [options]
+"""
+import argparse
+import random
+import time
+from common.benchmark import add_json_argument, report
+from common.entities import Bomb
+from common.maps import Map
+from common.maps.spawns import DestructableWallSpawn, IndestructableWallSpawn
+from .blast import BlastEngine
+
+
+class NaiveBlastEngine(object):
+    """
+    Walks each flame a cell at a time, looking every cell up on the map - the straightforward way to resolve a
+    blast, kept here so the benchmark has a baseline to compare against (and to check the engine's results with).
+    """
+    def __init__(self, game_map):
+        self.map = game_map
+        self.bombs = {}
+
+    def place(self, bomb):
+        self.bombs[bomb.position] = bomb
+        return True
+
+    def detonate(self, bombs):
+        (width, height) = self.map.dimensions
+        flames = set()
+        destroyed = set()
+        detonated = []
+        worklist = [self.bombs.pop(bomb.position) for bomb in bombs]
+        while worklist:
+            bomb = worklist.pop()
+            detonated.append(bomb)
+            flames.add(bomb.position)
+            for (d_col, d_row) in [(0, -1), (1, 0), (0, 1), (-1, 0)]:
+                for distance in range(1, bomb.range + 1):
+                    cell = (bomb.position[0] + d_col * distance, bomb.position[1] + d_row * distance)
+                    if not (0 <= cell[0] < width and 0 <= cell[1] < height):
+                        break
+                    spawn = self.map.get_spawn(cell)
+                    if isinstance(spawn, IndestructableWallSpawn):
+                        break
+                    flames.add(cell)
+                    if isinstance(spawn, DestructableWallSpawn):
+                        destroyed.add(cell)
+                        break
+                    if cell in self.bombs:
+                        worklist.append(self.bombs.pop(cell))
+        for cell in destroyed:
+            self.map.add_spawn(None, cell)
+        return flames, sorted(destroyed, key=lambda cell: (cell[1], cell[0])), detonated
+
+
+ENGINES = {
+    'naive': NaiveBlastEngine,
+    'blast-engine': BlastEngine,
+}
+
+
+def board(dimensions, density, seed):
+    generator = random.Random(seed)
+    game_map = Map("benchmark", dimensions)
+    free = []
+    for row in range(dimensions[1]):
+        for col in range(dimensions[0]):
+            if col % 2 and row % 2:
+                game_map.add_spawn(IndestructableWallSpawn(), (col, row))
+            elif generator.random() < density:
+                game_map.add_spawn(DestructableWallSpawn(), (col, row))
+            else:
+                free.append((col, row))
+    return game_map, free
+
+
+def run_engine(name, dimensions, args):
+    """
+    Each round starts from a fresh board, places bombs on random free cells and sets off a few of them - the rest
+    go off if the chains reach them.
+    """
+    generator = random.Random(args.seed)
+    setup = 0.0
+    elapsed = 0.0
+    detonated = 0
+    outcomes = []
+    for num in range(args.rounds):
+        (game_map, free) = board(dimensions, args.density, args.seed + num)
+        start = time.perf_counter()
+        engine = ENGINES[name](game_map)
+        setup += time.perf_counter() - start
+        bombs = [Bomb(position, args.range) for position in generator.sample(free, min(args.bombs, len(free)))]
+        for bomb in bombs:
+            engine.place(bomb)
+
+        start = time.perf_counter()
+        result = engine.detonate(bombs[:args.triggers])
+        elapsed += time.perf_counter() - start
+        if name == 'naive':
+            (flames, destroyed, chain) = result
+        else:
+            flames = set((index % dimensions[0], index // dimensions[0]) for (index, flame) in enumerate(result.flames) if flame)
+            (destroyed, chain) = (result.destroyed, result.detonated)
+        detonated += len(chain)
+        outcomes.append((flames, destroyed, len(chain)))
+    return {
+        'engine': name,
+        'dimensions': "%dx%d" % dimensions,
+        'bombs': args.bombs,
+        'range': args.range,
+        'density': args.density,
+        'setup_ms': setup / args.rounds * 1e3,
+        'detonated_per_round': detonated / float(args.rounds),
+        'ms_per_round': elapsed / args.rounds * 1e3,
+        'us_per_bomb': elapsed / detonated * 1e6 if detonated else 0.0,
+    }, outcomes
+
+
+def benchmark_blasts(args):
+    results = []
+    for dimensions in args.dimensions:
+        (naive, expected) = run_engine('naive', dimensions, args)
+        (engine, outcomes) = run_engine('blast-engine', dimensions, args)
+        if outcomes != expected:
+            raise Exception("The blast engine and the naive engine disagree on a %dx%d board." % dimensions)
+        results.extend([naive, engine])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare blast resolution with many simultaneous bombs.")
+    add_json_argument(parser)
+    parser.add_argument("--dimensions", type=lambda value: [tuple(int(num) for num in size.split("x")) for size in value.split(",")],
+                        default=[(15, 13), (63, 63), (255, 255)], help="Comma separated board sizes, e.g. 15x13,63x63.")
+    parser.add_argument("--bombs", type=int, default=500, help="Bombs placed per round (capped by the free cells).")
+    parser.add_argument("--triggers", type=int, default=10, help="Bombs set off directly per round.")
+    parser.add_argument("--range", type=int, default=3)
+    parser.add_argument("--density", type=float, default=0.4, help="The fraction of free cells with a destructable wall.")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = benchmark_blasts(args)
+    report('blasts', args, results, precision=3)
+
+
+if __name__ == "__main__":
+    main()
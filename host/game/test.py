@@ -0,0 +1,67 @@
+import unittest
+from common.entities import Bomb
+from common.maps import Map
+from common.maps.spawns import DestructableWallSpawn, IndestructableWallSpawn
+from . import *
+
+
+class TestBlastEngine(unittest.TestCase):
+    def setUp(self):
+        # 0 1 2 3 4
+        # _ _ d _ _   row 0
+        # _ i _ i _   row 1
+        # _ _ _ _ d   row 2
+        self.map = Map(name="test", dimensions=(5, 3))
+        self.map.add_spawn(DestructableWallSpawn(), (2, 0))
+        self.map.add_spawn(IndestructableWallSpawn(), (1, 1))
+        self.map.add_spawn(IndestructableWallSpawn(), (3, 1))
+        self.map.add_spawn(DestructableWallSpawn(), (4, 2))
+        self.engine = BlastEngine(self.map)
+
+    def flames(self, result):
+        return [(index % 5, index // 5) for (index, flame) in enumerate(result.flames) if flame]
+
+    def testFlamesStopAtWalls(self):
+        bomb = Bomb((0, 0), range=3)
+        self.engine.place(bomb)
+        result = self.engine.detonate([bomb])
+        # east is stopped by (and destroys) the destructable wall, south runs to the edge of the map.
+        self.assertEqual(self.flames(result), [(0, 0), (1, 0), (2, 0), (0, 1), (0, 2)])
+        self.assertEqual(result.destroyed, [(2, 0)])
+        self.assertIsNone(self.map.get_spawn((2, 0)))
+
+    def testIndestructableWallsSurvive(self):
+        bomb = Bomb((1, 0), range=2)
+        self.engine.place(bomb)
+        result = self.engine.detonate([bomb])
+        self.assertNotIn((1, 1), self.flames(result))
+        self.assertEqual(self.map.get_spawn((1, 1)), IndestructableWallSpawn())
+
+    def testOutOfRange(self):
+        bomb = Bomb((0, 2), range=1)
+        self.engine.place(bomb)
+        result = self.engine.detonate([bomb])
+        self.assertEqual(self.flames(result), [(0, 1), (0, 2), (1, 2)])
+        self.assertEqual(result.destroyed, [])
+
+    def testChainReaction(self):
+        first = Bomb((0, 2), range=2, detonates_at=10)
+        second = Bomb((2, 2), range=2, detonates_at=100)
+        third = Bomb((2, 1), range=1, detonates_at=100)
+        for bomb in (first, second, third):
+            self.assertTrue(self.engine.place(bomb))
+        self.assertFalse(self.engine.place(Bomb((0, 2))))
+
+        result = self.engine.tick(10)
+        self.assertEqual(result.detonated, [first, second, third])
+        self.assertEqual(result.destroyed, [(2, 0), (4, 2)])
+        self.assertEqual(self.engine.bombs, {})
+
+    def testDestroyedWallsOpenTheWay(self):
+        first = Bomb((0, 0), range=4)
+        self.engine.place(first)
+        self.engine.detonate([first])
+        second = Bomb((0, 0), range=4)
+        self.engine.place(second)
+        result = self.engine.detonate([second])
+        self.assertEqual(self.flames(result), [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (0, 1), (0, 2)])
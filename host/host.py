@@ -1,20 +1,30 @@
 import logging
 import common.messaging.message_bus as message_bus
 import common.messaging.messages as messages
+import common.messaging.shared_memory as shared_memory
+import multiprocessing
+from common.event_queue import EventQueue
 import uuid as uuid_lib
 import threading
-import time
+from .ai.decisions import AIBatcher
+from .scheduler import TickScheduler
+from .session import SessionManager
+from .sharding import ShardedSessionManager
 
 class Host(object):
-    def __init__(self, bus, owner, uuid):
+    # events beyond this many waiting for the next tick are dropped, rather than letting a flood of input grow the
+    # queue without bound.
+    MAX_PENDING_EVENTS = 4096
+
+    def __init__(self, bus, owner, uuid, tick_rate=60):
         self.logger = logging.getLogger("host")
         self.shutting_down = False
         self.owner = owner
         self.uuid = uuid
         self.message_bus = bus
-        self.events_lock = threading.Lock()
-        self.events = []
+        self.events = EventQueue(self.MAX_PENDING_EVENTS)
         self.connected_clients = set()
+        self.scheduler = TickScheduler(tick_rate)
 
         self.message_bus.register_data_handler(messages.CreateGame, self.create_game)
         self.message_bus.register_data_handler(messages.Print, self.print)
@@ -22,13 +32,10 @@ class Host(object):
         self.main_thread.start()
 
     def get_events(self):
-        with self.events_lock:
-            to_return = list(self.events)
-        return to_return
+        return self.events.drain()
 
     def add_event(self, event):
-        with self.events_lock:
-            self.events.append(event)
+        return self.events.put(event)
 
     def print(self, request):
         self.logger.info("print received: %s" % request.message)
@@ -44,22 +51,124 @@ class Host(object):
     def process_event(self, event):
         pass
 
+    def simulate(self, tick_number, timestep):
+        """
+        Advances the game by one fixed timestep, after the tick's events have been processed.
+        """
+        pass
+
+    def tick(self, tick_number, timestep):
+        events = self.get_events()
+        self.scheduler.metrics.record_input_backlog(len(events))
+        for event in events:
+            self.process_event(event)
+        self.simulate(tick_number, timestep)
+
+    def tick_stats(self):
+        stats = self.scheduler.metrics.summary()
+        stats['dropped_events'] = self.events.dropped
+        return stats
+
     def run(self):
-        while not self.shutting_down:
-            events = self.get_events()
-            for event in events:
-                self.process_event(event)
-            time.sleep(.1)
-        self.logger.info("host shut down")
+        self.scheduler.run(self.tick, lambda: self.shutting_down)
+        self.logger.info("host shut down after %d ticks: %s" % (self.scheduler.metrics.ticks, self.tick_stats()))
 
 
 class LocalHost(Host):
-    def __init__(self, bus):
-        super().__init__(bus, bus.uuid, uuid_lib.uuid4())
+    def __init__(self, bus, tick_rate=60):
+        super().__init__(bus, bus.uuid, uuid_lib.uuid4(), tick_rate)
 
 
 class MultiplayerHost(Host):
-    def __init__(self, owner, host_port, uuid="host"):
-        super().__init__(message_bus.HostNetworkedMessageBus(uuid, host_port), owner, uuid)
+    def __init__(self, owner, host_port, uuid="host", tick_rate=60):
+        super().__init__(message_bus.HostNetworkedMessageBus(uuid, host_port), owner, uuid, tick_rate)
+        self.message_bus.start()
+
+
+class MultiGameHost(Host):
+    def __init__(self, owner, host_port, uuid="host", tick_rate=60, max_sessions=1024, shards=0, ai_workers=0):
+        """
+        A host for any number of independent games at once, each created by a client's CreateGame and addressed by
+        its session id.
+
+        :param max_sessions: CreateGame fails once this many games are running.
+        :param shards: if set, games are simulated by this many worker processes rather than on the host's own tick.
+        :param ai_workers: if set (and shards isn't), AI players decide in this many worker processes - given up to
+            half a tick to do so.
+        """
+        if shards:
+            self.sessions = ShardedSessionManager(shards, tick_rate, max_sessions)
+        else:
+            self.sessions = SessionManager(max_sessions, ai=AIBatcher(ai_workers, deadline=0.5 / tick_rate))
+        super().__init__(message_bus.HostNetworkedMessageBus(uuid, host_port), owner, uuid, tick_rate)
+        self.message_bus.register_data_handler(messages.InputMessage, self.route_input)
+        self.message_bus.register_data_handler(messages.SnapshotAck, self.acknowledge_snapshot)
         self.message_bus.start()
 
+    def create_game(self, request):
+        # raising here fails the request - e.g. when the session id is taken, or the host is full.
+        self.sessions.create(request.session_id, request.client_id, request.configuration)
+
+    def route_input(self, message):
+        self.sessions.add_input(message.session_id, message)
+
+    def acknowledge_snapshot(self, message):
+        self.sessions.acknowledge(message.session_id, message.client_id, message.tick)
+
+    def simulate(self, tick_number, timestep):
+        for (client_id, message) in self.sessions.tick(tick_number, timestep):
+            try:
+                self.message_bus.send_to_client(message, client_id)
+            except message_bus.ClientNotFoundException:
+                # the client has gone away - its game carries on without it.
+                pass
+
+    def stop(self):
+        super().stop()
+        self.sessions.stop()
+
+
+class SharedMemoryHost(object):
+    def __init__(self, owner, uuid="host", capacity=4 * 1024 * 1024, tick_rate=60):
+        """
+        Runs a Host in a separate process, connected to this one through a pair of shared memory rings - so the
+        host's simulation and the client's rendering each get a core, without going through the network stack.
+
+        This object lives in the client's process: message_bus is the client's end of the connection, and stop
+        shuts the host process down.
+
+        :param tick_rate: the host's tick rate.
+        """
+        self.logger = logging.getLogger("shared-memory-host")
+        self.to_host = shared_memory.SharedRing.create(capacity)
+        self.to_client = shared_memory.SharedRing.create(capacity)
+        self.message_bus = shared_memory.SharedMemoryMessageBus(owner, self.to_host, self.to_client)
+        # forking a process that's running threads (and a window) isn't safe - start the host from scratch instead.
+        context = multiprocessing.get_context("spawn")
+        self.process = context.Process(name="host", target=run_shared_memory_host, args=(owner, uuid, self.to_host.handle(), self.to_client.handle(), tick_rate))
+        self.process.start()
+
+    def stop(self, timeout=5.0):
+        self.message_bus.stop()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.logger.warning("host process didn't exit - terminating it")
+            self.process.terminate()
+            self.process.join()
+        self.to_host.release()
+        self.to_client.release()
+
+
+def run_shared_memory_host(owner, uuid, to_host, to_client, tick_rate=60):
+    """
+    The host process' entry point - runs a Host until the client closes its end of the connection.
+    """
+    to_host = shared_memory.SharedRing.attach(*to_host)
+    to_client = shared_memory.SharedRing.attach(*to_client)
+    bus = shared_memory.SharedMemoryMessageBus(uuid, to_client, to_host)
+    host = Host(bus, owner, uuid, tick_rate)
+    bus.start()
+    bus.join()
+    host.stop()
+    to_host.release()
+    to_client.release()
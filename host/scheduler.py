@@ -0,0 +1,101 @@
+import time
+
+
+class TickMetrics(object):
+    def __init__(self):
+        self.ticks = 0
+        # ticks that took longer than the timestep to run.
+        self.overruns = 0
+        # ticks that started more than a timestep after they were due.
+        self.late_ticks = 0
+        # ticks that were never run, because we fell further behind than the scheduler is willing to catch up.
+        self.skipped_ticks = 0
+        self.last_tick_duration = 0.0
+        self.max_tick_duration = 0.0
+        self.total_tick_duration = 0.0
+        self.input_backlog = 0
+        self.max_input_backlog = 0
+
+    def record_tick(self, duration, timestep, late):
+        self.ticks += 1
+        self.last_tick_duration = duration
+        self.max_tick_duration = max(self.max_tick_duration, duration)
+        self.total_tick_duration += duration
+        if duration > timestep:
+            self.overruns += 1
+        if late:
+            self.late_ticks += 1
+
+    def record_input_backlog(self, backlog):
+        """
+        :param backlog: the number of inputs waiting to be processed at the start of a tick.
+        """
+        self.input_backlog = backlog
+        self.max_input_backlog = max(self.max_input_backlog, backlog)
+
+    def summary(self):
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'late_ticks': self.late_ticks,
+            'skipped_ticks': self.skipped_ticks,
+            'average_tick_duration': self.total_tick_duration / self.ticks if self.ticks else 0.0,
+            'max_tick_duration': self.max_tick_duration,
+            'input_backlog': self.input_backlog,
+            'max_input_backlog': self.max_input_backlog,
+        }
+
+
+class TickScheduler(object):
+    def __init__(self, tick_rate=60, max_catch_up=5, clock=time.perf_counter, sleep=time.sleep):
+        """
+        Runs a simulation at a fixed timestep.
+
+        Elapsed wall time is added to an accumulator, and a tick is run for every whole timestep in it - so the
+        simulation advances at the same rate no matter how long each tick or each sleep actually took.  When a tick
+        runs long, the ticks that follow run back to back until the simulation has caught up, up to max_catch_up
+        ticks at a time - beyond that the backlog is dropped, rather than spiralling ever further behind.
+
+        :param tick_rate: ticks per second.
+        :param max_catch_up: the most ticks run back to back before the backlog is dropped.
+        :param clock: returns the current time in seconds - time.perf_counter for its resolution.
+        :param sleep: sleeps for the given number of seconds.
+        """
+        self.tick_rate = tick_rate
+        self.timestep = 1.0 / tick_rate
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.sleep = sleep
+        self.tick_number = 0
+        self.metrics = TickMetrics()
+
+    def run(self, tick, should_stop):
+        """
+        Calls tick(tick_number, timestep) at the tick rate until should_stop returns True.
+        """
+        accumulator = 0.0
+        previous = self.clock()
+        while not should_stop():
+            now = self.clock()
+            accumulator += now - previous
+            previous = now
+
+            steps = 0
+            while accumulator >= self.timestep and steps < self.max_catch_up:
+                late = accumulator >= 2 * self.timestep
+                start = self.clock()
+                tick(self.tick_number, self.timestep)
+                self.metrics.record_tick(self.clock() - start, self.timestep, late)
+                self.tick_number += 1
+                accumulator -= self.timestep
+                steps += 1
+
+            if accumulator >= self.timestep:
+                skipped = int(accumulator / self.timestep)
+                self.metrics.skipped_ticks += skipped
+                accumulator -= skipped * self.timestep
+
+            # whatever the ticks took has already been counted against the next one - only sleep for what's left.
+            remaining = self.timestep - accumulator - (self.clock() - previous)
+            if remaining > 0:
+                self.sleep(remaining)
@@ -0,0 +1,165 @@
+import logging
+import threading
+from common.event_queue import EventQueue
+from common.snapshots import Snapshot, SnapshotEncoder
+from .ai.decisions import AIBatcher
+
+
+class GameSession(object):
+    # inputs beyond this many waiting for the session's next tick are dropped.
+    MAX_PENDING_INPUTS = 1024
+
+    def __init__(self, session_id, owner, configuration):
+        """
+        A single game, advanced one fixed timestep at a time by whoever schedules it.
+
+        :param session_id: unique within a host.
+        :param owner: the client id of whoever created the game.
+        :param configuration: the game's GameConfiguration.
+        """
+        self.session_id = session_id
+        self.owner = owner
+        self.configuration = configuration
+        self.clients = {owner}
+        self.inputs = EventQueue(self.MAX_PENDING_INPUTS)
+        self.snapshots = SnapshotEncoder(session_id)
+        self.tick_number = 0
+
+    def add_input(self, message):
+        """
+        Can be called from any thread - the input is processed at the start of the session's next tick.
+        """
+        return self.inputs.put(message)
+
+    def acknowledge(self, client_id, tick):
+        self.snapshots.acknowledge(client_id, tick)
+
+    def tick(self, timestep, decisions=None):
+        """
+        :param decisions: the session's AI players' decisions for the tick, as a dictionary of player id to
+            AIAction.
+        :return: a list of (client id, StateSnapshot) tuples, for the tick's state to be sent to each client.
+        """
+        for message in self.inputs.drain():
+            self.process_input(message)
+        if decisions:
+            self.process_decisions(decisions)
+        self.simulate(timestep)
+        outgoing = self.snapshots.encode(Snapshot(self.tick_number, self.state()), self.clients)
+        self.tick_number += 1
+        return outgoing
+
+    def process_input(self, message):
+        pass
+
+    def ai_request(self):
+        """
+        :return: a (Board, list of AIPlayer) tuple, for the session's AI players to decide what to do this tick - or
+            None if it has none.
+        """
+        return None
+
+    def process_decisions(self, decisions):
+        pass
+
+    def simulate(self, timestep):
+        pass
+
+    def state(self):
+        """
+        :return: the game's entities, as a dictionary of entity id to a dictionary of field to value.  Unchanged
+            entities should keep the same dictionary from one tick to the next, so diffing skips them outright.
+        """
+        return {}
+
+
+class SessionManager(object):
+    def __init__(self, max_sessions=1024, session_class=GameSession, ai=None):
+        """
+        Keeps a host's game sessions, and ticks every one of them on the host's tick.
+
+        :param max_sessions: create refuses sessions beyond this many.
+        :param session_class: the GameSession (sub)class to create.
+        :param ai: the AIBatcher that decides for every session's AI players at once, each tick - by default, one
+            that decides in this process.
+        """
+        self.logger = logging.getLogger("session-manager")
+        self.max_sessions = max_sessions
+        self.session_class = session_class
+        self.ai = ai or AIBatcher()
+        self.lock = threading.Lock()
+        self.sessions = {}
+        # the ids of the sessions the last tick removed for failing.
+        self.failed = set()
+
+    def create(self, session_id, owner, configuration):
+        with self.lock:
+            if session_id in self.sessions:
+                raise SessionException("Session %s already exists." % session_id)
+            if len(self.sessions) >= self.max_sessions:
+                raise SessionException("Host is full (%d sessions)." % self.max_sessions)
+            session = self.session_class(session_id, owner, configuration)
+            self.sessions[session_id] = session
+        self.logger.debug("created session %s for %s" % (session_id, owner))
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            if session_id not in self.sessions:
+                raise SessionException("Session %s doesn't exist." % session_id)
+            return self.sessions[session_id]
+
+    def remove(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def add_input(self, session_id, message):
+        return self.get(session_id).add_input(message)
+
+    def acknowledge(self, session_id, client_id, tick):
+        self.get(session_id).acknowledge(client_id, tick)
+
+    def tick(self, tick_number, timestep):
+        """
+        :return: a list of (client id, message) tuples to send.
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+        failed = set()
+        for session in sessions:
+            try:
+                request = session.ai_request()
+                if request is not None:
+                    self.ai.add(session.session_id, *request)
+            except Exception as e:
+                self.logger.exception("Session %s failed, removing it: %s" % (session.session_id, str(e)))
+                failed.add(session.session_id)
+                self.remove(session.session_id)
+        decisions = self.ai.evaluate()
+
+        outgoing = []
+        for session in sessions:
+            if session.session_id in failed:
+                continue
+            try:
+                outgoing.extend(session.tick(timestep, decisions.get(session.session_id)))
+            except Exception as e:
+                # one broken game shouldn't take down every other game on the host.
+                self.logger.exception("Session %s failed, removing it: %s" % (session.session_id, str(e)))
+                failed.add(session.session_id)
+                self.remove(session.session_id)
+        self.failed = failed
+        return outgoing
+
+    def stop(self):
+        with self.lock:
+            self.sessions = {}
+        self.ai.stop()
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class SessionException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
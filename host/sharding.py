@@ -0,0 +1,205 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from common.event_queue import EventQueue
+from .scheduler import TickScheduler
+from .session import GameSession, SessionException, SessionManager
+
+
+class ShardedSessionManager(object):
+    def __init__(self, shards, tick_rate=60, max_sessions=1024, session_class=GameSession):
+        """
+        A drop-in replacement for SessionManager that spreads sessions over worker processes, so that a host can
+        simulate on every core rather than just the one its GIL allows.
+
+        Each worker ticks its own sessions on its own TickScheduler.  This process keeps track of which worker owns
+        which session, puts new sessions on whichever worker has the fewest, and forwards each input to its
+        session's worker.  Forwarding is batched: commands for a worker are queued up here, and sent as a single
+        message per worker when tick is called - pickling and queueing each input on its own costs more than most
+        sessions spend simulating.  Workers report the sessions they removed for failing along with their messages,
+        and tick forgets about them here too.
+
+        :param shards: the number of worker processes.
+        :param tick_rate: the workers' tick rate.
+        :param max_sessions: create refuses sessions beyond this many, across every worker.
+        :param session_class: the GameSession (sub)class the workers create - it has to be importable, since
+            workers are spawned rather than forked.
+        """
+        self.logger = logging.getLogger("sharded-session-manager")
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        self.sessions = {}
+        # the workers start from scratch, rather than forking a process that's running threads.
+        context = multiprocessing.get_context("spawn")
+        self.results = context.Queue()
+        self.outbound = context.Queue()
+        self.shards = [SessionShard(index, context, tick_rate, session_class, self.outbound, self.results) for index in range(shards)]
+        self.shard_stats = {}
+
+    def create(self, session_id, owner, configuration):
+        with self.lock:
+            if session_id in self.sessions:
+                raise SessionException("Session %s already exists." % session_id)
+            if len(self.sessions) >= self.max_sessions:
+                raise SessionException("Host is full (%d sessions)." % self.max_sessions)
+            shard = min(self.shards, key=lambda candidate: candidate.sessions)
+            shard.sessions += 1
+            self.sessions[session_id] = shard
+        shard.pending.put(("create", session_id, owner, configuration))
+        self.logger.debug("created session %s for %s on shard %d" % (session_id, owner, shard.index))
+
+    def remove(self, session_id):
+        with self.lock:
+            shard = self.sessions.pop(session_id, None)
+            if shard is None:
+                return
+            shard.sessions -= 1
+        shard.pending.put(("remove", session_id))
+
+    def add_input(self, session_id, message):
+        with self.lock:
+            if session_id not in self.sessions:
+                raise SessionException("Session %s doesn't exist." % session_id)
+            shard = self.sessions[session_id]
+        return shard.pending.put(("input", session_id, message))
+
+    def acknowledge(self, session_id, client_id, tick):
+        with self.lock:
+            if session_id not in self.sessions:
+                raise SessionException("Session %s doesn't exist." % session_id)
+            shard = self.sessions[session_id]
+        shard.pending.put(("acknowledge", session_id, client_id, tick))
+
+    def tick(self, tick_number, timestep):
+        """
+        Sends each worker the commands queued for it since the last tick - the workers tick their own sessions.
+
+        :return: a list of (client id, message) tuples to send, from every worker tick that finished since the
+            last call.
+        """
+        for shard in self.shards:
+            shard.flush()
+        outgoing = []
+        while True:
+            try:
+                (index, messages, failed) = self.outbound.get_nowait()
+            except queue.Empty:
+                return outgoing
+            outgoing.extend(messages)
+            for session_id in failed:
+                self.forget(session_id, self.shards[index])
+
+    def forget(self, session_id, shard):
+        """
+        Drops a session its worker has already removed - unless the id has since been given to a new session.
+        """
+        with self.lock:
+            if self.sessions.get(session_id) is not shard:
+                return
+            self.sessions.pop(session_id)
+            shard.sessions -= 1
+        self.logger.debug("session %s failed on shard %d" % (session_id, shard.index))
+
+    def stop(self, timeout=5.0):
+        """
+        Stops every worker, and collects their tick metrics into shard_stats.
+        """
+        for shard in self.shards:
+            shard.pending.put(("stop", ))
+            shard.flush()
+        for _ in self.shards:
+            try:
+                (index, stats) = self.results.get(timeout=timeout)
+            except queue.Empty:
+                break
+            self.shard_stats[index] = stats
+        for shard in self.shards:
+            shard.join(timeout)
+        with self.lock:
+            self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class SessionShard(object):
+    def __init__(self, index, context, tick_rate, session_class, outbound, results):
+        """
+        This process' handle on a single worker process.
+        """
+        self.logger = logging.getLogger("session-shard-%d" % index)
+        self.index = index
+        self.sessions = 0
+        self.commands = context.Queue()
+        self.process = context.Process(name="session-shard-%d" % index, target=run_session_shard,
+                                       args=(index, tick_rate, session_class, self.commands, outbound, results, logging.getLogger().level))
+        self.process.start()
+        self.pending = EventQueue()
+
+    def flush(self):
+        commands = self.pending.drain()
+        if commands:
+            self.commands.put(commands)
+
+    def join(self, timeout):
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.logger.warning("session shard didn't exit - terminating it")
+            self.process.terminate()
+            self.process.join()
+
+
+class SessionShardWorker(object):
+    def __init__(self, index, tick_rate, session_class, commands, outbound):
+        self.logger = logging.getLogger("session-shard-%d" % index)
+        self.index = index
+        self.commands = commands
+        self.outbound = outbound
+        self.sessions = SessionManager(max_sessions=float("inf"), session_class=session_class)
+        self.scheduler = TickScheduler(tick_rate)
+        self.stopping = False
+
+    def run(self):
+        self.scheduler.run(self.tick, lambda: self.stopping)
+        # nobody reads what's still queued for sending once the manager is stopping - don't wait on it to exit.
+        self.outbound.cancel_join_thread()
+        stats = self.scheduler.metrics.summary()
+        stats['sessions'] = len(self.sessions)
+        return stats
+
+    def tick(self, tick_number, timestep):
+        while True:
+            try:
+                commands = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            for command in commands:
+                self.process_command(command)
+        outgoing = self.sessions.tick(tick_number, timestep)
+        if outgoing or self.sessions.failed:
+            self.outbound.put((self.index, outgoing, list(self.sessions.failed)))
+
+    def process_command(self, command):
+        try:
+            if command[0] == "create":
+                self.sessions.create(*command[1:])
+            elif command[0] == "acknowledge":
+                self.sessions.acknowledge(*command[1:])
+            elif command[0] == "remove":
+                self.sessions.remove(command[1])
+            elif command[0] == "input":
+                self.sessions.add_input(command[1], command[2])
+            elif command[0] == "stop":
+                self.stopping = True
+        except SessionException as e:
+            self.logger.error(str(e))
+
+
+def run_session_shard(index, tick_rate, session_class, commands, outbound, results, log_level):
+    """
+    A worker process' entry point - ticks its sessions until told to stop, then reports its tick metrics.
+    """
+    logging.getLogger().setLevel(log_level)
+    worker = SessionShardWorker(index, tick_rate, session_class, commands, outbound)
+    results.put((index, worker.run()))
@@ -0,0 +1,218 @@
+import time
+import unittest
+from common.maps import Map
+from common.messaging.message_bus import ClientNetworkedMessageBus
+from common.messaging.messages import CreateGame, InputMessage, SnapshotAck, StateSnapshot
+from .ai import AIAction, AIPlayer, Board, DangerMap
+from .game import BlastEngine
+from .host import MultiGameHost, MultiplayerHost
+from .scheduler import TickScheduler
+from .session import GameSession, SessionException, SessionManager
+from .sharding import ShardedSessionManager
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTickScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ticks = []
+
+    def run_for(self, scheduler, ticks, durations=None):
+        """
+        Runs scheduler until it has ticked the given number of times - durations maps a tick number to how long
+        that tick takes.
+        """
+        durations = durations or {}
+
+        def tick(tick_number, timestep):
+            self.ticks.append((tick_number, self.clock.now))
+            self.clock.now += durations.get(tick_number, 0.0)
+        scheduler.run(tick, lambda: len(self.ticks) >= ticks)
+
+    def testTicksAtFixedRate(self):
+        # timesteps of 1/64 keep the fake clock exact.
+        scheduler = TickScheduler(64, clock=self.clock, sleep=self.clock.sleep)
+        self.run_for(scheduler, 64)
+        self.assertEqual([tick_number for (tick_number, _) in self.ticks], list(range(64)))
+        self.assertEqual(self.ticks[-1][1], 1.0)
+        self.assertEqual(scheduler.metrics.overruns, 0)
+        self.assertEqual(scheduler.metrics.late_ticks, 0)
+
+    def testSlowTicksAreCaughtUp(self):
+        scheduler = TickScheduler(64, clock=self.clock, sleep=self.clock.sleep)
+        # tick 2 takes three timesteps - the next three run back to back (two of them late), and the rest run on
+        # schedule.
+        self.run_for(scheduler, 10, {2: 3 / 64.0})
+        self.assertEqual(scheduler.metrics.overruns, 1)
+        self.assertEqual(scheduler.metrics.late_ticks, 2)
+        self.assertEqual(scheduler.metrics.skipped_ticks, 0)
+        self.assertEqual([time for (_, time) in self.ticks[3:6]], [6 / 64.0] * 3)
+        self.assertEqual(self.ticks[-1][1], 10 / 64.0)
+
+    def testBacklogBeyondCatchUpIsSkipped(self):
+        scheduler = TickScheduler(64, max_catch_up=2, clock=self.clock, sleep=self.clock.sleep)
+        self.run_for(scheduler, 5, {0: 10 / 64.0})
+        self.assertEqual(scheduler.metrics.late_ticks, 2)
+        self.assertEqual(scheduler.metrics.skipped_ticks, 8)
+
+    def testInputBacklog(self):
+        scheduler = TickScheduler(60, clock=self.clock, sleep=self.clock.sleep)
+        scheduler.metrics.record_input_backlog(5)
+        scheduler.metrics.record_input_backlog(2)
+        summary = scheduler.metrics.summary()
+        self.assertEqual(summary['input_backlog'], 2)
+        self.assertEqual(summary['max_input_backlog'], 5)
+
+
+class FailingSession(GameSession):
+    def simulate(self, timestep):
+        raise ValueError("broken")
+
+
+class RecordingSession(GameSession):
+    def process_input(self, message):
+        self.configuration.append((self.tick_number, message.inputs))
+
+
+class AISession(GameSession):
+    def __init__(self, session_id, owner, configuration):
+        super().__init__(session_id, owner, configuration)
+        self.danger = DangerMap(BlastEngine(Map(name=session_id, dimensions=(3, 1))))
+
+    def ai_request(self):
+        return Board.from_danger(self.danger, self.tick_number), [AIPlayer("ai-1", (0, 0))]
+
+    def process_decisions(self, decisions):
+        self.configuration.append((self.tick_number, decisions))
+
+
+class TestSessionManager(unittest.TestCase):
+    def testCreate(self):
+        sessions = SessionManager(max_sessions=2)
+        sessions.create("game-1", "client-1", None)
+        with self.assertRaises(SessionException):
+            sessions.create("game-1", "client-2", None)
+        sessions.create("game-2", "client-2", None)
+        with self.assertRaises(SessionException):
+            sessions.create("game-3", "client-3", None)
+        sessions.remove("game-1")
+        sessions.create("game-3", "client-3", None)
+        self.assertEqual(len(sessions), 2)
+
+    def testInputsAreProcessedOnTheNextTick(self):
+        sessions = SessionManager(session_class=RecordingSession)
+        received = []
+        sessions.create("game-1", "client-1", received)
+        sessions.add_input("game-1", InputMessage("client-1", "left", "game-1"))
+        sessions.tick(0, 1 / 60.0)
+        sessions.tick(1, 1 / 60.0)
+        sessions.add_input("game-1", InputMessage("client-1", "bomb", "game-1"))
+        sessions.tick(2, 1 / 60.0)
+        self.assertEqual(received, [(0, "left"), (2, "bomb")])
+        with self.assertRaises(SessionException):
+            sessions.add_input("game-2", InputMessage("client-1", "left", "game-2"))
+
+    def testAIDecisionsAreProcessedOnTheirTick(self):
+        sessions = SessionManager(session_class=AISession)
+        received = []
+        sessions.create("game-1", "client-1", received)
+        sessions.tick(0, 1 / 60.0)
+        sessions.tick(1, 1 / 60.0)
+        # nothing to bomb, and nowhere to go.
+        self.assertEqual(received, [(0, {"ai-1": AIAction.WAIT}), (1, {"ai-1": AIAction.WAIT})])
+        sessions.stop()
+
+    def testFailingSessionIsRemoved(self):
+        sessions = SessionManager(session_class=FailingSession)
+        sessions.create("game-1", "client-1", None)
+        sessions.tick(0, 1 / 60.0)
+        self.assertEqual(len(sessions), 0)
+        self.assertEqual(sessions.failed, {"game-1"})
+
+
+class TestShardedSessionManager(unittest.TestCase):
+    def testSessionsAreSpreadOverShards(self):
+        sessions = ShardedSessionManager(2, tick_rate=30, max_sessions=3)
+        for num in range(3):
+            sessions.create("game-%d" % num, "client-%d" % num, None)
+        with self.assertRaises(SessionException):
+            sessions.create("game-3", "client-3", None)
+        sessions.add_input("game-0", InputMessage("client-0", "left", "game-0"))
+        sessions.tick(0, 1 / 30.0)
+        sessions.stop()
+        self.assertEqual(sorted(stats['sessions'] for stats in sessions.shard_stats.values()), [1, 2])
+
+    def testFailedSessionsAreForgotten(self):
+        sessions = ShardedSessionManager(1, tick_rate=30, max_sessions=1, session_class=FailingSession)
+        try:
+            sessions.create("game-0", "client-0", None)
+            sessions.tick(0, 1 / 30.0)
+            self.assertTrue(wait_until(lambda: sessions.tick(0, 1 / 30.0) == [] and len(sessions) == 0))
+            self.assertEqual(sessions.shards[0].sessions, 0)
+            with self.assertRaises(SessionException):
+                sessions.add_input("game-0", InputMessage("client-0", "left", "game-0"))
+            # the failed session no longer counts towards the limit.
+            sessions.create("game-1", "client-1", None)
+        finally:
+            sessions.stop()
+
+
+class TestMultiplayerHost(unittest.TestCase):
+    def testTickRate(self):
+        host = MultiplayerHost("owner", 40011, tick_rate=120)
+        try:
+            self.assertEqual(host.scheduler.timestep, 1 / 120.0)
+        finally:
+            host.stop()
+
+
+class TestMultiGameHost(unittest.TestCase):
+    def setUp(self):
+        self.host = MultiGameHost("owner", 40010)
+        self.client = ClientNetworkedMessageBus("client-1")
+        self.snapshots = []
+        self.client.register_data_handler(StateSnapshot, self.snapshots.append)
+        self.client.start(self.host.message_bus.listener_address)
+
+    def tearDown(self):
+        self.client.stop()
+        self.host.stop()
+
+    def testCreateGame(self):
+        create_game = CreateGame("client-1", None)
+        request = self.client.send(create_game)
+        self.assertEqual(request.failures(), {})
+        self.assertEqual(len(self.host.sessions), 1)
+        self.client.send(InputMessage("client-1", "left", create_game.session_id))
+
+        # a session id can't be reused while its game is running.
+        request = self.client.send(CreateGame("client-1", None, create_game.session_id))
+        self.assertEqual(len(request.failures()), 1)
+
+    def testSnapshotsAreDeltasOnceAcknowledged(self):
+        create_game = CreateGame("client-1", None)
+        self.client.send(create_game)
+        self.assertTrue(wait_until(lambda: len(self.snapshots) > 0))
+        self.assertFalse(self.snapshots[0].delta)
+        self.client.send(SnapshotAck(create_game.session_id, "client-1", self.snapshots[0].tick))
+        self.assertTrue(wait_until(lambda: self.snapshots[-1].delta))
+        self.assertEqual(self.snapshots[-1].entities, {})
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True